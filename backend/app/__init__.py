@@ -1,20 +1,30 @@
-from flask import Flask
+from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
 import os
-import logging
-from .models import db
+import click
+from .models import db, MedicalRecord
+from .backup import backup_cli
+from .snapshots import snapshot_cli
+from .upload_gc import upload_gc_cli
+from .bulk_io import FORMATS, IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE, Checkpoint, export_chunks, import_stream, parse_format
+from .ratelimit_storage import default_strategy, ratelimit_storage_uri
+from .metrics import init_metrics
+from .compression import init_compression
+from .db_profiles import configure_engine, init_engine_hooks
+from .startup import LazyMigrate
+from .utils import validate_api_key
+from .logs import configure_logging
 
 def create_app():
     app = Flask(__name__, 
                 static_folder='../frontend/static', 
                 template_folder='../frontend/templates')
     
-    # Configure logging
-    app.logger.setLevel(logging.INFO)
+    # Configure logging (cola con hilo escritor; LOG_LEVEL, LOG_FORMAT y LOG_SAMPLING)
+    configure_logging(app)
     
     # Load configuration from environment variables
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///motosegura.db')
@@ -27,22 +37,127 @@ def create_app():
     # Directorio de aplicación para acceso web
     app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
     
+    # Delegar el envío de uploads al servidor web: 'x-accel' (nginx) o 'x-sendfile'
+    app.config['UPLOAD_OFFLOAD'] = os.getenv('UPLOAD_OFFLOAD', '')
+    app.config['UPLOAD_ACCEL_PREFIX'] = os.getenv('UPLOAD_ACCEL_PREFIX', '/_protected_uploads')
+    
+    # Instantáneas estáticas de los registros (SNAPSHOT_FOLDER) y si /record/<id> las sirve directamente
+    app.config['SNAPSHOT_SERVE_SCANS'] = os.getenv('SNAPSHOT_SERVE_SCANS', 'false').lower() in ('1', 'true', 'yes')
+    
     app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB
     
+    # Perfil del motor según la URL (DB_ENGINE_PROFILE): WAL en SQLite, pool dimensionado en PostgreSQL
+    configure_engine(app)
+    
     # Initialize extensions
     db.init_app(app)
-    migrate = Migrate(app, db)
+    init_engine_hooks(app, db)
+    # alembic sólo se importa al usar `flask db`; backend/migrations es de debug_app
+    migrate = LazyMigrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
     
     # Configurar CORS para permitir solicitudes desde cualquier origen
     CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
     
-    # Initialize rate limiter
+    # Initialize rate limiter (RATELIMIT_ENABLED=false lo desactiva, p. ej. en los benchmarks)
+    app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false'
     limiter = Limiter(
         app=app,
         key_func=get_remote_address,
-        default_limits=[os.getenv('RATELIMIT_DEFAULT', "200 per day"), "50 per hour"]
+        default_limits=[os.getenv('RATELIMIT_DEFAULT', "200 per day"), "50 per hour"],
+        # Contadores compartidos entre los workers de gunicorn (Redis o SQLite)
+        storage_uri=ratelimit_storage_uri(),
+        strategy=os.getenv('RATELIMIT_STRATEGY', default_strategy())
     )
     
+    # Métricas Prometheus en /metrics (agregadas entre los workers de gunicorn; con la API key o METRICS_TOKEN)
+    init_metrics(app, limiter, authorize=lambda: validate_api_key(request.headers.get('X-API-Key')))
+    
+    # Compresión gzip/brotli de las respuestas grandes; las que llevan ETag se comprimen una sola vez
+    init_compression(app)
+    
+    # Register blueprints
+    from .routes import main
+    app.register_blueprint(main)
+    # Las instantáneas de emergencia son archivos estáticos: sin límite de peticiones
+    limiter.exempt(app.view_functions['main.snapshot_file'])
+    
+    # Register error handlers
+    @app.errorhandler(404)
+    def not_found(error):
+        return {'error': 'Not found'}, 404
+    
+    @app.errorhandler(500)
+    def server_error(error):
+        return {'error': 'Internal server error'}, 500
+    
+    # Esquema, carpetas e imagen por defecto: una sola vez con `flask init`, no en cada worker
+    @app.cli.command('init')
+    def init_command():
+        """Crea las tablas, las carpetas de uploads y la imagen de perfil por defecto."""
+        init_app_data(app)
+    
+    # `flask snapshots build` (SNAPSHOT_FOLDER)
+    from .routes import record_snapshots
+    app.cli.add_command(snapshot_cli(record_snapshots))
+    
+    # `flask backup create|list|restore-record|restore|prune` (BACKUP_DIR)
+    def backup_folders():
+        from .utils import get_persistent_upload_folder
+        return {'persistent': get_persistent_upload_folder(), 'uploads': app.config['UPLOAD_FOLDER']}
+    
+    def record_restored(record_id):
+        from .routes import mark_record_restored
+        mark_record_restored(record_id)
+    
+    app.cli.add_command(backup_cli(db, MedicalRecord.__table__, backup_folders, image_column='profile_image',
+                                   after_restore=record_restored))
+    
+    # `flask uploads gc`: imágenes huérfanas y enlaces rotos
+    app.cli.add_command(upload_gc_cli(db, MedicalRecord.id, MedicalRecord.profile_image, backup_folders))
+    
+    @app.cli.command('export-records')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Por defecto, según la extensión de --output')
+    @click.option('--output', '-o', type=click.File('wb'), default='-')
+    def export_records_command(fmt, output):
+        """Exporta todos los registros en CSV o NDJSON, en streaming."""
+        from .routes import RECORD_EXPORT_FIELDS, export_records
+        for chunk in export_chunks(export_records(), RECORD_EXPORT_FIELDS, parse_format(fmt, output.name)):
+            output.write(chunk)
+    
+    @app.cli.command('import-records')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Por defecto, según la extensión')
+    @click.option('--batch-size', type=click.IntRange(1, MAX_IMPORT_BATCH_SIZE), default=IMPORT_BATCH_SIZE)
+    @click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+                  help='Archivo de progreso (por defecto, <archivo>.checkpoint)')
+    def import_records_command(source, fmt, batch_size, checkpoint):
+        """
+        Importa registros desde un archivo CSV o NDJSON (o - para la entrada estándar).
+        
+        Tras cada lote se guarda el progreso; si se interrumpe, volver a
+        ejecutar el mismo comando continúa desde el último lote confirmado.
+        """
+        from .routes import prepare_imported_record, write_imported_records
+        if checkpoint is None and source.name != '<stdin>':
+            checkpoint = f"{source.name}.checkpoint"
+        progress = Checkpoint(checkpoint, os.path.abspath(source.name))
+        start = progress.load().rows
+        if start:
+            click.echo(f"Reanudando tras la fila {start} ({checkpoint})", err=True)
+        result = import_stream(source, parse_format(fmt, source.name), prepare_imported_record,
+                               write_imported_records, batch_size, progress)
+        for error in result.errors:
+            click.echo(f"Fila {error['row']}: {error['error']}", err=True)
+        click.echo(f"{result.rows} filas: {result.inserted} insertadas, {result.skipped} ya existían, "
+                   f"{result.invalid} no válidas")
+    
+    return app
+
+# Revisión de app/migrations con el esquema anterior a las migraciones
+INITIAL_SCHEMA_REVISION = '8ec8dd5b8e1b'
+
+def init_app_data(app):
+    """Inicialización única del despliegue (la ejecuta `flask init` antes de arrancar gunicorn)"""
     # Create upload folders if they don't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['PERSISTENT_UPLOAD_FOLDER'], exist_ok=True)
@@ -65,25 +180,21 @@ def create_app():
         except Exception as e:
             app.logger.warning(f"Could not create default profile image: {str(e)}")
     
-    # Register blueprints
-    from .routes import main
-    app.register_blueprint(main)
-    
-    # Register error handlers
-    @app.errorhandler(404)
-    def not_found(error):
-        return {'error': 'Not found'}, 404
-    
-    @app.errorhandler(500)
-    def server_error(error):
-        return {'error': 'Internal server error'}, 500
-    
-    # Create tables if they don't exist
+    # Create tables if they don't exist (o aplicar las migraciones pendientes de app/migrations)
     with app.app_context():
         try:
-            db.create_all()
+            from flask_migrate import stamp, upgrade
+            app.extensions['lazy_migrate'].load()
+            tables = set(db.inspect(db.engine).get_table_names())
+            if 'alembic_version' in tables:
+                upgrade()
+            elif MedicalRecord.__tablename__ in tables:
+                # Base de datos anterior a las migraciones: marcarla con el esquema inicial y actualizarla
+                stamp(revision=INITIAL_SCHEMA_REVISION)
+                upgrade()
+            else:
+                db.create_all()
+                stamp()
             app.logger.info("Database tables created successfully")
         except Exception as e:
             app.logger.error(f"Error creating database tables: {str(e)}")
-    
-    return app
\ No newline at end of file
@@ -0,0 +1,529 @@
+"""
+Copias de seguridad incrementales de la base de datos y de los uploads.
+
+El almacén (`BACKUP_DIR`) guarda cada contenido una sola vez, por su
+SHA-256, y un manifiesto por copia::
+
+    blobs/ab/abcdef...      contenido (un archivo subido, una copia de la base de datos)
+    manifests/<id>.json     {base de datos: blob, uploads: {ruta: [blob, tamaño, mtime]}}
+
+- Base de datos: con SQLite, la API de backup de sqlite3 hace una copia
+  consistente sin parar la aplicación (en modo WAL la lectura no bloquea a
+  los escritores) y se guarda comprimida. Con PostgreSQL se guarda la
+  salida de `pg_dump --format=custom` leída como flujo.
+- Uploads: sólo se copian los contenidos que no están ya en el almacén. Un
+  archivo con el mismo tamaño y mtime que en la copia anterior no se
+  vuelve a leer: se reutiliza su hash.
+- Restaurar un registro lee su fila (y las de sus tablas relacionadas) de
+  la copia de la base de datos y recupera sus imágenes del almacén, sin
+  extraer nada más.
+"""
+import datetime
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, insert
+from sqlalchemy.engine import make_url
+
+from .images import DERIVATIVE_FORMATS, DERIVATIVE_SIZES, derivative_name
+
+CHUNK_SIZE = 1024 * 1024
+
+# Copias que conserva `flask backup prune` por defecto
+DEFAULT_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+
+
+def _file_chunks(stream):
+    return iter(lambda: stream.read(CHUNK_SIZE), b'')
+
+
+class BackupStore:
+    """Almacén de contenidos por hash y de manifiestos de copia"""
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.manifest_dir = os.path.join(root, 'manifests')
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    @contextmanager
+    def locked(self):
+        """
+        Bloqueo exclusivo del almacén (flock sobre `<root>/.lock`).
+
+        Lo toman `create_backup` y `prune`: una copia en curso ya ha movido
+        sus blobs nuevos a su sitio pero aún no ha guardado el manifiesto
+        que los referencia, y una limpieza a la vez los borraría.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def put_stream(self, stream):
+        """
+        Guarda el contenido de `stream` si no estaba ya.
+
+        Returns:
+            tuple: (sha256, tamaño, si se ha escrito un blob nuevo)
+        """
+        os.makedirs(self.blob_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, prefix='.tmp-')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in _file_chunks(stream):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            path = self.blob_path(digest.hexdigest())
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                return digest.hexdigest(), size, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return digest.hexdigest(), size, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put_file(self, path, digest=None):
+        """Guarda el archivo `path`; si su `digest` ya se conoce y está en el almacén, no lo lee"""
+        if digest and os.path.exists(self.blob_path(digest)):
+            return digest, os.path.getsize(path), False
+        with open(path, 'rb') as f:
+            return self.put_stream(f)
+
+    def copy_blob(self, digest, destination):
+        """Escribe el blob en `destination` de forma atómica"""
+        folder = os.path.dirname(destination) or '.'
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out, open(self.blob_path(digest), 'rb') as source:
+                shutil.copyfileobj(source, out, CHUNK_SIZE)
+            # mkstemp crea el archivo con 0600; el servidor web tiene que poder leerlo
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def manifest_ids(self):
+        """IDs de las copias, de la más antigua a la más reciente"""
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.manifest_dir) if name.endswith('.json'))
+
+    def load_manifest(self, snapshot_id='latest'):
+        ids = self.manifest_ids()
+        if not ids:
+            raise LookupError(f"No hay copias en {self.root}")
+        if snapshot_id in (None, 'latest'):
+            snapshot_id = ids[-1]
+        path = os.path.join(self.manifest_dir, f"{snapshot_id}.json")
+        if not os.path.exists(path):
+            raise LookupError(f"Copia no encontrada: {snapshot_id}")
+        with open(path) as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        path = os.path.join(self.manifest_dir, f"{manifest['id']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def prune(self, keep):
+        """
+        Borra las copias más antiguas (deja `keep`) y los blobs que ya no usa ninguna.
+
+        Returns:
+            tuple: (copias borradas, blobs borrados, bytes liberados)
+        """
+        with self.locked():
+            return self._prune(keep)
+
+    def _prune(self, keep):
+        ids = self.manifest_ids()
+        removed = ids[:max(len(ids) - keep, 0)]
+        for snapshot_id in removed:
+            os.remove(os.path.join(self.manifest_dir, f"{snapshot_id}.json"))
+
+        referenced = set()
+        for snapshot_id in self.manifest_ids():
+            manifest = self.load_manifest(snapshot_id)
+            referenced.add(manifest['database']['blob'])
+            referenced.update(entry[0] for entry in manifest['uploads'].values())
+
+        blobs, reclaimed = 0, 0
+        for dirpath, _, filenames in os.walk(self.blob_dir):
+            for name in filenames:
+                # Los '.tmp-' son blobs que otra copia está escribiendo
+                if name not in referenced and not name.startswith('.'):
+                    path = os.path.join(dirpath, name)
+                    reclaimed += os.path.getsize(path)
+                    os.remove(path)
+                    blobs += 1
+        return len(removed), blobs, reclaimed
+
+
+def _postgres_dsn(url):
+    # pg_dump y pg_restore entienden la URL de libpq, sin el driver de SQLAlchemy
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+def snapshot_database(url, store):
+    """Copia consistente de la base de datos de `url` (con la aplicación en marcha) en el almacén"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        with tempfile.TemporaryDirectory(dir=store.root) as tmp:
+            copy_path = os.path.join(tmp, 'snapshot.db')
+            source = sqlite3.connect(url.database)
+            target = sqlite3.connect(copy_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            # mtime=0: la misma base de datos da el mismo blob y no ocupa dos veces
+            gz_path = f"{copy_path}.gz"
+            with open(copy_path, 'rb') as src, open(gz_path, 'wb') as raw, \
+                    gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as out:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            with open(gz_path, 'rb') as f:
+                digest, size, _ = store.put_stream(f)
+        return {'dialect': 'sqlite', 'blob': digest, 'size': size}
+
+    if backend == 'postgresql':
+        process = subprocess.Popen(['pg_dump', '--format=custom', '--no-owner', '--dbname', _postgres_dsn(url)],
+                                   stdout=subprocess.PIPE)
+        try:
+            digest, size, _ = store.put_stream(process.stdout)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode:
+            raise RuntimeError(f"pg_dump terminó con el código {returncode}")
+        return {'dialect': 'postgresql', 'blob': digest, 'size': size}
+
+    raise ValueError(f"Base de datos no soportada por las copias: {backend}")
+
+
+def snapshot_uploads(folders, store, previous=None):
+    """
+    Copia al almacén los archivos de `folders` ({etiqueta: carpeta}) que no estén ya.
+
+    Returns:
+        tuple: ({'etiqueta/ruta': [sha256, tamaño, mtime_ns]}, estadísticas)
+    """
+    known = previous['uploads'] if previous else {}
+    entries = {}
+    stats = {'files': 0, 'bytes': 0, 'hashed': 0, 'new_blobs': 0, 'new_bytes': 0}
+    seen = set()
+    for label, folder in folders.items():
+        if not folder or not os.path.isdir(folder) or os.path.realpath(folder) in seen:
+            continue
+        seen.add(os.path.realpath(folder))
+        for dirpath, _, filenames in os.walk(folder):
+            for filename in filenames:
+                # Temporales de escrituras en curso (derivados, subidas)
+                if filename.startswith('.') or filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = f"{label}/{os.path.relpath(path, folder).replace(os.sep, '/')}"
+                try:
+                    st = os.stat(path)
+                    previous_entry = known.get(key)
+                    digest = None
+                    if previous_entry and previous_entry[1:] == [st.st_size, st.st_mtime_ns]:
+                        digest = previous_entry[0]
+                    else:
+                        stats['hashed'] += 1
+                    digest, size, new = store.put_file(path, digest)
+                except FileNotFoundError:
+                    continue  # borrado mientras se recorría la carpeta
+                entries[key] = [digest, size, st.st_mtime_ns]
+                stats['files'] += 1
+                stats['bytes'] += size
+                if new:
+                    stats['new_blobs'] += 1
+                    stats['new_bytes'] += size
+    return entries, stats
+
+
+def create_backup(url, folders, store):
+    """Crea una copia (base de datos y uploads) y devuelve su manifiesto"""
+    # Hasta guardar el manifiesto, `prune` no puede borrar los blobs nuevos
+    with store.locked():
+        ids = store.manifest_ids()
+        previous = store.load_manifest(ids[-1]) if ids else None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        # Primero la base de datos: los archivos que sus filas referencian ya existen y entran después
+        manifest = {
+            'id': now.strftime('%Y%m%dT%H%M%S%fZ'),
+            'created_at': now.isoformat(timespec='seconds'),
+            'database': snapshot_database(url, store),
+        }
+        manifest['uploads'], manifest['stats'] = snapshot_uploads(folders, store, previous)
+        store.save_manifest(manifest)
+        return manifest
+
+
+def _copy_rows(lines, columns):
+    """Filas de un bloque COPY ... FROM stdin (formato texto) de pg_restore"""
+    def unescape(value):
+        if value == '\\N':
+            return None
+        if '\\' not in value:
+            return value
+        out, chars = [], iter(value)
+        for char in chars:
+            if char == '\\':
+                char = next(chars, '')
+                char = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v'}.get(char, char)
+            out.append(char)
+        return ''.join(out)
+
+    for line in lines:
+        line = line.rstrip('\n')
+        if line == '\\.':
+            return
+        yield dict(zip(columns, (unescape(value) for value in line.split('\t'))))
+
+
+@contextmanager
+def snapshot_reader(store, manifest):
+    """
+    Lector de filas de la copia de la base de datos de `manifest`.
+
+    Devuelve una función `read(tabla, columna, valor)` con la lista de
+    filas (diccionarios) en las que `columna` vale `valor`.
+    """
+    database = manifest['database']
+    blob = store.blob_path(database['blob'])
+    if database['dialect'] == 'sqlite':
+        with tempfile.TemporaryDirectory(dir=store.root) as tmp:
+            path = os.path.join(tmp, 'snapshot.db')
+            with gzip.open(blob, 'rb') as source, open(path, 'wb') as out:
+                shutil.copyfileobj(source, out, CHUNK_SIZE)
+            connection = sqlite3.connect(path)
+            connection.row_factory = sqlite3.Row
+            try:
+                def read(table, column, value):
+                    cursor = connection.execute(f'SELECT * FROM "{table}" WHERE "{column}" = ?', (value,))
+                    return [dict(row) for row in cursor]
+                yield read
+            finally:
+                connection.close()
+        return
+
+    def read(table, column, value):
+        # pg_restore escribe sólo los datos de la tabla; se filtra el flujo sin guardarlo
+        process = subprocess.Popen(['pg_restore', '--data-only', f'--table={table}', '--file=-', blob],
+                                   stdout=subprocess.PIPE, text=True)
+        rows = []
+        try:
+            for line in process.stdout:
+                if line.startswith('COPY '):
+                    columns = [c.strip().strip('"') for c in line[line.index('(') + 1:line.index(')')].split(',')]
+                    rows = [row for row in _copy_rows(process.stdout, columns) if row[column] == str(value)]
+        finally:
+            process.stdout.close()
+            process.wait()
+        return rows
+    yield read
+
+
+def _coerce(table, row):
+    """Fila de la copia con los tipos de Python de las columnas actuales de `table`"""
+    values = {}
+    for key, value in row.items():
+        if key not in table.c:
+            continue  # columna que ya no existe en el esquema
+        if isinstance(value, str):
+            try:
+                python_type = table.c[key].type.python_type
+            except NotImplementedError:
+                python_type = str
+            if python_type is datetime.datetime:
+                value = datetime.datetime.fromisoformat(value)
+            elif python_type is datetime.date:
+                value = datetime.date.fromisoformat(value)
+            elif python_type is bool:
+                value = value.lower() in ('t', 'true', '1')
+            elif python_type in (int, float):
+                value = python_type(value)
+        values[key] = value
+    return values
+
+
+def record_files(filename):
+    """Archivos de una imagen de perfil: el original y sus derivados"""
+    if not filename:
+        return []
+    return [filename] + [derivative_name(filename, size, ext)
+                         for size in DERIVATIVE_SIZES for ext in DERIVATIVE_FORMATS]
+
+
+def restore_files(store, manifest, folders, filenames):
+    """Recupera de la copia los archivos `filenames` en su carpeta; devuelve las rutas escritas"""
+    restored = []
+    for label, folder in folders.items():
+        for filename in filenames:
+            entry = manifest['uploads'].get(f"{label}/{filename}")
+            if entry and folder:
+                destination = os.path.join(folder, filename)
+                store.copy_blob(entry[0], destination)
+                restored.append(destination)
+    return restored
+
+
+def restore_record(engine, store, manifest, table, record_id, image_column=None, related=(), folders=None):
+    """
+    Devuelve un registro al estado de la copia: su fila, las filas relacionadas y sus imágenes.
+
+    La fila actual (si existe) y sus relacionadas se sustituyen en una sola
+    transacción.
+
+    Args:
+        table: tabla del registro (clave primaria de una columna).
+        image_column: columna con el nombre de la imagen de perfil.
+        related: columnas de otras tablas que apuntan al registro (se restauran sus filas).
+        folders: {etiqueta: carpeta} de los uploads.
+
+    Returns:
+        dict: {'row': fila restaurada, 'related': filas relacionadas, 'files': rutas escritas}
+    """
+    primary_key = list(table.primary_key.columns)[0]
+    with snapshot_reader(store, manifest) as read:
+        rows = read(table.name, primary_key.name, record_id)
+        if not rows:
+            raise LookupError(f"El registro {record_id} no está en la copia {manifest['id']}")
+        related_rows = [(column, read(column.table.name, column.name, record_id)) for column in related]
+
+    row = _coerce(table, rows[0])
+    with engine.begin() as connection:
+        for column, _ in related_rows:
+            connection.execute(delete(column.table).where(column == record_id))
+        connection.execute(delete(table).where(primary_key == record_id))
+        connection.execute(insert(table), [row])
+        for column, linked in related_rows:
+            if linked:
+                connection.execute(insert(column.table), [_coerce(column.table, r) for r in linked])
+
+    files = []
+    if image_column and folders:
+        files = restore_files(store, manifest, folders, record_files(row.get(image_column)))
+    return {'row': row, 'related': sum(len(linked) for _, linked in related_rows), 'files': files}
+
+
+def restore_snapshot(store, manifest, output):
+    """Escribe la copia completa en `output`: la base de datos y las carpetas de uploads"""
+    database = manifest['database']
+    os.makedirs(output, exist_ok=True)
+    if database['dialect'] == 'sqlite':
+        database_path = os.path.join(output, 'database.db')
+        with gzip.open(store.blob_path(database['blob']), 'rb') as source, open(database_path, 'wb') as out:
+            shutil.copyfileobj(source, out, CHUNK_SIZE)
+    else:
+        database_path = os.path.join(output, 'database.dump')
+        store.copy_blob(database['blob'], database_path)
+    for key, entry in manifest['uploads'].items():
+        store.copy_blob(entry[0], os.path.join(output, 'uploads', *key.split('/')))
+    return database_path
+
+
+def _size(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def backup_cli(db, table, upload_folders, image_column=None, related=(), after_restore=None):
+    """
+    Grupo `flask backup` para una aplicación.
+
+    Args:
+        db: instancia de Flask-SQLAlchemy.
+        table: tabla de los registros que restaura `restore-record`.
+        upload_folders: función sin argumentos que devuelve {etiqueta: carpeta}.
+        after_restore: se llama con el ID tras restaurar un registro (cachés, contadores).
+    """
+    group = AppGroup('backup', help='Copias de seguridad incrementales de la base de datos y los uploads.')
+
+    def get_store():
+        return BackupStore(os.getenv('BACKUP_DIR', 'backups'))
+
+    @group.command('create')
+    def create_command():
+        """Crea una copia: base de datos y uploads nuevos desde la anterior."""
+        store = get_store()
+        os.makedirs(store.root, exist_ok=True)
+        manifest = create_backup(db.engine.url, upload_folders(), store)
+        stats = manifest['stats']
+        click.echo(f"Copia {manifest['id']}: base de datos {_size(manifest['database']['size'])}, "
+                   f"{stats['files']} archivos ({_size(stats['bytes'])}), "
+                   f"{stats['new_blobs']} nuevos ({_size(stats['new_bytes'])}), {stats['hashed']} leídos")
+
+    @group.command('list')
+    def list_command():
+        """Lista las copias disponibles."""
+        store = get_store()
+        for snapshot_id in store.manifest_ids():
+            manifest = store.load_manifest(snapshot_id)
+            click.echo(f"{snapshot_id}  {manifest['created_at']}  {manifest['database']['dialect']}  "
+                       f"{len(manifest['uploads'])} archivos")
+
+    @group.command('restore-record')
+    @click.argument('record_id')
+    @click.option('--snapshot', default='latest', help='ID de la copia (por defecto, la más reciente)')
+    def restore_record_command(record_id, snapshot):
+        """Devuelve un registro (datos e imagen) al estado de una copia."""
+        store = get_store()
+        try:
+            manifest = store.load_manifest(snapshot)
+            result = restore_record(db.engine, store, manifest, table, record_id, image_column,
+                                    related, upload_folders())
+        except LookupError as e:
+            raise click.ClickException(str(e))
+        if after_restore:
+            after_restore(record_id)
+        click.echo(f"Registro {record_id} restaurado desde {manifest['id']} "
+                   f"({result['related']} filas relacionadas, {len(result['files'])} archivos)")
+
+    @group.command('restore')
+    @click.option('--snapshot', default='latest', help='ID de la copia (por defecto, la más reciente)')
+    @click.option('--output', '-o', required=True, type=click.Path(file_okay=False))
+    def restore_command(snapshot, output):
+        """Extrae una copia completa (base de datos y uploads) en una carpeta."""
+        store = get_store()
+        try:
+            manifest = store.load_manifest(snapshot)
+        except LookupError as e:
+            raise click.ClickException(str(e))
+        database_path = restore_snapshot(store, manifest, output)
+        click.echo(f"Copia {manifest['id']} extraída: {database_path} y {len(manifest['uploads'])} archivos")
+
+    @group.command('prune')
+    @click.option('--keep', type=click.IntRange(1), default=DEFAULT_KEEP, help='Copias que se conservan')
+    def prune_command(keep):
+        """Borra las copias antiguas y los blobs que ya no usa ninguna."""
+        removed, blobs, reclaimed = get_store().prune(keep)
+        click.echo(f"{removed} copias y {blobs} blobs borrados ({_size(reclaimed)} liberados)")
+
+    return group
@@ -0,0 +1,306 @@
+"""
+Exportación e importación masiva de fichas en CSV o NDJSON.
+
+La exportación lee las filas como tuplas desde un cursor del servidor y
+las codifica por fragmentos, así que la memoria no depende del tamaño de
+la tabla. La importación lee la entrada en streaming, valida cada fila e
+inserta por lotes (`executemany`, o `COPY` con PostgreSQL y psycopg2),
+cada lote en su propia transacción.
+
+Tras cada lote confirmado se guarda el número de filas de entrada
+procesadas (el checkpoint); una importación interrumpida se reanuda desde
+ahí. Las filas cuyo ID ya existe se omiten, así que repetir un lote no
+duplica nada.
+"""
+import csv
+import io
+import json
+import os
+
+from flask import Response, stream_with_context
+from sqlalchemy import String, insert, select
+
+from .serialization import STREAM_CHUNK_ROWS, dumps, iter_chunks
+
+FORMATS = ('csv', 'ndjson')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Filas por transacción en las importaciones
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+MAX_IMPORT_BATCH_SIZE = 10000
+
+# Errores de validación que se detallan en el resultado (el resto sólo se cuentan)
+MAX_REPORTED_ERRORS = 100
+
+
+def parse_format(value, hint=''):
+    """
+    Formato pedido ('csv' o 'ndjson').
+
+    Sin `value` se deduce de `hint` (un Content-Type, un Accept o el nombre
+    del archivo): CSV si lo menciona, NDJSON si no.
+    """
+    fmt = (value or '').lower()
+    if not fmt:
+        fmt = 'csv' if 'csv' in (hint or '').lower() else 'ndjson'
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt} (opciones: {', '.join(FORMATS)})")
+    return fmt
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        # Los vínculos anidados van como JSON dentro de la celda
+        return dumps(value).decode()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_chunks(records, fields, fmt, chunk_rows=STREAM_CHUNK_ROWS):
+    """Codifica los diccionarios de `records` en fragmentos de bytes de `chunk_rows` filas"""
+    if fmt == 'ndjson':
+        for chunk in iter_chunks(records, lambda record: record, separator=b'\n', chunk_rows=chunk_rows):
+            yield chunk + b'\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(fields)
+    pending = 1
+    for record in records:
+        writer.writerow([_csv_value(record.get(field)) for field in fields])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue().encode()
+
+
+def export_response(records, fields, fmt, filename):
+    """Descarga en streaming de `records` (CSV o NDJSON)"""
+    return Response(
+        stream_with_context(export_chunks(records, fields, fmt)),
+        mimetype=MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+def read_records(stream, fmt):
+    """
+    Itera `(número de fila, diccionario)` de un flujo binario en CSV o NDJSON.
+
+    Las filas se numeran desde 1 en el orden de la entrada (las líneas en
+    blanco de NDJSON no cuentan). Una línea NDJSON que no es un objeto
+    JSON se entrega como `None` para que se informe como error.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        yield from enumerate(csv.DictReader(text), 1)
+        return
+
+    number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def check_types(table, row):
+    """Mensaje de error si algún valor de `row` para una columna de texto de `table` no es texto, o None"""
+    for key, value in row.items():
+        if value is not None and not isinstance(value, str) and isinstance(table.c[key].type, String):
+            return f"{key} debe ser texto"
+    return None
+
+
+def check_lengths(table, row):
+    """Mensaje de error si algún texto de `row` no cabe en su columna de `table`, o None"""
+    for key, value in row.items():
+        length = getattr(table.c[key].type, 'length', None)
+        if length and isinstance(value, str) and len(value) > length:
+            return f"{key} supera los {length} caracteres"
+    return None
+
+
+class ImportResult:
+    """Contadores de una importación (sólo se guardan los primeros errores)"""
+
+    def __init__(self, rows=0, inserted=0, skipped=0, invalid=0):
+        self.rows = rows
+        self.inserted = inserted
+        self.skipped = skipped
+        self.invalid = invalid
+        self.errors = []
+
+    def add_error(self, number, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'error': message})
+
+    def to_dict(self):
+        return {'rows': self.rows, 'inserted': self.inserted, 'skipped': self.skipped,
+                'invalid': self.invalid, 'errors': self.errors}
+
+
+class Checkpoint:
+    """
+    Progreso de una importación en un archivo JSON.
+
+    Se reescribe de forma atómica después de cada lote confirmado, así que
+    siempre refleja filas que ya están en la base de datos. Sin `path` sólo
+    se guarda en memoria (`state`), p. ej. para informar a un cliente de la
+    API desde qué fila reanudar.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.state = {'rows': 0}
+
+    def load(self):
+        """Resultado guardado (vacío si no hay checkpoint)"""
+        if not self.path or not os.path.exists(self.path):
+            return ImportResult()
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved.get('source') != self.source:
+            raise ValueError(f"El checkpoint {self.path} corresponde a otra importación ({saved.get('source')})")
+        return ImportResult(saved['rows'], saved['inserted'], saved['skipped'], saved['invalid'])
+
+    def save(self, result):
+        state = dict(result.to_dict(), source=self.source)
+        del state['errors']
+        self.state = state
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_import(records, prepare, write_batch, batch_size=IMPORT_BATCH_SIZE, result=None, on_batch=None):
+    """
+    Valida e inserta `records` por lotes.
+
+    Args:
+        records: iterable de `(número de fila, diccionario)` (ver `read_records`).
+        prepare: convierte un diccionario en la fila a insertar; lanza
+            ValueError con el motivo si no es válido.
+        write_batch: inserta y confirma una lista de filas; devuelve
+            `(insertadas, omitidas)`.
+        result: resultado de partida al reanudar; se saltan sus `rows` filas.
+        on_batch: se llama con el resultado tras cada lote confirmado.
+
+    Returns:
+        ImportResult
+    """
+    result = result or ImportResult()
+    start = result.rows
+    batch = []
+    last = start
+
+    def flush():
+        if batch:
+            inserted, skipped = write_batch(batch)
+            result.inserted += inserted
+            result.skipped += skipped
+            batch.clear()
+        result.rows = last
+        if on_batch:
+            on_batch(result)
+
+    for number, record in records:
+        if number <= start:
+            continue
+        last = number
+        try:
+            if record is None:
+                raise ValueError('La fila no es un objeto JSON')
+            batch.append(prepare(record))
+        except ValueError as e:
+            result.add_error(number, str(e))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return result
+
+
+def new_rows(connection, id_column, rows):
+    """
+    Filas de `rows` cuyo ID no existe todavía (ni se repite dentro del lote).
+
+    Returns:
+        tuple: (filas nuevas, número de filas omitidas)
+    """
+    by_id = {}
+    for row in rows:
+        by_id.setdefault(row['id'], row)
+    existing = set(connection.scalars(select(id_column).where(id_column.in_(list(by_id)))))
+    fresh = [row for row_id, row in by_id.items() if row_id not in existing]
+    return fresh, len(rows) - len(fresh)
+
+
+def _copy_rows(connection, table, rows):
+    """COPY ... FROM STDIN de psycopg2: la vía más rápida de cargar filas en PostgreSQL"""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow(['\\N' if row[c] is None else _csv_value(row[c]) for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, rows):
+    """
+    Inserta `rows` (diccionarios con todas las columnas) en `table`.
+
+    Con PostgreSQL y psycopg2 se usa COPY; en el resto, un único
+    `executemany`. Los valores por defecto de las columnas no se aplican
+    con COPY, así que las filas deben venir completas.
+    """
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+        _copy_rows(connection, table, rows)
+    else:
+        connection.execute(insert(table), rows)
+
+
+def import_stream(stream, fmt, prepare, write_batch, batch_size=IMPORT_BATCH_SIZE, checkpoint=None, skip=0):
+    """
+    Importa un flujo CSV o NDJSON con `run_import`.
+
+    Si `checkpoint` tiene progreso guardado se reanuda desde él (o desde
+    `skip` filas, si es mayor). Al terminar sin errores el checkpoint se
+    borra.
+    """
+    result = checkpoint.load() if checkpoint else ImportResult()
+    result.rows = max(result.rows, skip)
+    result = run_import(read_records(stream, fmt), prepare, write_batch, batch_size, result,
+                        on_batch=checkpoint.save if checkpoint else None)
+    if checkpoint:
+        checkpoint.clear()
+    return result
@@ -0,0 +1,319 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo bloqueos entre hilos
+    fcntl = None
+
+
+class TTLCache:
+    """
+    Caché LRU en memoria con caducidad por entrada.
+
+    Es segura entre hilos y lleva contadores de aciertos y fallos para poder
+    medir su efectividad.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Devuelve el valor guardado o None si no existe o ha caducado"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        """Guarda un valor; `ttl` permite acortar la caducidad por defecto"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Invalida una entrada"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class FileStore:
+    """
+    Almacén clave -> bytes en un directorio local, compartido por los workers.
+
+    Cada entrada es un archivo con la caducidad en la primera línea; las
+    escrituras son atómicas (archivo temporal + `os.replace`). Los bloqueos
+    entre procesos usan `flock` sobre un conjunto fijo de archivos.
+
+    Como mucho cada `sweep_interval` segundos, una escritura barre el
+    directorio (`sweep`): borra las entradas caducadas y, si el total supera
+    `max_bytes`, las que caducan antes hasta volver por debajo del límite.
+    """
+
+    LOCK_STRIPES = 64
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, directory, max_bytes=None, sweep_interval=SWEEP_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        os.makedirs(os.path.join(directory, 'locks'), exist_ok=True)
+        self._thread_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def _path(self, key):
+        # Las claves vienen de la URL: se usa su hash como nombre de archivo
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        expires_at, _, value = data.partition(b'\n')
+        if float(expires_at) <= time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b'%.3f\n' % (time.time() + ttl) + value)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep()
+        except OSError:
+            pass
+        finally:
+            self._sweep_lock.release()
+
+    def sweep(self):
+        """Borra las entradas caducadas y las más próximas a caducar si se supera `max_bytes`; devuelve cuántas"""
+        now = time.time()
+        removed, total, entries = 0, 0, []
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir() or folder.name == 'locks':
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    with open(entry.path, 'rb') as f:
+                        expires_at = float(f.readline())
+                    size = entry.stat().st_size
+                except (OSError, ValueError):
+                    continue
+                if expires_at <= now:
+                    removed += self._unlink(entry.path)
+                else:
+                    entries.append((expires_at, size, entry.path))
+                    total += size
+        if self.max_bytes and total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                removed += self._unlink(path)
+                total -= size
+        return removed
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        return 1
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lock(self, key):
+        stripe = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) % self.LOCK_STRIPES
+        with self._thread_locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, 'locks', str(stripe)), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisStore:
+    """Almacén clave -> bytes en Redis (o un servidor compatible)"""
+
+    def __init__(self, url, prefix='motosegura:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def lock(self, key):
+        return self.client.lock(f"{self.prefix}lock:{key}", timeout=10, blocking_timeout=10)
+
+
+class ReadThroughCache:
+    """
+    Caché de lectura de payloads serializados, compartida entre workers.
+
+    En un fallo sólo un lector (por proceso y entre procesos) ejecuta la
+    carga; los demás esperan el bloqueo de la clave y encuentran el valor ya
+    guardado, de modo que una ráfaga de peticiones al mismo ID se traduce en
+    una única consulta. Los registros inexistentes se recuerdan un tiempo
+    corto para que tampoco lleguen a la base de datos, pero sólo en la
+    memoria del proceso (un `TTLCache` acotado): un escaneo de IDs al azar
+    no deja un archivo por ID en el almacén compartido.
+
+    Las escrituras deben llamar a `invalidate` tras el commit; `ttl` acota
+    el tiempo que una lectura concurrente con la escritura puede quedar
+    desactualizada.
+    """
+
+    def __init__(self, namespace, store=None, ttl=300, missing_ttl=5, max_missing=10000):
+        self._store = store
+        self.namespace = namespace
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._missing = TTLCache(max_entries=max_missing, ttl=missing_ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def store(self):
+        # El almacén por defecto se crea con la primera lectura, no al importar
+        if self._store is None:
+            self._store = default_record_store()
+        return self._store
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get_or_load(self, key, loader):
+        """
+        Devuelve los bytes guardados para `key` o los obtiene con `loader`.
+
+        `loader()` debe devolver bytes, o None si el registro no existe; en
+        ese caso también se devuelve None.
+        """
+        store_key = self._key(key)
+        if self._missing.get(store_key):
+            self.hits += 1
+            return None
+        value = self.store.get(store_key)
+        if value is None:
+            with self.store.lock(store_key):
+                # Otro lector pudo cargarlo mientras esperábamos el bloqueo
+                value = self.store.get(store_key)
+                if value is None:
+                    self.misses += 1
+                    loaded = loader()
+                    if loaded is None:
+                        self._missing.set(store_key, True)
+                    else:
+                        self.store.set(store_key, loaded, self.ttl)
+                    return loaded
+        self.hits += 1
+        # b'': entrada de inexistente guardada por una versión anterior
+        return value or None
+
+    def invalidate(self, *keys):
+        # Los inexistentes recordados por otros workers caducan solos en `missing_ttl` segundos
+        for key in keys:
+            self._missing.pop(self._key(key))
+            self.store.delete(self._key(key))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_record_store = None
+_record_store_lock = threading.Lock()
+
+
+def default_record_store():
+    """
+    Almacén compartido de la caché de registros.
+
+    Usa Redis si `RECORD_CACHE_URL` apunta a uno y, si no, un directorio
+    local (`RECORD_CACHE_DIR`, de como mucho `RECORD_CACHE_MAX_MB` megas).
+    """
+    global _record_store
+    if _record_store is None:
+        with _record_store_lock:
+            if _record_store is None:
+                url = os.getenv('RECORD_CACHE_URL', '')
+                if url.startswith(('redis://', 'rediss://', 'unix://')):
+                    _record_store = RedisStore(url)
+                else:
+                    _record_store = FileStore(
+                        os.getenv('RECORD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'motosegura-records')),
+                        max_bytes=int(os.getenv('RECORD_CACHE_MAX_MB', '256')) * 1024 * 1024)
+    return _record_store
+
+
+def get_record_cache(namespace):
+    """Caché de lectura de registros para `namespace` (p. ej. 'ficha'); `RECORD_CACHE_TTL` fija la caducidad"""
+    return ReadThroughCache(namespace, ttl=int(os.getenv('RECORD_CACHE_TTL', '300')))
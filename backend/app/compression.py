@@ -0,0 +1,213 @@
+"""
+Compresión de las respuestas (gzip y, si está instalado, brotli).
+
+Las respuestas de texto (JSON, NDJSON, CSV, HTML) se comprimen según el
+`Accept-Encoding` del cliente cuando superan `COMPRESS_MIN_SIZE` bytes;
+los listados en streaming se comprimen fragmento a fragmento, sin
+esperar al final.
+
+Una respuesta con ETag se comprime una sola vez: el resultado se guarda
+en el almacén compartido de la caché de registros con la ruta, la ETag, la
+codificación, el Content-Type y las cabeceras de `Vary` como clave (el
+mismo listado puede ser JSON o NDJSON según `Accept`). Como la ETag cambia
+con el contenido, no hace falta invalidar nada. El Content-Type se guarda también junto al cuerpo y un acierto
+sólo se usa si coincide con el de la respuesta.
+
+Sólo se guardan las URL canónicas: respuestas completas (no los listados
+en streaming, que pueden ocupar varios megas) cuya query string sólo
+lleva parámetros conocidos (`CACHEABLE_ARGS`), una vez cada uno. Así un
+cliente no puede llenar el almacén variando parámetros que se ignoran.
+"""
+import hashlib
+import os
+import zlib
+
+from flask import request
+
+from .cache import default_record_store
+from .metrics import registry
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli sólo se ofrece gzip
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'application/javascript',
+                          'image/svg+xml'}
+
+# Preferencia del servidor si el cliente acepta varias con la misma calidad
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+# Respuestas comprimidas de más de este tamaño no se guardan en la caché
+MAX_CACHED_BYTES = 8 * 1024 * 1024
+
+# Parámetros de los listados y búsquedas; con cualquier otro la respuesta no se guarda
+CACHEABLE_ARGS = {'limit', 'cursor', 'format', 'stream', 'since', 'nombre', 'apellido', 'q'}
+
+
+def _settings():
+    return {
+        'min_size': int(os.getenv('COMPRESS_MIN_SIZE', '1024')),
+        'gzip_level': int(os.getenv('COMPRESS_GZIP_LEVEL', '6')),
+        'brotli_quality': int(os.getenv('COMPRESS_BROTLI_QUALITY', '5')),
+        'cache_ttl': int(os.getenv('COMPRESS_CACHE_TTL', '300')),
+    }
+
+
+def compressor(encoding, settings):
+    """Objeto con `compress(datos)` y `flush()` para una codificación"""
+    if encoding == 'br':
+        return _BrotliStream(brotli.Compressor(quality=settings['brotli_quality']))
+    # wbits=31: formato gzip (cabecera y CRC), no zlib
+    return zlib.compressobj(settings['gzip_level'], zlib.DEFLATED, 31)
+
+
+class _BrotliStream:
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, mode=None):
+        # Sin modo se cierra el flujo; con uno, se vacía lo pendiente
+        return self._compressor.finish() if mode is None else self._compressor.flush()
+
+
+def compress(data, encoding, settings=None):
+    """Comprime `data` de una vez"""
+    stream = compressor(encoding, settings or _settings())
+    return stream.compress(data) + stream.flush()
+
+
+def is_canonical_request():
+    """Si la query string sólo lleva parámetros de `CACHEABLE_ARGS`, sin repetir"""
+    return all(key in CACHEABLE_ARGS and len(request.args.getlist(key)) == 1 for key in request.args)
+
+
+def cache_key(response, encoding):
+    """Clave de la versión comprimida de `response`, o None si no se guarda en la caché"""
+    etag = response.get_etag()[0]
+    if not etag or response.is_streamed or not is_canonical_request():
+        return None
+    # Las cabeceras de la petición que cambian el contenido (Vary) también la distinguen
+    varies = '\x1f'.join(f"{header}={request.headers.get(header, '')}"
+                          for header in sorted(response.vary) if header.lower() != 'accept-encoding')
+    digest = hashlib.sha1(f"{response.content_type}\x1f{varies}".encode()).hexdigest()[:16]
+    return f"compressed:{encoding}:{request.path}:{etag}:{digest}"
+
+
+def pack(content_type, body):
+    """Cuerpo comprimido precedido de su Content-Type, tal como se guarda en la caché"""
+    return content_type.encode() + b'\n' + body
+
+
+def unpack(cached, content_type):
+    """Cuerpo de una entrada de la caché si su Content-Type es `content_type`, o None"""
+    stored, _, body = cached.partition(b'\n')
+    return body if stored.decode() == content_type else None
+
+
+def is_compressible(response):
+    if response.status_code not in (200, 201) or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return False
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+class CompressionStats:
+    """Aciertos y fallos de la caché de respuestas comprimidas"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def init_compression(app, store=None):
+    """
+    Comprime las respuestas de `app` en un `after_request`.
+
+    `COMPRESS_ENABLED=false` lo desactiva (p. ej. si nginx ya comprime);
+    `COMPRESS_MIN_SIZE`, `COMPRESS_GZIP_LEVEL`, `COMPRESS_BROTLI_QUALITY`
+    y `COMPRESS_CACHE_TTL` lo ajustan.
+    """
+    if os.getenv('COMPRESS_ENABLED', 'true').lower() == 'false':
+        return
+    settings = _settings()
+    stats = CompressionStats()
+    registry.register_stats('compression', stats)
+
+    def cache_store():
+        return store or default_record_store()
+
+    def record_sizes(encoding, original, compressed):
+        registry.inc('compression_input_bytes_total', original, encoding=encoding)
+        registry.inc('compression_output_bytes_total', compressed, encoding=encoding)
+
+    def compressed_stream(chunks, encoding):
+        stream = compressor(encoding, settings)
+        original, size = 0, 0
+        try:
+            for chunk in chunks:
+                original += len(chunk)
+                # Vaciar tras cada fragmento para que el cliente reciba las filas según se generan
+                data = stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    size += len(data)
+                    yield data
+            data = stream.flush()
+            size += len(data)
+            yield data
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+        record_sizes(encoding, original, size)
+
+    @app.after_request
+    def compress_response(response):
+        if not is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if not encoding:
+            return response
+        if not response.is_streamed and response.content_length is not None \
+                and response.content_length < settings['min_size']:
+            return response
+
+        # La ETag no cambia con la codificación (Vary la distingue), así que los 304 siguen funcionando.
+        # Sólo las respuestas completas de URL canónicas se guardan (ver `cache_key`)
+        key = cache_key(response, encoding)
+        content_type = response.content_type
+        cached = cache_store().get(key) if key else None
+        body = unpack(cached, content_type) if cached is not None else None
+        if body is not None:
+            stats.hits += 1
+            # El cuerpo original (p. ej. el generador de un listado) se descarta sin ejecutar la consulta
+            close = getattr(response.response, 'close', None)
+            if close:
+                close()
+            response.response = [body]
+            response.content_length = len(body)
+        elif response.is_streamed:
+            # Los listados en streaming se comprimen al vuelo, sin guardarlos (ver `cache_key`)
+            response.response = compressed_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < settings['min_size']:
+                return response
+            stats.misses += bool(key)
+            body = compress(data, encoding, settings)
+            record_sizes(encoding, len(data), len(body))
+            if key and len(body) <= MAX_CACHED_BYTES:
+                cache_store().set(key, pack(content_type, body), settings['cache_ttl'])
+            response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,136 @@
+"""
+Perfiles del motor de base de datos.
+
+`DB_ENGINE_PROFILE` elige el perfil: 'auto' (por defecto, según la URL),
+'sqlite', 'postgres' o 'default' (opciones de SQLAlchemy sin tocar).
+
+- sqlite: WAL, `synchronous=NORMAL`, mmap, caché de páginas y
+  `busy_timeout`, aplicados a cada conexión nueva. Con WAL los lectores no
+  bloquean al escritor y los escritores esperan en lugar de fallar con
+  "database is locked".
+- postgres: pool dimensionado según la topología de gunicorn (hilos por
+  worker y, si se conoce, el máximo de conexiones del servidor repartido
+  entre los workers), `pool_pre_ping` y `statement_timeout`.
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+PROFILES = ('auto', 'default', 'sqlite', 'postgres')
+
+# Pragmas del perfil sqlite (los tamaños pensados también para una Raspberry Pi)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+}
+
+
+def _int_env(name, default):
+    return int(os.getenv(name, default))
+
+
+def resolve_profile(uri, profile=None):
+    """Nombre del perfil para `uri` ('auto' se resuelve por el dialecto)"""
+    profile = (profile or os.getenv('DB_ENGINE_PROFILE', 'auto')).lower()
+    if profile not in PROFILES:
+        raise ValueError(f"DB_ENGINE_PROFILE desconocido: {profile} (opciones: {', '.join(PROFILES)})")
+    if profile != 'auto':
+        return profile
+    backend = make_url(uri).get_backend_name()
+    if backend == 'sqlite':
+        return 'sqlite'
+    if backend == 'postgresql':
+        return 'postgres'
+    return 'default'
+
+
+def gunicorn_topology():
+    """(workers, hilos por worker) según GUNICORN_WORKERS/WEB_CONCURRENCY y GUNICORN_THREADS"""
+    workers = _int_env('GUNICORN_WORKERS', os.getenv('WEB_CONCURRENCY', '1'))
+    threads = _int_env('GUNICORN_THREADS', '1')
+    return max(workers, 1), max(threads, 1)
+
+
+def postgres_pool_options():
+    """
+    Opciones de pool para PostgreSQL.
+
+    Cada worker tiene su propio pool: `pool_size` cubre sus hilos y el
+    desbordamiento absorbe picos. Con `DB_MAX_CONNECTIONS` el total
+    (workers × (pool + desbordamiento)) no supera lo que admite el servidor.
+    """
+    workers, threads = gunicorn_topology()
+    pool_size = _int_env('DB_POOL_SIZE', threads)
+    max_overflow = _int_env('DB_MAX_OVERFLOW', max(2, threads // 2))
+    max_connections = os.getenv('DB_MAX_CONNECTIONS')
+    if max_connections:
+        per_worker = max(int(max_connections) // workers, 1)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = max(min(max_overflow, per_worker - pool_size), 0)
+    return {'pool_size': pool_size, 'max_overflow': max_overflow}
+
+
+def engine_options(uri, profile=None):
+    """Opciones de `create_engine` (SQLALCHEMY_ENGINE_OPTIONS) del perfil de `uri`"""
+    profile = resolve_profile(uri, profile)
+    if profile == 'sqlite':
+        # Espera del driver ante un bloqueo de escritura (en segundos)
+        return {'connect_args': {'timeout': _int_env('SQLITE_BUSY_TIMEOUT_MS', '5000') / 1000}}
+    if profile == 'postgres':
+        statement_timeout = _int_env('DB_STATEMENT_TIMEOUT_MS', '25000')
+        return dict(
+            postgres_pool_options(),
+            pool_pre_ping=True,
+            pool_recycle=_int_env('DB_POOL_RECYCLE', '1800'),
+            pool_timeout=_int_env('DB_POOL_TIMEOUT', '10'),
+            connect_args={
+                'connect_timeout': _int_env('DB_CONNECT_TIMEOUT', '5'),
+                # Por debajo del timeout de gunicorn: la consulta se cancela antes que el worker
+                'options': f"-c statement_timeout={statement_timeout}",
+            },
+        )
+    return {}
+
+
+def sqlite_pragmas():
+    pragmas = dict(SQLITE_PRAGMAS)
+    pragmas['busy_timeout'] = _int_env('SQLITE_BUSY_TIMEOUT_MS', '5000')
+    pragmas['mmap_size'] = _int_env('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))
+    # Negativo: KiB de caché por conexión
+    pragmas['cache_size'] = -_int_env('SQLITE_CACHE_KB', '8192')
+    return pragmas
+
+
+def install_engine_hooks(engine, profile=None):
+    """Registra en `engine` los ajustes por conexión de su perfil; devuelve el perfil"""
+    profile = resolve_profile(str(engine.url), profile)
+    if profile == 'sqlite':
+        pragmas = sqlite_pragmas()
+        if not engine.url.database or engine.url.database == ':memory:':
+            # Una base en memoria no tiene diario en disco
+            pragmas.pop('journal_mode')
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+    return profile
+
+
+def configure_engine(app):
+    """Añade las opciones del perfil a la configuración (antes de inicializar SQLAlchemy)"""
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_engine_hooks(app, db):
+    """Instala los ajustes por conexión en el motor de la aplicación (después de inicializarlo)"""
+    with app.app_context():
+        app.config['DB_ENGINE_PROFILE'] = install_engine_hooks(db.engine)
@@ -0,0 +1,46 @@
+import hashlib
+
+from flask import Response, request
+
+# Las respuestas JSON pueden cambiar: el cliente las guarda pero revalida siempre
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+def strong_etag(*parts):
+    """ETag fuerte a partir de los valores que determinan el contenido de la respuesta"""
+    raw = '\x1f'.join(p.decode() if isinstance(p, bytes) else str(p) for p in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()[:32]
+
+
+def payload_etag(payload, *parts):
+    """ETag fuerte de un payload ya serializado (y de lo que se le añada al responder)"""
+    digest = hashlib.md5(payload)
+    for part in parts:
+        digest.update(b'\x1f' + str(part).encode())
+    return digest.hexdigest()
+
+
+def not_modified(etag, vary=()):
+    """
+    Respuesta 304 si el cliente ya tiene la versión `etag`, o None.
+
+    Se comprueba antes de cargar o serializar nada, así que un 304 sólo
+    cuesta calcular la ETag. `vary` debe coincidir con el de la respuesta
+    completa (ver `tag_response`).
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    return tag_response(Response(status=304), etag, vary)
+
+
+def tag_response(response, etag, vary=()):
+    """
+    Añade la ETag y la política de revalidación a una respuesta.
+
+    `vary` son las cabeceras de la petición que cambian el contenido (p. ej.
+    `Accept` si elige el formato); la ETag también debe depender de ellas.
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    response.vary.update(vary)
+    return response
@@ -0,0 +1,154 @@
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Response, current_app, request, send_file
+
+# Los archivos con hash en el nombre nunca cambian: caché de un año
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'public, max-age=86400'
+
+# <record_id>_<md5>.<ext> y sus derivados <record_id>_<md5>_<tamaño>.<ext>
+_HASHED_NAME_RE = re.compile(r'_(?P<md5>[0-9a-f]{32})(?P<suffix>_[a-z]+)?\.(?P<ext>[a-z0-9]+)$')
+
+
+def content_etag(filename):
+    """ETag derivado del MD5 incluido en el nombre del archivo, o None"""
+    match = _HASHED_NAME_RE.search(filename)
+    if not match:
+        return None
+    return match.group('md5') + (match.group('suffix') or '') + '.' + match.group('ext')
+
+
+class UploadIndex:
+    """
+    Índice en memoria de los archivos subidos: nombre -> (carpeta, ruta).
+
+    Las carpetas se listan una sola vez con `os.scandir`; después cada
+    petición se resuelve con una búsqueda en el diccionario. Los archivos
+    nuevos se añaden con `register` o, si otro worker los creó, con una
+    única comprobación cuando no están en el índice.
+    """
+
+    def __init__(self, folders):
+        self.folders = [os.path.abspath(f) for f in folders if f]
+        self._paths = {}
+        self._scanned = False
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        paths = {}
+        # Se recorre en orden inverso para que la primera carpeta tenga prioridad
+        for folder in reversed(self.folders):
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            paths[entry.name] = (folder, entry.path)
+            except OSError:
+                continue
+        self._paths.update(paths)
+        self._scanned = True
+
+    def resolve(self, filename):
+        """Devuelve (carpeta, ruta) del archivo o None si no existe"""
+        if not self._scanned:
+            with self._lock:
+                if not self._scanned:
+                    self._scan()
+
+        entry = self._paths.get(filename)
+        if entry is not None:
+            return entry
+
+        for folder in self.folders:
+            path = os.path.join(folder, filename)
+            if os.path.isfile(path):
+                entry = (folder, path)
+                self._paths[filename] = entry
+                return entry
+        return None
+
+    def register(self, path):
+        """Añade un archivo recién escrito al índice"""
+        path = os.path.abspath(path)
+        folder, filename = os.path.split(path)
+        if folder in self.folders:
+            self._paths[filename] = (folder, path)
+
+    def forget(self, filename):
+        """Elimina un archivo del índice (p. ej. tras borrarlo)"""
+        self._paths.pop(filename, None)
+
+
+def send_upload(index, filename, offload=None, accel_prefix='/_protected_uploads'):
+    """
+    Envía un archivo del índice con soporte de Range, ETag y descarga delegada.
+
+    Sin delegación los bytes se envían con `wsgi.file_wrapper` (sendfile en
+    gunicorn) y Werkzeug resuelve Range e If-None-Match. Con `offload`:
+
+    - 'x-accel': emite `X-Accel-Redirect` para que nginx sirva el archivo
+      desde una location interna por carpeta, p. ej.::
+
+          location /_protected_uploads/0/ {
+              internal;
+              alias /data/motosegura/uploads/;
+          }
+
+    - 'x-sendfile': emite `X-Sendfile` con la ruta absoluta (Apache, lighttpd).
+
+    Returns:
+        Response o None si el archivo no existe.
+    """
+    entry = index.resolve(filename)
+    if entry is None:
+        return None
+    folder, path = entry
+
+    etag = content_etag(filename)
+    cache_control = IMMUTABLE_CACHE_CONTROL if etag else DEFAULT_CACHE_CONTROL
+
+    if offload in ('x-accel', 'x-sendfile'):
+        if etag and request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            if offload == 'x-accel':
+                response.headers['X-Accel-Redirect'] = f"{accel_prefix}/{index.folders.index(folder)}/{filename}"
+            else:
+                response.headers['X-Sendfile'] = path
+        if etag:
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    try:
+        response = send_file(path, conditional=True, etag=etag or True,
+                             max_age=31536000 if etag else 86400)
+    except FileNotFoundError:
+        # Borrado por otro proceso (p. ej. limpieza de huérfanos)
+        index.forget(filename)
+        return None
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def get_upload_index(app, folders):
+    """
+    Índice de uploads de la aplicación, creado la primera vez que se usa.
+
+    `folders` es una función que devuelve las carpetas en orden de prioridad;
+    sólo se llama al crear el índice.
+    """
+    index = app.extensions.get('upload_index')
+    if index is None:
+        index = app.extensions['upload_index'] = UploadIndex(folders())
+    return index
+
+
+def upload_offload_settings():
+    """Modo de descarga delegada configurado: (modo, prefijo interno)"""
+    return (current_app.config.get('UPLOAD_OFFLOAD') or None,
+            current_app.config.get('UPLOAD_ACCEL_PREFIX', '/_protected_uploads').rstrip('/'))
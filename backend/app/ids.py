@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+import secrets
+import threading
+
+from sqlalchemy import BigInteger, Column, MetaData, String, Table, select, update
+from sqlalchemy.exc import IntegrityError
+
+# Mismo alfabeto que los IDs antiguos (6 caracteres aleatorios). Los nuevos
+# tienen 7, así que nunca pueden coincidir con uno ya emitido.
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ID_LENGTH = 7
+ID_SPACE = len(ALPHABET) ** ID_LENGTH
+LEGACY_ID_LENGTH = 6
+
+_ID_RE = re.compile(f"[{ALPHABET}]{{{LEGACY_ID_LENGTH},{ID_LENGTH}}}")
+
+
+def is_valid_id(value):
+    """Si `value` tiene la forma de un ID (antiguo o actual): p. ej. para IDs importados"""
+    return isinstance(value, str) and _ID_RE.fullmatch(value) is not None
+
+# IDs que cada proceso reserva de una vez en la tabla de secuencias
+DEFAULT_BLOCK_SIZE = int(os.getenv('ID_BLOCK_SIZE', '256'))
+
+_MASK64 = (1 << 64) - 1
+
+# Tabla propia, fuera de los modelos: se crea la primera vez que se usa
+sequence_metadata = MetaData()
+id_sequence = Table(
+    'id_sequence', sequence_metadata,
+    Column('name', String(50), primary_key=True),
+    Column('next_value', BigInteger, nullable=False),
+    # Clave de la permutación; se genera una vez y no debe cambiar nunca
+    Column('secret', String(64), nullable=False),
+)
+
+
+class FeistelPermutation:
+    """
+    Biyección con clave sobre [0, radix**length).
+
+    Es una red de Feistel sobre dos mitades de tamaños `radix**(length//2)`
+    y `radix**(length - length//2)` que alterna el módulo en cada ronda
+    (como FF1), así que nunca sale del dominio. Al ser una biyección,
+    números de secuencia distintos dan siempre resultados distintos.
+    """
+
+    # Debe ser par para que las mitades vuelvan a su tamaño original
+    ROUNDS = 6
+
+    def __init__(self, secret, radix=len(ALPHABET), length=ID_LENGTH):
+        self.left_size = radix ** (length // 2)
+        self.right_size = radix ** (length - length // 2)
+        self.size = self.left_size * self.right_size
+        self.round_keys = [
+            int.from_bytes(hashlib.blake2b(f"{secret}:{i}".encode(), digest_size=8).digest(), 'big')
+            for i in range(self.ROUNDS)
+        ]
+
+    def permute(self, value):
+        if not 0 <= value < self.size:
+            raise ValueError(f"Valor fuera del dominio: {value}")
+        left_size, right_size = self.left_size, self.right_size
+        left, right = divmod(value, right_size)
+        for key in self.round_keys:
+            # Función de ronda: mezcla multiplicativa de 64 bits con la clave de la ronda.
+            # Cualquier función de ronda da una biyección; esta sólo tiene que ser rápida.
+            x = ((right ^ key) * 0x9E3779B97F4A7C15) & _MASK64
+            x ^= x >> 29
+            x = (x * 0xBF58476D1CE4E5B9) & _MASK64
+            left, right = right, (left + (x ^ (x >> 32))) % left_size
+            left_size, right_size = right_size, left_size
+        return left * right_size + right
+
+
+def encode_id(number, length=ID_LENGTH):
+    """Convierte un entero en un ID de `length` caracteres del alfabeto"""
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class IdAllocator:
+    """
+    Generador de IDs cortos, únicos y sin orden aparente.
+
+    Cada proceso reserva bloques de números consecutivos en la tabla
+    `id_sequence` con una transacción propia (un UPDATE por bloque, no por
+    inserción) y los transforma con una permutación con clave, de modo que
+    los IDs no revelan el orden ni el volumen de altas. No hace falta
+    consultar la tabla de destino: dos números de secuencia distintos nunca
+    producen el mismo ID, tampoco entre workers.
+
+    Los números reservados y no usados (p. ej. al reiniciar un worker) se
+    pierden; el espacio de 36^7 IDs lo hace irrelevante.
+    """
+
+    def __init__(self, name, block_size=DEFAULT_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, engine, count):
+        """Reserva `count` números y devuelve (primero, clave)"""
+        sequence_metadata.create_all(engine, checkfirst=True)
+        for attempt in range(2):
+            try:
+                with engine.begin() as connection:
+                    # El UPDATE bloquea la fila (o la base de datos en SQLite) hasta el commit
+                    reserved = connection.execute(
+                        update(id_sequence)
+                        .where(id_sequence.c.name == self.name)
+                        .values(next_value=id_sequence.c.next_value + count)
+                    ).rowcount
+                    if not reserved:
+                        secret = secrets.token_hex(32)
+                        connection.execute(id_sequence.insert().values(
+                            name=self.name, next_value=count, secret=secret
+                        ))
+                        return 0, secret
+                    row = connection.execute(
+                        select(id_sequence.c.next_value, id_sequence.c.secret)
+                        .where(id_sequence.c.name == self.name)
+                    ).one()
+                    return row.next_value - count, row.secret
+            except IntegrityError:
+                # Otro worker creó la secuencia a la vez: reintentar con el UPDATE
+                if attempt:
+                    raise
+
+    def allocate(self, engine, count=1):
+        """
+        Devuelve una lista de `count` IDs nuevos.
+
+        Args:
+            engine: motor de SQLAlchemy donde vive la secuencia.
+            count (int): número de IDs a generar.
+        """
+        url = str(engine.url)
+        pid = os.getpid()
+        ids = []
+        with self._lock:
+            state = self._state.get(url)
+            # Un bloque heredado por fork pertenece al proceso padre
+            if state is None or state['pid'] != pid:
+                state = self._state[url] = {'pid': pid, 'next': 0, 'end': 0, 'permutation': None}
+            while len(ids) < count:
+                if state['next'] >= state['end']:
+                    size = max(self.block_size, count - len(ids))
+                    start, secret = self._reserve(engine, size)
+                    if start + size > ID_SPACE:
+                        raise RuntimeError(f"Espacio de IDs agotado para '{self.name}'")
+                    state.update(next=start, end=start + size)
+                    if state['permutation'] is None:
+                        state['permutation'] = FeistelPermutation(secret)
+                take = min(count - len(ids), state['end'] - state['next'])
+                permute = state['permutation'].permute
+                ids.extend(encode_id(permute(n)) for n in range(state['next'], state['next'] + take))
+                state['next'] += take
+        return ids
+
+    def next_id(self, engine):
+        """Devuelve un único ID nuevo"""
+        return self.allocate(engine, 1)[0]
@@ -0,0 +1,143 @@
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Tamaños derivados (lado mayor en píxeles), de mayor a menor
+DERIVATIVE_SIZES = {
+    'full': 1280,
+    'card': 480,
+    'thumb': 160,
+}
+
+# Formatos de salida: extensión -> (formato PIL, opciones de guardado)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+ORIGINAL_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif')
+
+_DERIVATIVE_RE = re.compile(
+    r'^(?P<stem>.+)_(?P<size>%s)\.(?P<ext>%s)$' % ('|'.join(DERIVATIVE_SIZES), '|'.join(DERIVATIVE_FORMATS))
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivative_name(filename, size, ext):
+    """Nombre del archivo derivado de `filename` para un tamaño y formato"""
+    stem = filename.rsplit('.', 1)[0]
+    return f"{stem}_{size}.{ext}"
+
+
+def parse_derivative(filename):
+    """Devuelve (stem, tamaño, extensión) si `filename` es un derivado, o None"""
+    match = _DERIVATIVE_RE.match(filename)
+    if not match:
+        return None
+    return match.group('stem'), match.group('size'), match.group('ext')
+
+
+def find_original(folder, stem):
+    """Busca el original de un derivado probando las extensiones permitidas"""
+    for ext in ORIGINAL_EXTENSIONS:
+        path = os.path.join(folder, f"{stem}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def derivative_urls(base_url, filename):
+    """URLs de todos los derivados de una imagen: {tamaño: {formato: url}}"""
+    return {
+        size: {ext: f"{base_url}/{derivative_name(filename, size, ext)}" for ext in DERIVATIVE_FORMATS}
+        for size in DERIVATIVE_SIZES
+    }
+
+
+def derivatives_exist(original_path):
+    folder, filename = os.path.split(original_path)
+    return all(
+        os.path.exists(os.path.join(folder, derivative_name(filename, size, ext)))
+        for size in DERIVATIVE_SIZES for ext in DERIVATIVE_FORMATS
+    )
+
+
+@timed('image_derivatives')
+def generate_derivatives(original_path):
+    """
+    Genera los derivados redimensionados de una imagen junto al original.
+
+    La orientación EXIF se aplica a los píxeles y los metadatos se descartan,
+    de modo que los derivados no llevan ubicación ni datos del dispositivo.
+    Cada tamaño se reduce a partir del anterior para no reescalar siempre
+    desde el original completo.
+
+    Returns:
+        list: nombres de los archivos generados.
+    """
+    from PIL import Image, ImageOps
+
+    folder, filename = os.path.split(original_path)
+    generated = []
+    with Image.open(original_path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        for size, max_side in DERIVATIVE_SIZES.items():
+            image = image.copy()
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            for ext, (pil_format, options) in DERIVATIVE_FORMATS.items():
+                output = image
+                if pil_format == 'JPEG' and output.mode == 'RGBA':
+                    # JPEG no admite transparencia: fondo blanco
+                    output = Image.new('RGB', image.size, 'white')
+                    output.paste(image, mask=image.split()[3])
+                name = derivative_name(filename, size, ext)
+                fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        output.save(f, pil_format, **options)
+                    os.replace(tmp_path, os.path.join(folder, name))
+                except Exception:
+                    os.unlink(tmp_path)
+                    raise
+                generated.append(name)
+    return generated
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('IMAGE_WORKERS', '2')),
+                    thread_name_prefix='image-derivatives'
+                )
+    return _executor
+
+
+def _generate_logged(original_path):
+    try:
+        generated = generate_derivatives(original_path)
+        logger.info(f"Generated {len(generated)} derivatives for {os.path.basename(original_path)}")
+        return generated
+    except Exception as e:
+        logger.error(f"Error generating derivatives for {original_path}: {str(e)}")
+        return []
+
+
+def schedule_derivatives(original_path):
+    """Encola la generación de derivados en el pool de workers de imágenes"""
+    return _get_executor().submit(_generate_logged, original_path)
@@ -0,0 +1,193 @@
+"""
+Registro de logs sin bloquear las peticiones.
+
+Los hilos de las peticiones sólo filtran y encolan el registro; un hilo
+de fondo por proceso lo formatea (JSON por defecto) y lo escribe. Si la
+cola se llena, los registros se descartan y se cuentan en lugar de frenar
+al worker.
+
+Las rutas muy frecuentes pueden muestrearse o limitarse con
+`LOG_SAMPLING`, por endpoint de Flask::
+
+    LOG_SAMPLING="main.get_fichas=0.01,get_ficha=5/s"
+
+`0.01` deja pasar el 1 % de los registros y `5/s` como mucho cinco por
+segundo. Sólo afecta a los niveles inferiores a WARNING.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+# Atributos propios de LogRecord: el resto son campos de `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de `extra` y de la petición"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def parse_sampling(spec):
+    """`'endpoint=0.1,otro=5/s'` -> {endpoint: ('ratio', 0.1), otro: ('rate', 5.0)}"""
+    rules = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        endpoint, _, value = item.partition('=')
+        value = value.strip()
+        if value.endswith('/s'):
+            rules[endpoint.strip()] = ('rate', float(value[:-2]))
+        else:
+            rules[endpoint.strip()] = ('ratio', float(value))
+    return rules
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Añade el endpoint, método y ruta de la petición y aplica el muestreo.
+
+    Se ejecuta en el hilo de la petición (el único que tiene el contexto),
+    antes de encolar, así que los registros descartados no cuestan más.
+    """
+
+    def __init__(self, sampling=None):
+        super().__init__()
+        self.sampling = sampling or {}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _allow(self, endpoint):
+        rule = self.sampling.get(endpoint)
+        if rule is None:
+            return True
+        kind, value = rule
+        if kind == 'ratio':
+            return random.random() < value
+        now = int(time.monotonic())
+        with self._lock:
+            second, count = self._windows.get(endpoint, (now, 0))
+            if second != now:
+                second, count = now, 0
+            self._windows[endpoint] = (second, count + 1)
+            return count < value
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        endpoint = request.endpoint or 'unmatched'
+        if record.levelno < logging.WARNING and not self._allow(endpoint):
+            return False
+        record.endpoint = endpoint
+        record.method = request.method
+        record.path = request.path
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    QueueHandler con su propio hilo escritor.
+
+    El hilo se arranca con el primer registro de cada proceso, así que
+    también funciona en los workers creados con fork.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self.queue = queue.Queue(self.queue.maxsize)
+                    self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                    self._listener.start()
+                    self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Sólo se resuelven los argumentos y la traza; el formato lo aplica el hilo escritor
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Escribe lo pendiente y detiene el hilo (al salir del proceso)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.dropped}
+
+
+_handler = None
+
+
+def configure_logging(app):
+    """
+    Envía los logs de la aplicación (y de las librerías) a la cola.
+
+    `LOG_LEVEL` fija el nivel, `LOG_FORMAT` elige 'json' o 'text',
+    `LOG_QUEUE_SIZE` acota la cola y `LOG_SAMPLING` muestrea por endpoint.
+    """
+    global _handler
+    if _handler is None:
+        target = logging.StreamHandler(sys.stderr)
+        if os.getenv('LOG_FORMAT', 'json').lower() == 'text':
+            target.setFormatter(logging.Formatter(TEXT_FORMAT))
+        else:
+            target.setFormatter(JSONFormatter())
+        _handler = BackgroundQueueHandler(target, maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        _handler.addFilter(RequestContextFilter(parse_sampling(os.getenv('LOG_SAMPLING'))))
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        atexit.register(_handler.stop)
+
+    # Sin el handler síncrono de Flask los registros de app.logger llegan a la cola del root
+    from flask.logging import default_handler
+
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(logging.NOTSET)
+    return _handler
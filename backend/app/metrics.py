@@ -0,0 +1,457 @@
+"""
+Instrumentación del backend: métricas Prometheus y perfiles de peticiones lentas.
+
+Cada proceso acumula sus métricas en memoria y las vuelca cada pocos
+segundos a `METRICS_DIR/metrics-<pid>.json` (por defecto, `metrics/` en la
+carpeta instance de la aplicación); `/metrics` suma los archivos de los
+workers vivos, así que cualquier worker de gunicorn devuelve el total del
+servidor. Cuando un worker se reinicia sus contadores salen del
+total, lo que Prometheus trata como un reinicio normal de contador.
+
+Con `PROFILE_SLOW_MS` se activa un perfilador por muestreo: mientras hay
+peticiones en curso, un hilo toma sus pilas cada `PROFILE_INTERVAL_MS` y,
+si una petición supera el umbral, escribe sus pilas en formato "folded"
+(`PROFILE_DIR/*.folded`), listo para flamegraph.pl o speedscope.
+"""
+import atexit
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, g, has_app_context, request
+
+PREFIX = 'motosegura_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# nombre -> (tipo, ayuda, buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Peticiones atendidas', None),
+    'http_request_duration_seconds': ('histogram', 'Latencia de las peticiones', LATENCY_BUCKETS),
+    'db_statement_duration_seconds': ('histogram', 'Duración de cada sentencia SQL', SQL_BUCKETS),
+    'db_statements_per_request': ('histogram', 'Sentencias SQL por petición', STATEMENT_COUNT_BUCKETS),
+    'db_seconds_total': ('counter', 'Tiempo en SQL de las peticiones', None),
+    'operation_duration_seconds': ('histogram', 'Duración de operaciones costosas (QR, imágenes)', LATENCY_BUCKETS),
+    'ratelimit_rejections_total': ('counter', 'Peticiones rechazadas por el rate limiter', None),
+    'cache_hits_total': ('counter', 'Aciertos de caché', None),
+    'cache_misses_total': ('counter', 'Fallos de caché', None),
+    'cache_entries': ('gauge', 'Entradas en las cachés en memoria', None),
+    'slow_request_profiles_total': ('counter', 'Perfiles escritos de peticiones lentas', None),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas del proceso, con volcado a un archivo por worker.
+
+    Las fuentes de estadísticas (`register_stats`) se leen al volcar: cada
+    una devuelve el `stats()` de una caché y se publica como aciertos,
+    fallos y entradas.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._stats_sources = {}
+        self.reset()
+
+    def reset(self):
+        """Vacía las métricas (p. ej. en el hijo tras un fork, para no contar dos veces lo del padre)"""
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self._last_flush = 0.0
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, _labels_key(labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def register_stats(self, name, stats):
+        """Publica las estadísticas de una caché: `stats()` devuelve hits*/misses/entries"""
+        self._stats_sources[name] = stats
+
+    def _stats_samples(self):
+        counters, gauges = [], []
+        for cache, stats in self._stats_sources.items():
+            try:
+                values = stats()
+            except Exception:
+                continue
+            for field, value in values.items():
+                if field == 'misses':
+                    counters.append(('cache_misses_total', {'cache': cache}, value))
+                elif field.startswith('hits'):
+                    tier = field[len('hits_'):] or 'all'
+                    counters.append(('cache_hits_total', {'cache': cache, 'tier': tier}, value))
+                elif field == 'entries':
+                    gauges.append(('cache_entries', {'cache': cache}, value))
+        return counters, gauges
+
+    def snapshot(self):
+        """Estado serializable del proceso (los histogramas con buckets no acumulados)"""
+        stats_counters, gauges = self._stats_samples()
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(entry[0]), entry[1], entry[2]]
+                          for (name, labels), entry in self._histograms.items()]
+        counters.extend([name, sorted(labels.items()), value] for name, labels, value in stats_counters)
+        return {
+            'counters': counters,
+            'gauges': [[name, sorted(labels.items()), value] for name, labels, value in gauges],
+            'histograms': histograms,
+        }
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def flush(self, force=False):
+        """Vuelca el estado al archivo del worker (como mucho una vez por intervalo)"""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, self._path(os.getpid()))
+        except OSError:
+            pass
+
+    def _worker_snapshots(self):
+        """Estados de todos los workers vivos; borra los archivos de procesos terminados"""
+        if not self.directory:
+            yield self.snapshot()
+            return
+        self.flush(force=True)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                pid = int(name[len('metrics-'):-len('.json')])
+            except ValueError:
+                continue
+            if not _pid_alive(pid):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def collect(self):
+        """Suma los estados de todos los workers"""
+        counters, gauges, histograms = {}, {}, {}
+        for state in self._worker_snapshots():
+            for name, labels, value in state['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in state['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+            for name, labels, buckets, total, count in state['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                entry = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], buckets)]
+                entry[1] += total
+                entry[2] += count
+        return counters, gauges, histograms
+
+    def render(self):
+        """Todas las métricas en el formato de texto de Prometheus"""
+        counters, gauges, histograms = self.collect()
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in gauges.items():
+            samples.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, total, count) in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket in zip(METRICS[name][2], buckets):
+                cumulative += bucket
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+
+        output = []
+        for name, (kind, help_text, _) in METRICS.items():
+            if name not in samples:
+                continue
+            output.append(f"# HELP {PREFIX}{name} {help_text}")
+            output.append(f"# TYPE {PREFIX}{name} {kind}")
+            output.extend(sorted(samples[name]))
+        return '\n'.join(output) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    return str(value)
+
+
+# Sin METRICS_DIR, init_metrics usa la carpeta instance de la aplicación; vacío, sólo este proceso
+registry = MetricsRegistry(
+    directory=os.getenv('METRICS_DIR'),
+    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset)
+atexit.register(registry.flush, True)
+
+
+@contextmanager
+def timed(operation):
+    """Mide una operación costosa: `with timed('qr_render'): ...` (también como decorador)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('operation_duration_seconds', time.perf_counter() - start, operation=operation)
+
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo de las peticiones en curso.
+
+    Un único hilo por proceso recorre `sys._current_frames()` cada
+    `interval` segundos y acumula la pila de cada hilo que está atendiendo
+    una petición; si no hay ninguna, el hilo espera sin consumir CPU.
+    """
+
+    def __init__(self, threshold, interval=0.005, directory=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'motosegura-profiles')
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Un hilo por proceso: tras un fork el del padre no existe en el hijo
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._active = {}
+                    threading.Thread(target=self._run, name='request-profiler', daemon=True).start()
+
+    def begin(self):
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+        self._wakeup.set()
+
+    def end(self, duration, endpoint):
+        """Termina el muestreo de la petición actual y escribe su perfil si fue lenta"""
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._wakeup.clear()
+        if stacks and duration >= self.threshold:
+            self._write(stacks, duration, endpoint)
+            registry.inc('slow_request_profiles_total', endpoint=endpoint)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def _write(self, stacks, duration, endpoint):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{endpoint}-{os.getpid()}.folded"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name.replace('/', '_')), 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError:
+            pass
+
+
+def _collapse(frame):
+    """Pila en formato folded: de la raíz a la hoja, separada por ';'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names)).replace(' ', '_')
+
+
+_sql_listening = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    registry.observe('db_statement_duration_seconds', elapsed)
+    request_stats = g.get('_metrics') if has_app_context() else None
+    if request_stats is not None:
+        request_stats['sql_count'] += 1
+        request_stats['sql_time'] += elapsed
+
+
+def _listen_sql():
+    global _sql_listening
+    if not _sql_listening:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _sql_listening = True
+
+
+def init_metrics(app, limiter=None, authorize=None):
+    """
+    Instrumenta `app` y registra `/metrics`.
+
+    `METRICS_ENABLED=false` lo desactiva todo. `/metrics` exige
+    `Authorization: Bearer <METRICS_TOKEN>` o que `authorize()` (p. ej. la
+    comprobación de la API key de la aplicación) devuelva True; sin
+    ninguno de los dos queda abierto y sólo debe exponerse en la red interna.
+    """
+    if os.getenv('METRICS_ENABLED', 'true').lower() == 'false':
+        return
+
+    if registry.directory is None:
+        registry.directory = os.path.join(app.instance_path, 'metrics')
+    _listen_sql()
+    slow_ms = os.getenv('PROFILE_SLOW_MS')
+    profiler = SamplingProfiler(
+        threshold=float(slow_ms) / 1000,
+        interval=float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000,
+        directory=os.getenv('PROFILE_DIR'),
+    ) if slow_ms else None
+    token = os.getenv('METRICS_TOKEN')
+
+    def start_request_metrics():
+        g._metrics = {'start': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0}
+        if profiler:
+            profiler.begin()
+
+    # Antes que el rate limiter, para medir también las peticiones que rechaza con 429
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request_metrics)
+
+    def finish_request_metrics(stats, endpoint, method, status):
+        duration = time.perf_counter() - stats['start']
+        registry.inc('http_requests_total', endpoint=endpoint, method=method, status=str(status))
+        registry.observe('http_request_duration_seconds', duration, endpoint=endpoint, method=method)
+        registry.observe('db_statements_per_request', stats['sql_count'], endpoint=endpoint)
+        registry.inc('db_seconds_total', stats['sql_time'], endpoint=endpoint)
+        if status == 429:
+            registry.inc('ratelimit_rejections_total', endpoint=endpoint)
+        if profiler:
+            profiler.end(duration, endpoint)
+        registry.flush()
+
+    @app.after_request
+    def record_request_metrics(response):
+        stats = g.get('_metrics')
+        if stats is None or stats.get('closing'):
+            return response
+        stats['closing'] = True
+        # La regla de la ruta (no la URL) mantiene acotado el número de series
+        endpoint, method, status = request.endpoint or 'unmatched', request.method, response.status_code
+        # Se registra al cerrar la respuesta: un listado en streaming sigue leyendo filas (y
+        # sumando sentencias a `g._metrics`) después de after_request
+        response.call_on_close(lambda: finish_request_metrics(stats, endpoint, method, status))
+        return response
+
+    if profiler:
+        @app.teardown_request
+        def discard_request_profile(exc):
+            # Si la petición terminó sin pasar por after_request
+            stats = g.pop('_metrics', None)
+            if stats is not None and not stats.get('closing'):
+                profiler.end(0, request.endpoint or 'unmatched')
+
+    def authorized():
+        if token and request.headers.get('Authorization') == f"Bearer {token}":
+            return True
+        if authorize is not None:
+            return authorize()
+        return not token
+
+    def metrics_view():
+        if not authorized():
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    if limiter is not None:
+        metrics_view = limiter.exempt(metrics_view)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
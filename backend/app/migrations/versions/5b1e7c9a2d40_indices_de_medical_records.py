@@ -0,0 +1,29 @@
+"""indices de medical_records
+
+Revision ID: 5b1e7c9a2d40
+Revises: 8ec8dd5b8e1b
+Create Date: 2026-10-18 18:05:12.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7c9a2d40'
+down_revision = '8ec8dd5b8e1b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Las bases creadas con create_all antes de las migraciones pueden tenerlos ya
+    op.create_index(op.f('ix_medical_records_created_at'), 'medical_records', ['created_at'],
+                    unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_medical_records_updated_at'), 'medical_records', ['updated_at'],
+                    unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_medical_records_updated_at'), table_name='medical_records')
+    op.drop_index(op.f('ix_medical_records_created_at'), table_name='medical_records')
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask import request
 import datetime
+from .images import derivative_urls
+from .ids import IdAllocator
 
 db = SQLAlchemy()
 
@@ -16,8 +18,14 @@ class MedicalRecord(db.Model):
     allergies = db.Column(db.Text, nullable=True)
     medications = db.Column(db.Text, nullable=True)
     profile_image = db.Column(db.String(255), default='default.png')
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    # Se actualiza en cada escritura; su máximo (indexado) forma parte de la ETag del listado
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
+    
+    @staticmethod
+    def new_id():
+        """Genera un ID nuevo sin consultar la tabla"""
+        return record_ids.next_id(db.engine)
     
     def to_dict(self, include_image_url=False):
         """
@@ -29,24 +37,67 @@ class MedicalRecord(db.Model):
         Returns:
             dict: Diccionario con los datos del registro médico.
         """
+        row = tuple(getattr(self, column.key) for column in RECORD_ROW_COLUMNS)
+        return record_row_serializer(include_image_url)(row)
+    
+    @staticmethod
+    def image_urls(profile_image):
+        """
+        URLs absolutas de la imagen de perfil según el host de la petición actual.
+        
+        Se calculan aparte de `to_dict` para poder cachear el resto del
+        registro, que no depende del host.
+        """
+        urls = {}
+        # Obtener host base desde el request actual
+        if profile_image and request:
+            host_url = request.host_url.rstrip('/')
+            urls['foto_url_completa'] = f"{host_url}/uploads/{profile_image}"
+            # Versiones redimensionadas (thumb, card, full) en WebP y JPEG
+            if profile_image != 'default.png':
+                urls['fotos'] = derivative_urls(f"{host_url}/uploads", profile_image)
+        return urls
+
+# IDs de registro: 7 caracteres sin orden aparente, reservados por bloques
+record_ids = IdAllocator(MedicalRecord.__tablename__)
+
+# Columnas que lee `record_row_serializer`, en su orden (los listados las seleccionan como tuplas)
+RECORD_ROW_COLUMNS = (
+    MedicalRecord.id, MedicalRecord.first_name, MedicalRecord.last_name, MedicalRecord.blood_type,
+    MedicalRecord.emergency_contact_name, MedicalRecord.emergency_contact_phone, MedicalRecord.allergies,
+    MedicalRecord.medications, MedicalRecord.profile_image, MedicalRecord.created_at,
+)
+
+def record_row_serializer(include_image_url=False):
+    """
+    Serializador de filas de `RECORD_ROW_COLUMNS` con el formato de `to_dict`.
+    
+    El host de las URLs de imagen se calcula una vez al crearlo, no por fila,
+    así que un listado crea un serializador por petición.
+    """
+    base_url = None
+    if include_image_url and request:
+        base_url = f"{request.host_url.rstrip('/')}/uploads"
+    
+    def serialize(row):
+        (record_id, first_name, last_name, blood_type, contact_name, contact_phone,
+         allergies, medications, profile_image, created_at) = row
         record_dict = {
-            'id': self.id,
-            'nombre': self.first_name,
-            'apellido': self.last_name,
-            'tipo_sangre': self.blood_type,
-            'contacto_emergencia': self.emergency_contact_name,
-            'numero_contacto': self.emergency_contact_phone,
-            'alergias': self.allergies or '',
-            'medicaciones': self.medications or '',
-            'foto_url': self.profile_image,
-            'fecha_registro': self.created_at.strftime('%Y-%m-%d')
+            'id': record_id,
+            'nombre': first_name,
+            'apellido': last_name,
+            'tipo_sangre': blood_type,
+            'contacto_emergencia': contact_name,
+            'numero_contacto': contact_phone,
+            'alergias': allergies or '',
+            'medicaciones': medications or '',
+            'foto_url': profile_image,
+            'fecha_registro': created_at.date().isoformat(),
         }
-        
-        # Incluir URLs absolutas para las imágenes cuando sea solicitado
-        if include_image_url and self.profile_image:
-            # Obtener host base desde el request actual
-            if request:
-                host_url = request.host_url.rstrip('/')
-                record_dict['foto_url_completa'] = f"{host_url}/uploads/{self.profile_image}"
-        
-        return record_dict
\ No newline at end of file
+        if base_url and profile_image:
+            record_dict['foto_url_completa'] = f"{base_url}/{profile_image}"
+            # Versiones redimensionadas (thumb, card, full) en WebP y JPEG
+            if profile_image != 'default.png':
+                record_dict['fotos'] = derivative_urls(base_url, profile_image)
+        return record_dict
+    return serialize
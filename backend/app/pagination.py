@@ -0,0 +1,169 @@
+import base64
+import datetime
+import json
+
+from flask import Response, stream_with_context
+from sqlalchemy import and_, or_
+
+from .serialization import dumps, iter_chunks
+
+# Límites por defecto para los listados paginados
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Número de filas que se piden al cursor del servidor en cada viaje
+STREAM_BATCH_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """El cursor recibido no es válido o está corrupto"""
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Convierte el parámetro `limit` en un entero acotado entre 1 y `maximum`"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit debe ser un número entero')
+    if limit < 1:
+        raise ValueError('limit debe ser mayor que cero')
+    return min(limit, maximum)
+
+
+def encode_cursor(values):
+    """Codifica los valores de la clave de ordenación en un token opaco"""
+    payload = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_values(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor('cursor inválido')
+    if not isinstance(values, list):
+        raise InvalidCursor('cursor inválido')
+    return values
+
+
+def decode_cursor(token, columns):
+    """Decodifica un cursor y convierte cada valor al tipo de su columna"""
+    values = _decode_values(token)
+    if len(values) != len(columns):
+        raise InvalidCursor('cursor inválido')
+
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and _is_datetime(column):
+            try:
+                value = datetime.datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise InvalidCursor('cursor inválido')
+        decoded.append(value)
+    return decoded
+
+
+def encode_offset(offset):
+    """Cursor opaco para resultados que no admiten keyset (p. ej. ordenados por relevancia)"""
+    return encode_cursor([offset])
+
+
+def decode_offset(token):
+    """Decodifica un cursor creado con `encode_offset`; sin cursor devuelve 0"""
+    if not token:
+        return 0
+    values = _decode_values(token)
+    if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+        raise InvalidCursor('cursor inválido')
+    return values[0]
+
+
+def _is_datetime(column):
+    try:
+        return column.type.python_type is datetime.datetime
+    except NotImplementedError:
+        return False
+
+
+def keyset_filter(columns, values):
+    """
+    Construye la condición `(c1, c2, ...) > (v1, v2, ...)` de forma portable.
+
+    Se expande como `c1 > v1 OR (c1 = v1 AND c2 > v2) ...` para que funcione
+    igual en SQLite y PostgreSQL y pueda aprovechar el índice de la clave.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, column > values[i]))
+    return or_(*clauses)
+
+
+def keyset_page(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE, row_key=None):
+    """
+    Devuelve una página de `query` ordenada por `columns` a partir de `cursor`.
+
+    `row_key` extrae de una fila los valores de `columns`; por defecto se leen
+    los atributos con el mismo nombre que cada columna.
+
+    Returns:
+        tuple: (filas, siguiente_cursor). `siguiente_cursor` es None en la última página.
+    """
+    if cursor:
+        query = query.filter(keyset_filter(columns, decode_cursor(cursor, columns)))
+
+    # Pedimos una fila extra para saber si hay más páginas sin hacer un COUNT
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = row_key(last) if row_key else [getattr(last, c.key) for c in columns]
+        next_cursor = encode_cursor(values)
+    return rows, next_cursor
+
+
+def iter_query(query, columns, batch_size=STREAM_BATCH_SIZE):
+    """Itera una consulta con un cursor del servidor sin cargarla completa en memoria"""
+    return query.order_by(*columns).yield_per(batch_size)
+
+
+def wants_stream(req):
+    """Indica el formato de streaming pedido por el cliente: 'ndjson', 'json' o None"""
+    fmt = req.args.get('format', '').lower()
+    if fmt == 'ndjson' or 'application/x-ndjson' in req.headers.get('Accept', ''):
+        return 'ndjson'
+    if fmt == 'json' or req.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return 'json'
+    return None
+
+
+def stream_ndjson(rows, serialize):
+    """Respuesta NDJSON que emite las filas, una por línea, a medida que se leen"""
+    def generate():
+        for chunk in iter_chunks(rows, serialize, separator=b'\n'):
+            yield chunk + b'\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def stream_json_array(rows, serialize, key, envelope=None):
+    """
+    Respuesta JSON `{..., key: [...]}` generada por fragmentos de filas.
+
+    El sobre se mantiene igual que el de `jsonify` para que los clientes
+    existentes no noten la diferencia.
+    """
+    envelope = envelope or {}
+
+    def generate():
+        yield dumps(envelope)[:-1] + (b',' if envelope else b'') + dumps(key) + b':['
+        first = True
+        for chunk in iter_chunks(rows, serialize):
+            yield chunk if first else b',' + chunk
+            first = False
+        yield b']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
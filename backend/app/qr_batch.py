@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import unicodedata
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+
+from .metrics import timed
+from .qr_cache import get_qr_cache, qr_cache_key, render_qr_png
+
+# Formatos de salida soportados para los lotes de QR
+BATCH_FORMATS = {
+    'pdf': ('application/pdf', 'pdf'),
+    'png': ('image/png', 'png'),
+    'zip': ('application/zip', 'zip'),
+}
+
+# Página A4 a 300 ppp con una rejilla de 4 x 5 pegatinas
+PAGE_SIZE = (2480, 3508)
+PAGE_MARGIN = 120
+GRID_COLUMNS = 4
+GRID_ROWS = 5
+LABEL_HEIGHT = 60
+
+# Por debajo de este número de QR pendientes no compensa arrancar procesos
+MIN_PARALLEL_BATCH = 16
+
+
+def _mp_context():
+    # forkserver evita heredar los hilos y locks del worker de gunicorn
+    method = os.getenv('QR_BATCH_MP_CONTEXT')
+    if not method:
+        methods = multiprocessing.get_all_start_methods()
+        method = 'forkserver' if 'forkserver' in methods else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def render_many(payloads, params=None, workers=None):
+    """
+    Renderiza una lista de QR en paralelo y devuelve los PNG en el mismo orden.
+
+    Los QR que ya están en la caché no se vuelven a renderizar; el resto se
+    reparte entre los núcleos con un pool de procesos y se guarda en la caché.
+    """
+    cache = get_qr_cache()
+    rendered = {}
+    missing = []
+    for data in payloads:
+        if data in rendered:
+            continue
+        png = cache.get(qr_cache_key(data, params))
+        if png is None:
+            missing.append(data)
+        rendered[data] = png
+
+    workers = workers or os.cpu_count() or 1
+    if missing:
+        if workers == 1 or len(missing) < MIN_PARALLEL_BATCH:
+            pngs = [render_qr_png(data, params) for data in missing]
+        else:
+            chunksize = max(1, len(missing) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context()) as pool:
+                pngs = list(pool.map(render_qr_png, missing, repeat(params), chunksize=chunksize))
+        for data, png in zip(missing, pngs):
+            cache.put(qr_cache_key(data, params), png)
+            rendered[data] = png
+
+    return [rendered[data] for data in payloads]
+
+
+def compose_pages(pngs, labels):
+    """Coloca los QR en páginas A4 con su etiqueta debajo"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    try:
+        font = ImageFont.load_default(size=LABEL_HEIGHT // 2)
+    except TypeError:
+        # Pillow < 10.1 sólo tiene la fuente bitmap de tamaño fijo
+        font = ImageFont.load_default()
+
+    per_page = GRID_COLUMNS * GRID_ROWS
+    cell_width = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) // GRID_COLUMNS
+    cell_height = (PAGE_SIZE[1] - 2 * PAGE_MARGIN) // GRID_ROWS
+    tile_size = min(cell_width, cell_height - LABEL_HEIGHT) - 20
+
+    pages = []
+    for start in range(0, len(pngs), per_page):
+        page = Image.new('RGB', PAGE_SIZE, 'white')
+        draw = ImageDraw.Draw(page)
+        for i, (png, label) in enumerate(zip(pngs[start:start + per_page], labels[start:start + per_page])):
+            row, column = divmod(i, GRID_COLUMNS)
+            x = PAGE_MARGIN + column * cell_width
+            y = PAGE_MARGIN + row * cell_height
+            tile = Image.open(BytesIO(png)).convert('RGB').resize((tile_size, tile_size), Image.NEAREST)
+            page.paste(tile, (x + (cell_width - tile_size) // 2, y))
+            # La fuente por defecto de PIL no incluye acentos
+            label = unicodedata.normalize('NFKD', label).encode('ascii', 'ignore').decode()
+            draw.text((x + cell_width // 2, y + tile_size + LABEL_HEIGHT // 2), label,
+                      fill='black', font=font, anchor='mm')
+        pages.append(page)
+    return pages
+
+
+@timed('qr_batch')
+def build_batch(pngs, labels, names, fmt='pdf'):
+    """
+    Empaqueta los QR renderizados en el formato pedido.
+
+    - pdf: un único PDF con tantas páginas como haga falta.
+    - png: la hoja en PNG; si hay varias páginas se entregan en un zip.
+    - zip: un PNG por ficha, con `names` como nombre de archivo.
+
+    Returns:
+        tuple: (bytes, mimetype, extensión)
+    """
+    if fmt not in BATCH_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}. Use uno de: {', '.join(BATCH_FORMATS)}")
+
+    output = BytesIO()
+    if fmt == 'zip':
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+            for name, png in zip(names, pngs):
+                archive.writestr(f"{name}.png", png)
+        return output.getvalue(), *BATCH_FORMATS['zip']
+
+    pages = compose_pages(pngs, labels)
+    if fmt == 'pdf':
+        pages[0].save(output, 'PDF', save_all=True, append_images=pages[1:], resolution=300)
+        return output.getvalue(), *BATCH_FORMATS['pdf']
+
+    if len(pages) == 1:
+        pages[0].save(output, 'PNG')
+        return output.getvalue(), *BATCH_FORMATS['png']
+
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        for number, page in enumerate(pages, start=1):
+            buffered = BytesIO()
+            page.save(buffered, 'PNG')
+            archive.writestr(f"hoja-{number:02d}.png", buffered.getvalue())
+    return output.getvalue(), *BATCH_FORMATS['zip']
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from flask import Response, request
+
+from .metrics import registry, timed
+
+# Parámetros de renderizado compartidos por todos los generadores de QR
+QR_PARAMS = {
+    'version': 1,
+    'error_correction': 'L',
+    'box_size': 10,
+    'border': 4,
+    'fill_color': 'black',
+    'back_color': 'white',
+}
+
+# El contenido de un QR nunca cambia para la misma clave: caché de un año
+QR_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@timed('qr_render')
+def render_qr_png(data, params=None):
+    """Renderiza un código QR como PNG y devuelve los bytes"""
+    # qrcode y PIL se importan aquí para no cargarlos hasta el primer render
+    import qrcode
+
+    params = dict(QR_PARAMS, **(params or {}))
+    error_correction = getattr(qrcode.constants, f"ERROR_CORRECT_{params['error_correction']}")
+    qr = qrcode.QRCode(
+        version=params['version'],
+        error_correction=error_correction,
+        box_size=params['box_size'],
+        border=params['border'],
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color=params['fill_color'], back_color=params['back_color'])
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def qr_cache_key(data, params=None):
+    """Clave de contenido: hash del texto del QR y de los parámetros de render"""
+    params = dict(QR_PARAMS, **(params or {}))
+    raw = json.dumps([data, sorted(params.items())], separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class QRCache:
+    """
+    Caché de dos niveles para imágenes QR.
+
+    El primer nivel es un LRU acotado en memoria del proceso; el segundo es
+    un directorio en disco compartido por todos los workers de gunicorn.
+    Las claves son hashes de contenido, así que las entradas nunca caducan.
+    """
+
+    def __init__(self, max_entries=1024, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def _remember(self, key, png):
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Busca la imagen en memoria y luego en disco; devuelve None si no existe"""
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self.hits_memory += 1
+                return png
+
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    png = f.read()
+            except OSError:
+                png = None
+            if png:
+                self.hits_disk += 1
+                self._remember(key, png)
+                return png
+        return None
+
+    def put(self, key, png):
+        """Guarda la imagen en ambos niveles"""
+        self._remember(key, png)
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Escritura atómica para que otro worker nunca lea un archivo a medias
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError:
+            # El disco es una optimización; si falla seguimos con la memoria
+            pass
+
+    def get_or_render(self, data, params=None):
+        """Devuelve (clave, png) usando la caché o renderizando si hace falta"""
+        key = qr_cache_key(data, params)
+        png = self.get(key)
+        if png is None:
+            self.misses += 1
+            png = render_qr_png(data, params)
+            self.put(key, png)
+        return key, png
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+        }
+
+
+_qr_cache = None
+_qr_cache_lock = threading.Lock()
+
+
+def get_qr_cache():
+    """Devuelve la caché de QR del proceso, configurada desde variables de entorno"""
+    global _qr_cache
+    if _qr_cache is None:
+        with _qr_cache_lock:
+            if _qr_cache is None:
+                directory = os.getenv('QR_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'motosegura-qr'))
+                _qr_cache = QRCache(
+                    max_entries=int(os.getenv('QR_CACHE_SIZE', '1024')),
+                    directory=directory or None,
+                )
+    return _qr_cache
+
+
+# Sólo se publica si algún QR ha llegado a crear la caché
+registry.register_stats('qr', lambda: _qr_cache.stats() if _qr_cache else {})
+
+
+def qr_png_response(data, params=None):
+    """
+    Respuesta PNG para un QR con ETag fuerte y Cache-Control inmutable.
+
+    Si el cliente ya tiene la imagen (If-None-Match) se responde 304 sin
+    leer ni renderizar nada.
+    """
+    key = qr_cache_key(data, params)
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+    else:
+        _, png = get_qr_cache().get_or_render(data, params)
+        response = Response(png, mimetype='image/png')
+    response.set_etag(key)
+    response.headers['Cache-Control'] = QR_CACHE_CONTROL
+    return response
@@ -0,0 +1,269 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from math import floor
+
+from limits.storage import MovingWindowSupport, Storage
+
+try:
+    from limits.storage import SlidingWindowCounterSupport
+except ImportError:  # limits < 4.1 no tiene ventana deslizante por contadores
+    SlidingWindowCounterSupport = None
+
+# Archivo por defecto, compartido por todos los workers de la misma máquina
+DEFAULT_RATELIMIT_DB = os.path.join(tempfile.gettempdir(), 'motosegura-ratelimit.db')
+
+# Cada cuántas escrituras (por proceso) se eliminan las entradas caducadas
+PURGE_EVERY = 1000
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS counters (
+           key TEXT PRIMARY KEY,
+           value INTEGER NOT NULL,
+           expires_at REAL NOT NULL
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS events (
+           key TEXT NOT NULL,
+           at REAL NOT NULL,
+           expires_at REAL NOT NULL
+       )""",
+    "CREATE INDEX IF NOT EXISTS ix_events_key_at ON events (key, at)",
+    "CREATE INDEX IF NOT EXISTS ix_events_expires_at ON events (expires_at)",
+)
+
+_INCR_SQL = """
+    INSERT INTO counters (key, value, expires_at) VALUES (:key, :amount, :now + :expiry)
+    ON CONFLICT (key) DO UPDATE SET
+        value = CASE WHEN expires_at <= :now THEN :amount ELSE value + :amount END,
+        expires_at = CASE WHEN expires_at <= :now THEN :now + :expiry ELSE expires_at END
+    RETURNING value
+"""
+
+
+def sqlite_path_from_uri(uri):
+    """
+    Ruta del archivo a partir de una URI con el formato de SQLAlchemy:
+    `sqlite:///relativa.db` o `sqlite:////ruta/absoluta.db`.
+    """
+    path = uri.split('://', 1)[1] if '://' in uri else ''
+    if path.startswith('/'):
+        path = path[1:]
+    return path.split('?', 1)[0] or DEFAULT_RATELIMIT_DB
+
+
+class SQLiteStorage(Storage, MovingWindowSupport, *(
+        [SlidingWindowCounterSupport] if SlidingWindowCounterSupport else [])):
+    """
+    Almacenamiento de límites de peticiones en un archivo SQLite en modo WAL.
+
+    Todos los workers de gunicorn de la máquina comparten el mismo archivo,
+    por lo que los límites son exactos entre procesos sin necesidad de Redis.
+    Cada comprobación es una única sentencia (o una transacción corta con
+    `BEGIN IMMEDIATE`) sobre una conexión ya abierta por hilo; con WAL y
+    `synchronous=OFF` no hay fsync, así que cuesta decenas de microsegundos.
+    Los contadores son efímeros: tras un corte de luz se pierde, como mucho,
+    el último puñado de incrementos.
+
+    Se registra con el esquema `sqlite://`, p. ej.::
+
+        Limiter(storage_uri='sqlite:////var/lib/motosegura/ratelimit.db')
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = sqlite_path_from_uri(uri or '')
+        self.timeout = float(options.get('timeout', 5))
+        self._local = threading.local()
+        self._writes = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        try:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+        finally:
+            connection.close()
+
+    # -- Conexiones ---------------------------------------------------------
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('PRAGMA temp_store=MEMORY')
+        return connection
+
+    @property
+    def _connection(self):
+        # Una conexión por hilo y por proceso (no se reutiliza tras un fork)
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+        return local.connection
+
+    def _maybe_purge(self, connection, now):
+        self._writes += 1
+        if self._writes % PURGE_EVERY:
+            return
+        connection.execute('DELETE FROM counters WHERE expires_at <= ?', (now,))
+        connection.execute('DELETE FROM events WHERE expires_at <= ?', (now,))
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    # -- Contadores (ventana fija) ------------------------------------------
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        connection = self._connection
+        value = connection.execute(
+            _INCR_SQL, {'key': key, 'amount': amount, 'now': now, 'expiry': expiry}
+        ).fetchone()[0]
+        if elastic_expiry:
+            connection.execute('UPDATE counters SET expires_at = ? WHERE key = ?', (now + expiry, key))
+        self._maybe_purge(connection, now)
+        return value
+
+    def decr(self, key, amount=1):
+        row = self._connection.execute(
+            'UPDATE counters SET value = max(value - ?, 0) WHERE key = ? AND expires_at > ? RETURNING value',
+            (amount, key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key):
+        row = self._connection.execute(
+            'SELECT value FROM counters WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection.execute(
+            'SELECT expires_at FROM counters WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        connection = self._connection
+        counters = connection.execute('DELETE FROM counters').rowcount
+        events = connection.execute('DELETE FROM events').rowcount
+        return max(counters, events)
+
+    def clear(self, key):
+        connection = self._connection
+        connection.execute('DELETE FROM counters WHERE key = ?', (key,))
+        connection.execute('DELETE FROM events WHERE key = ?', (key,))
+
+    # -- Ventana móvil ------------------------------------------------------
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            count = connection.execute(
+                'SELECT count(*) FROM events WHERE key = ? AND at > ?', (key, now - expiry)
+            ).fetchone()[0]
+            if count + amount > limit:
+                connection.execute('ROLLBACK')
+                return False
+            connection.executemany(
+                'INSERT INTO events (key, at, expires_at) VALUES (?, ?, ?)',
+                [(key, now, now + expiry)] * amount
+            )
+            self._maybe_purge(connection, now)
+            connection.execute('COMMIT')
+            return True
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        row = self._connection.execute(
+            'SELECT min(at), count(*) FROM events WHERE key = ? AND at > ?', (key, now - expiry)
+        ).fetchone()
+        if not row[1]:
+            return now, 0
+        return row[0], row[1]
+
+    # -- Ventana deslizante por contadores ----------------------------------
+
+    @staticmethod
+    def _sliding_window_keys(key, expiry, now):
+        return f"{key}/{int((now - expiry) / expiry)}", f"{key}/{int(now / expiry)}"
+
+    def _sliding_window_info(self, connection, key, expiry, now):
+        previous_key, current_key = self._sliding_window_keys(key, expiry, now)
+        counts = dict(connection.execute(
+            'SELECT key, value FROM counters WHERE key IN (?, ?) AND expires_at > ?',
+            (previous_key, current_key, now)
+        ).fetchall())
+        previous_count = counts.get(previous_key, 0)
+        current_count = counts.get(current_key, 0)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        connection = self._connection
+        # La lectura y el incremento van en la misma transacción: sin carreras entre workers
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window_info(
+                connection, key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                connection.execute('ROLLBACK')
+                return False
+            connection.execute(_INCR_SQL, {
+                'key': self._sliding_window_keys(key, expiry, now)[1],
+                'amount': amount, 'now': now, 'expiry': 2 * expiry,
+            }).fetchone()
+            self._maybe_purge(connection, now)
+            connection.execute('COMMIT')
+            return True
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_sliding_window(self, key, expiry):
+        return self._sliding_window_info(self._connection, key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self._sliding_window_keys(key, expiry, time.time())
+        self._connection.execute('DELETE FROM counters WHERE key IN (?, ?)', (previous_key, current_key))
+
+
+def default_strategy():
+    """Ventana deslizante por contadores si la versión de `limits` la soporta"""
+    return 'sliding-window-counter' if SlidingWindowCounterSupport else 'moving-window'
+
+
+def ratelimit_storage_uri():
+    """
+    URI de almacenamiento de límites: Redis si está configurado y, si no,
+    el archivo SQLite compartido entre workers.
+    """
+    return (os.environ.get('REDIS_URL')
+            or os.environ.get('RATELIMIT_STORAGE_URI')
+            or f"sqlite:///{DEFAULT_RATELIMIT_DB}")
@@ -1,9 +1,26 @@
 from flask import Blueprint, request, jsonify, send_from_directory, render_template, current_app, url_for, after_this_request
-from .models import db, MedicalRecord
-from .utils import generate_qr_code, require_api_key, save_profile_image, get_persistent_upload_folder
+from .models import db, MedicalRecord, RECORD_ROW_COLUMNS, record_row_serializer, record_ids
+from .utils import generate_qr_code, require_api_key, save_profile_image, get_upload_folders
+from .images import ORIGINAL_EXTENSIONS, derivative_name, parse_derivative
+from .snapshots import SnapshotStore
+from .file_serving import get_upload_index, send_upload, upload_offload_settings
+from .cache import get_record_cache
+from .metrics import registry
+from .etags import not_modified, payload_etag, strong_etag, tag_response
+from .serialization import json_response
+from .validation import blood_type_error
+from .upload_gc import referenced_stems, release_images
+from .ids import is_valid_id
+from .bulk_io import (IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE, Checkpoint, check_lengths, check_types, export_response,
+                      import_stream, insert_rows, new_rows, parse_format)
+from .pagination import InvalidCursor, keyset_page, iter_query, parse_limit, stream_json_array, stream_ndjson, wants_stream
+import csv
+import datetime
+import json
+import logging
 import os
 from werkzeug.exceptions import BadRequest, NotFound
-import requests
+from sqlalchemy.exc import SQLAlchemyError
 from flask_cors import cross_origin
 
 main = Blueprint('main', __name__)
@@ -27,6 +44,137 @@ def add_cors_headers(response):
 def is_mobile_device():
     return 'X-Mobile-Device' in request.headers
 
+# Caché compartida de los registros serializados (sin las URLs que dependen del host)
+record_cache = get_record_cache('record')
+registry.register_stats('record', record_cache.stats)
+
+def load_records(record_ids):
+    """Registros `record_ids` con el formato de `to_dict`, en una sola consulta"""
+    serialize = record_row_serializer()
+    rows = db.session.query(*RECORD_ROW_COLUMNS).filter(MedicalRecord.id.in_(record_ids))
+    return {row.id: serialize(row) for row in rows}
+
+def record_image_url(record):
+    """Foto de la página de emergencia: el derivado mediano (la ruta de uploads cae al original si aún no existe)"""
+    image = record.get('foto_url')
+    if not image or image == 'default.png':
+        return None
+    return f"/uploads/{derivative_name(image, 'card', 'jpg')}"
+
+# Instantáneas estáticas (JSON + HTML) de cada registro para los escaneos; SNAPSHOT_FOLDER las activa
+record_snapshots = SnapshotStore(
+    os.getenv('SNAPSHOT_FOLDER', ''), load_records,
+    lambda: (row[0] for row in iter_query(db.session.query(MedicalRecord.id), [MedicalRecord.id])),
+    record_image_url
+)
+
+def records_changed(*record_ids):
+    """Tras confirmar cambios en registros: vacía su caché y regenera sus instantáneas"""
+    record_cache.invalidate(*record_ids)
+    record_snapshots.refresh(*record_ids)
+
+def release_record_images(*filenames):
+    """Tras confirmar cambios en registros: borra las imágenes que ya no usa ninguno"""
+    release_images(filenames, get_upload_folders(),
+                   lambda stems: referenced_stems(db, MedicalRecord.profile_image, stems),
+                   forget=get_upload_index(current_app, get_upload_folders).forget)
+
+def load_record_payload(record_id):
+    """Registro serializado como JSON, desde la caché o, en un fallo, desde la base de datos"""
+    def load():
+        record = db.session.get(MedicalRecord, record_id)
+        return json.dumps(record.to_dict()).encode() if record else None
+    
+    return record_cache.get_or_load(record_id, load)
+
+def record_etag(payload):
+    """ETag de un registro: su contenido más el host de las URLs de imagen"""
+    return payload_etag(payload, request.host_url)
+
+def records_watermark():
+    """
+    Marca de agua de la tabla: cambia con cada alta (número y fecha máxima),
+    baja (número) o modificación (`updated_at` máximo), sin leer las filas.
+    """
+    count, last_update = db.session.query(
+        db.func.count(MedicalRecord.id), db.func.max(MedicalRecord.updated_at)
+    ).one()
+    return f"{count}:{last_update.isoformat() if last_update else ''}"
+
+# Campos obligatorios de un registro (alta individual e importación)
+REQUIRED_RECORD_FIELDS = ['first_name', 'last_name', 'blood_type', 'emergency_contact_name', 'emergency_contact_phone']
+
+# Campos de la exportación masiva: las columnas de la tabla, tal cual
+RECORD_EXPORT_FIELDS = [column.key for column in MedicalRecord.__table__.columns]
+
+def export_records():
+    """Diccionarios de todos los registros, leídos por lotes desde un cursor del servidor"""
+    columns = [MedicalRecord.__table__.c[field] for field in RECORD_EXPORT_FIELDS]
+    rows = iter_query(db.session.query(*columns), [MedicalRecord.id])
+    return (dict(zip(RECORD_EXPORT_FIELDS, row)) for row in rows)
+
+def _import_datetime(value, field, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid {field}: {value}')
+
+def prepare_imported_record(data):
+    """Fila completa de `medical_records` a partir de un registro importado; ValueError si no es válido"""
+    for field in REQUIRED_RECORD_FIELDS:
+        if not isinstance(data.get(field), str) or not data[field].strip():
+            raise ValueError(f'Field {field} is required')
+    blood_type_message = blood_type_error(data['blood_type'])
+    if blood_type_message:
+        raise ValueError(blood_type_message)
+    
+    now = datetime.datetime.utcnow()
+    row = {
+        'id': data.get('id') or None,
+        'first_name': data['first_name'],
+        'last_name': data['last_name'],
+        'blood_type': data['blood_type'],
+        'emergency_contact_name': data['emergency_contact_name'],
+        'emergency_contact_phone': data['emergency_contact_phone'],
+        'allergies': data.get('allergies') or '',
+        'medications': data.get('medications') or '',
+        'profile_image': data.get('profile_image') or 'default.png',
+        'created_at': _import_datetime(data.get('created_at'), 'created_at', now),
+        # Una importación cuenta como escritura: mueve la marca de agua del listado
+        'updated_at': now,
+    }
+    if row['id'] is not None and not is_valid_id(row['id']):
+        raise ValueError(f"Invalid id: {row['id']!r}")
+    message = check_types(MedicalRecord.__table__, row) or check_lengths(MedicalRecord.__table__, row)
+    if message:
+        raise ValueError(message)
+    if os.path.basename(row['profile_image']) != row['profile_image']:
+        raise ValueError('profile_image must be a file name')
+    return row
+
+def write_imported_records(rows):
+    """Inserta un lote de registros importados en una transacción; omite los IDs que ya existen"""
+    missing = [row for row in rows if not row['id']]
+    for row, record_id in zip(missing, record_ids.allocate(db.engine, len(missing))):
+        row['id'] = record_id
+    
+    connection = db.session.connection()
+    fresh, skipped = new_rows(connection, MedicalRecord.id, rows)
+    insert_rows(connection, MedicalRecord.__table__, fresh)
+    db.session.commit()
+    records_changed(*(row['id'] for row in fresh))
+    return len(fresh), skipped
+
+def mark_record_restored(record_id):
+    """Tras restaurar un registro desde una copia: mueve la marca de agua del listado y vacía su caché"""
+    MedicalRecord.query.filter_by(id=record_id).update({'updated_at': datetime.datetime.utcnow()})
+    db.session.commit()
+    records_changed(record_id)
+
 # Frontend routes
 @main.route('/')
 def index():
@@ -34,9 +182,23 @@ def index():
 
 @main.route('/record/<record_id>')
 def view_record(record_id):
-    record = MedicalRecord.query.get_or_404(record_id)
+    # La página es la misma para todos los registros (la SPA pide los datos a la API),
+    # así que no se consulta la base de datos. Con SNAPSHOT_SERVE_SCANS se responde
+    # la instantánea estática, que funciona aunque la base de datos no responda.
+    if current_app.config['SNAPSHOT_SERVE_SCANS']:
+        response = record_snapshots.send(f"{record_id}.html")
+        if response is not None:
+            return response
     return render_template('index.html')
 
+@main.route('/snapshots/<name>')
+def snapshot_file(name):
+    """Instantánea de emergencia de un registro (`<id>.html` o `<id>.json`), sin consultar la base de datos"""
+    response = record_snapshots.send(name)
+    if response is None:
+        return jsonify({'error': 'Snapshot not found'}), 404
+    return response
+
 # API routes
 @main.route('/api/records', methods=['POST'])
 def create_record():
@@ -44,19 +206,19 @@ def create_record():
         data = request.form
         
         # Validate required fields
-        required_fields = ['first_name', 'last_name', 'blood_type', 'emergency_contact_name', 'emergency_contact_phone']
-        for field in required_fields:
+        for field in REQUIRED_RECORD_FIELDS:
             if field not in data or not data[field].strip():
                 return jsonify({'error': f'Field {field} is required'}), 400
         
         # Validate blood type format
-        valid_blood_types = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
-        if data['blood_type'] not in valid_blood_types:
-            return jsonify({'error': 'Invalid blood type. Must be one of: ' + ', '.join(valid_blood_types)}), 400
+        blood_type_message = blood_type_error(data['blood_type'])
+        if blood_type_message:
+            return jsonify({'error': blood_type_message}), 400
         
         profile_image = request.files.get('profile_image')
         
         record = MedicalRecord(
+            id=MedicalRecord.new_id(),
             first_name=data['first_name'],
             last_name=data['last_name'],
             blood_type=data['blood_type'],
@@ -72,6 +234,7 @@ def create_record():
         if profile_image:
             record.profile_image = save_profile_image(profile_image, record.id)
             db.session.commit()
+        records_changed(record.id)
         
         # Generar la URL para el QR basada en la configuración del backend
         qr_host = request.headers.get('X-Frontend-Host', request.host_url.rstrip('/'))
@@ -95,12 +258,19 @@ def create_record():
 @main.route('/api/records/<record_id>', methods=['GET'])
 def get_record(record_id):
     try:
-        record = MedicalRecord.query.get(record_id)
-        if not record:
+        payload = load_record_payload(record_id)
+        if not payload:
             return jsonify({'error': 'Record not found'}), 404
         
+        etag = record_etag(payload)
+        response = not_modified(etag)
+        if response:
+            return response
+        
         # Incluir URLs absolutas para las imágenes
-        return jsonify(record.to_dict(include_image_url=True))
+        record = json.loads(payload)
+        record.update(MedicalRecord.image_urls(record['foto_url']))
+        return tag_response(jsonify(record), etag)
     except Exception as e:
         current_app.logger.error(f"Error getting record: {str(e)}")
         return jsonify({'error': 'Failed to get record'}), 500
@@ -124,10 +294,14 @@ def update_record(record_id):
         record.allergies = data.get('allergies', record.allergies)
         record.medications = data.get('medications', record.medications)
         
+        previous_image = record.profile_image
         if profile_image:
             record.profile_image = save_profile_image(profile_image, record.id)
         
         db.session.commit()
+        records_changed(record_id)
+        if record.profile_image != previous_image:
+            release_record_images(previous_image)
         return jsonify(record.to_dict(include_image_url=True))
     except Exception as e:
         current_app.logger.error(f"Error updating record: {str(e)}")
@@ -141,13 +315,64 @@ def delete_record(record_id):
         if not record:
             return jsonify({'error': 'Record not found'}), 404
         
+        image = record.profile_image
         db.session.delete(record)
         db.session.commit()
+        records_changed(record_id)
+        release_record_images(image)
         return jsonify({'message': 'Record deleted successfully'})
     except Exception as e:
         current_app.logger.error(f"Error deleting record: {str(e)}")
         return jsonify({'error': 'Failed to delete record'}), 500
 
+@main.route('/api/records/export', methods=['GET'])
+@require_api_key
+def export_records_route():
+    """Todos los registros en CSV o NDJSON (`format` o Accept), en streaming"""
+    try:
+        fmt = parse_format(request.args.get('format'), request.headers.get('Accept', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return export_response(export_records(), RECORD_EXPORT_FIELDS, fmt, 'records')
+
+@main.route('/api/records/import', methods=['POST'])
+@require_api_key
+def import_records_route():
+    """
+    Importa registros en CSV o NDJSON desde el cuerpo de la petición.
+    
+    Se inserta por lotes de `batch_size` filas, cada uno en su transacción.
+    Si la importación se interrumpe, `rows` indica las filas ya confirmadas
+    y repetir la petición con `skip=<rows>` la reanuda. El cuerpo está
+    limitado por MAX_CONTENT_LENGTH; los archivos grandes se importan con
+    `flask import-records`.
+    """
+    try:
+        fmt = parse_format(request.args.get('format'), request.content_type)
+        skip = int(request.args.get('skip', 0))
+        batch_size = min(int(request.args.get('batch_size', IMPORT_BATCH_SIZE)), MAX_IMPORT_BATCH_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if skip < 0 or batch_size < 1:
+        return jsonify({'error': 'skip and batch_size must be positive'}), 400
+    
+    progress = Checkpoint(None, 'api')
+    try:
+        result = import_stream(request.stream, fmt, prepare_imported_record, write_imported_records,
+                               batch_size, progress, skip)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Cuerpo que no es UTF-8 o CSV mal formado: los lotes anteriores ya están confirmados
+        db.session.rollback()
+        return jsonify(dict(progress.state, error=f'Invalid file: {e}')), 400
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception('Error importing records', extra={'rows': progress.state['rows']})
+        return jsonify(dict(progress.state, error='Import interrupted; resume with skip=rows')), 500
+    return jsonify(result.to_dict())
+
+# El listado elige entre JSON y NDJSON también según la cabecera Accept
+LISTING_VARY = ('Accept',)
+
 @main.route('/api/fichas', methods=['GET', 'OPTIONS'])
 @cross_origin()
 def get_fichas():
@@ -156,24 +381,53 @@ def get_fichas():
         return '', 204
         
     try:
-        # Registrar información sobre la solicitud
-        current_app.logger.info(f"Solicitud de fichas desde: {request.remote_addr}, Agente: {request.user_agent}")
-        current_app.logger.info(f"Headers: {request.headers}")
+        # Registrar información sobre la solicitud (las cabeceras completas sólo con LOG_LEVEL=DEBUG)
+        current_app.logger.info("Solicitud de fichas", extra={'remote_addr': request.remote_addr,
+                                                              'user_agent': request.user_agent.string})
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug("Headers: %s", dict(request.headers))
+        
+        # Sin cambios en la tabla desde la última descarga: 304 sin leer ni serializar filas.
+        # El formato (JSON o NDJSON) también se elige con Accept, así que forma parte de la ETag
+        stream = wants_stream(request)
+        etag = strong_etag('records', records_watermark(), request.host_url, request.query_string, stream)
+        response = not_modified(etag, LISTING_VARY)
+        if response:
+            return response
         
-        # Obtener todos los registros médicos
-        records = MedicalRecord.query.all()
+        # Orden estable por fecha de creación con el ID como desempate
+        columns = [MedicalRecord.created_at, MedicalRecord.id]
+        cursor = request.args.get('cursor')
         
-        # Convertir a JSON incluyendo URLs absolutas para las imágenes
-        fichas = [record.to_dict(include_image_url=True) for record in records]
+        # Tuplas de columnas en lugar de objetos ORM; el host de las URLs se calcula una vez
+        rows = db.session.query(*RECORD_ROW_COLUMNS)
+        serialize = record_row_serializer(include_image_url=True)
         
-        # Verificar si la solicitud proviene de un dispositivo móvil
-        if is_mobile_device():
-            current_app.logger.info(f"Solicitud desde dispositivo móvil, devolviendo {len(fichas)} fichas")
+        if stream == 'ndjson':
+            return tag_response(stream_ndjson(iter_query(rows, columns), serialize), etag, LISTING_VARY)
         
-        response_data = {'status': 'success', 'fichas': fichas}
-        current_app.logger.info(f"Enviando respuesta con {len(fichas)} fichas")
+        # Paginación por cursor (keyset) cuando el cliente la solicita
+        if stream is None and (cursor or 'limit' in request.args):
+            try:
+                limit = parse_limit(request.args.get('limit'))
+                records, next_cursor = keyset_page(rows, columns, cursor, limit)
+            except (InvalidCursor, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+            
+            fichas = [serialize(record) for record in records]
+            
+            # Verificar si la solicitud proviene de un dispositivo móvil
+            if is_mobile_device():
+                current_app.logger.info("Solicitud desde dispositivo móvil, devolviendo %d fichas", len(fichas))
+            
+            current_app.logger.info("Enviando página con %d fichas", len(fichas))
+            return tag_response(json_response({'status': 'success', 'fichas': fichas, 'next_cursor': next_cursor}), etag,
+                                LISTING_VARY)
         
-        return jsonify(response_data)
+        # Listado completo generado fila a fila desde un cursor del servidor
+        current_app.logger.info("Enviando listado completo de fichas en streaming")
+        return tag_response(stream_json_array(iter_query(rows, columns), serialize,
+                                              'fichas', envelope={'status': 'success'}), etag, LISTING_VARY)
     except Exception as e:
         current_app.logger.error(f"Error getting fichas: {str(e)}")
         return jsonify({'error': 'Failed to get records', 'details': str(e)}), 500
@@ -182,14 +436,20 @@ def get_fichas():
 @cross_origin()
 def get_ficha(ficha_id):
     try:
-        record = MedicalRecord.query.get(ficha_id)
-        if not record:
+        payload = load_record_payload(ficha_id)
+        if not payload:
             return jsonify({'error': 'Record not found'}), 404
         
+        etag = record_etag(payload)
+        response = not_modified(etag)
+        if response:
+            return response
+        
         # Incluir URL absoluta para la imagen
-        ficha = record.to_dict(include_image_url=True)
+        ficha = json.loads(payload)
+        ficha.update(MedicalRecord.image_urls(ficha['foto_url']))
         
-        return jsonify({'status': 'success', 'ficha': ficha})
+        return tag_response(jsonify({'status': 'success', 'ficha': ficha}), etag)
     except Exception as e:
         current_app.logger.error(f"Error getting ficha: {str(e)}")
         return jsonify({'error': 'Failed to get record', 'details': str(e)}), 500
@@ -197,21 +457,23 @@ def get_ficha(ficha_id):
 @main.route('/uploads/<filename>')
 def uploaded_file(filename):
     try:
-        # Agregar encabezados para caché en dispositivos móviles
-        @after_this_request
-        def add_header(response):
-            response.headers['Cache-Control'] = 'public, max-age=86400'  # 24 horas
-            return response
-            
-        # Primero intentar desde el directorio persistente
-        persistent_folder = get_persistent_upload_folder()
-        persistent_path = os.path.join(persistent_folder, filename)
+        # Índice en memoria de las carpetas persistente y de la aplicación
+        index = get_upload_index(current_app, get_upload_folders)
+        offload, accel_prefix = upload_offload_settings()
         
-        if os.path.exists(persistent_path):
-            return send_from_directory(persistent_folder, filename)
+        response = send_upload(index, filename, offload, accel_prefix)
+        if response is None:
+            # Si el derivado aún se está generando, servir el original
+            derivative = parse_derivative(filename)
+            if derivative:
+                for ext in ORIGINAL_EXTENSIONS:
+                    response = send_upload(index, f"{derivative[0]}.{ext}", offload, accel_prefix)
+                    if response is not None:
+                        break
         
-        # Si no existe en el persistente, intentar desde el directorio de la aplicación
-        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+        if response is None:
+            return jsonify({'error': 'File not found'}), 404
+        return response
     except Exception as e:
         current_app.logger.error(f"Error serving file: {str(e)}")
         return jsonify({'error': 'Failed to serve file'}), 500
@@ -0,0 +1,255 @@
+import logging
+import re
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+# Pesos de relevancia por campo (PostgreSQL usa etiquetas A-D)
+WEIGHT_LABELS = ('A', 'B', 'C', 'D')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Errores que indican que el motor no tiene FTS5 o que no se pueden crear las
+# extensiones: permisos insuficientes, extensión no instalada o no soportada
+_UNAVAILABLE_MESSAGES = ('no such module: fts5',)
+_UNAVAILABLE_PGCODES = {'42501', '58P01', '0A000'}
+
+
+def tokenize(value):
+    """Separa el texto de búsqueda en palabras, descartando símbolos"""
+    return _TOKEN_RE.findall(value or '')
+
+
+def _unavailable(error):
+    """Si `error` indica que el motor no admite el índice (y hay que usar ILIKE)"""
+    message = str(error.orig).lower()
+    if any(part in message for part in _UNAVAILABLE_MESSAGES):
+        return True
+    return getattr(error.orig, 'pgcode', None) in _UNAVAILABLE_PGCODES
+
+
+class SearchIndex:
+    """
+    Índice de búsqueda de texto completo sobre algunas columnas de una tabla.
+
+    En SQLite usa una tabla virtual FTS5 mantenida por triggers; en
+    PostgreSQL un índice GIN sobre una expresión tsvector sin acentos. En
+    ambos casos la base de datos mantiene el índice sincronizado en cada
+    INSERT, UPDATE o DELETE, incluidas las operaciones masivas. Con otros
+    motores se recurre a ILIKE.
+
+    Las búsquedas aceptan términos por campo (`{'nombre': 'juan'}`) o un
+    texto libre que busca en todos los campos; cada palabra se trata como
+    prefijo y se ignoran los acentos.
+    """
+
+    def __init__(self, table, key, fields):
+        self.table = table
+        self.key = key
+        self.fields = list(fields)
+        self.name = f"{table}_search"
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    # -- Estructuras --------------------------------------------------------
+
+    def _backend(self, engine):
+        name = engine.dialect.name
+        if name == 'sqlite':
+            return 'fts5'
+        if name == 'postgresql':
+            return 'tsvector'
+        return 'like'
+
+    def ensure(self, engine):
+        """Crea el índice y sus triggers si no existen (una vez por proceso y motor)"""
+        url = str(engine.url)
+        backend = self._backends.get(url)
+        if backend is not None:
+            return backend
+        with self._lock:
+            if url not in self._backends:
+                backend = self._backend(engine)
+                try:
+                    self._create(engine, backend)
+                except DBAPIError as error:
+                    if not _unavailable(error):
+                        logger.exception("No se pudo crear el índice %s", self.name)
+                        raise
+                    logger.warning("Índice %s no disponible en %s; se usa ILIKE",
+                                   self.name, engine.dialect.name, exc_info=True)
+                    backend = 'like'
+                self._backends[url] = backend
+        return self._backends[url]
+
+    def _ensure_fts5(self, connection):
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': self.name}
+        ).first()
+        if exists:
+            return
+
+        t, k, fields = self.table, self.key, self.fields
+        ids = f"{self.name}_ids"
+        columns = ', '.join(fields)
+        new_values = ', '.join(f"new.{f}" for f in fields)
+        assignments = ', '.join(f"{f} = new.{f}" for f in fields)
+        docid = f"(SELECT docid FROM {ids} WHERE record_id = old.{k})"
+
+        statements = [
+            # Tabla de correspondencia con rowid estable (AUTOINCREMENT no cambia con VACUUM)
+            f"CREATE TABLE {ids} (docid INTEGER PRIMARY KEY AUTOINCREMENT, record_id TEXT NOT NULL UNIQUE)",
+            f"CREATE VIRTUAL TABLE {self.name} USING fts5({columns}, "
+            f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+            f"""CREATE TRIGGER {self.name}_ai AFTER INSERT ON {t} BEGIN
+                INSERT INTO {ids} (record_id) VALUES (new.{k});
+                INSERT INTO {self.name} (rowid, {columns})
+                    VALUES ((SELECT docid FROM {ids} WHERE record_id = new.{k}), {new_values});
+            END""",
+            f"""CREATE TRIGGER {self.name}_au AFTER UPDATE ON {t} BEGIN
+                UPDATE {self.name} SET {assignments} WHERE rowid = {docid};
+                UPDATE {ids} SET record_id = new.{k} WHERE record_id = old.{k};
+            END""",
+            f"""CREATE TRIGGER {self.name}_ad AFTER DELETE ON {t} BEGIN
+                DELETE FROM {self.name} WHERE rowid = {docid};
+                DELETE FROM {ids} WHERE record_id = old.{k};
+            END""",
+            # Indexar las filas que ya existían
+            f"INSERT INTO {ids} (record_id) SELECT {k} FROM {t}",
+            f"""INSERT INTO {self.name} (rowid, {columns})
+                SELECT i.docid, {', '.join(f't.{f}' for f in fields)}
+                FROM {t} t JOIN {ids} i ON i.record_id = t.{k}""",
+        ]
+        for statement in statements:
+            connection.execute(text(statement))
+
+    def _create(self, engine, backend):
+        # Otro proceso puede estar creando las mismas estructuras a la vez; se
+        # reintenta una vez, ya que la segunda pasada ve lo que el otro creó
+        for attempt in (1, 2):
+            try:
+                with engine.begin() as connection:
+                    if backend == 'fts5':
+                        self._ensure_fts5(connection)
+                    elif backend == 'tsvector':
+                        self._ensure_tsvector(connection)
+                return
+            except DBAPIError as error:
+                if _unavailable(error) or attempt == 2:
+                    raise
+                logger.warning("No se pudo crear el índice %s; reintentando",
+                               self.name, exc_info=True)
+
+    def _tsvector_sql(self):
+        parts = [
+            f"setweight(to_tsvector('simple', {self.name}_unaccent(coalesce({f}, ''))), "
+            f"'{WEIGHT_LABELS[min(i, 3)]}')"
+            for i, f in enumerate(self.fields)
+        ]
+        return ' || '.join(parts)
+
+    def _ensure_tsvector(self, connection):
+        statements = [
+            "CREATE EXTENSION IF NOT EXISTS unaccent",
+            # unaccent() no es IMMUTABLE; el envoltorio permite usarlo en un índice
+            f"""CREATE OR REPLACE FUNCTION {self.name}_unaccent(text) RETURNS text
+                LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+                AS $$ SELECT public.unaccent('public.unaccent', $1) $$""",
+            f"CREATE INDEX IF NOT EXISTS {self.name}_idx ON {self.table} "
+            f"USING gin (({self._tsvector_sql()}))",
+        ]
+        for statement in statements:
+            connection.execute(text(statement))
+
+    def rebuild(self, engine):
+        """Elimina y vuelve a crear el índice desde cero"""
+        backend = self._backend(engine)
+        with engine.begin() as connection:
+            if backend == 'fts5':
+                for trigger in ('ai', 'au', 'ad'):
+                    connection.execute(text(f"DROP TRIGGER IF EXISTS {self.name}_{trigger}"))
+                connection.execute(text(f"DROP TABLE IF EXISTS {self.name}"))
+                connection.execute(text(f"DROP TABLE IF EXISTS {self.name}_ids"))
+            elif backend == 'tsvector':
+                connection.execute(text(f"DROP INDEX IF EXISTS {self.name}_idx"))
+        self._backends.pop(str(engine.url), None)
+        return self.ensure(engine)
+
+    # -- Consultas ----------------------------------------------------------
+
+    def search(self, session, terms=None, q='', limit=50, offset=0):
+        """
+        Devuelve los IDs que coinciden, ordenados por relevancia.
+
+        Args:
+            session: sesión de SQLAlchemy con la que se ejecuta la consulta.
+            terms (dict): texto a buscar por campo, p. ej. {'apellido': 'perez'}.
+            q (str): texto libre que se busca en todos los campos.
+            limit (int): número máximo de resultados.
+            offset (int): resultados a saltar (paginación).
+
+        Returns:
+            list: IDs de los registros en orden de relevancia.
+        """
+        terms = {f: tokenize(v) for f, v in (terms or {}).items() if f in self.fields}
+        terms = {f: tokens for f, tokens in terms.items() if tokens}
+        free = tokenize(q)
+        if not terms and not free:
+            return []
+
+        backend = self.ensure(session.get_bind())
+        if backend == 'fts5':
+            return self._search_fts5(session, terms, free, limit, offset)
+        if backend == 'tsvector':
+            return self._search_tsvector(session, terms, free, limit, offset)
+        return self._search_like(session, terms, free, limit, offset)
+
+    def _search_fts5(self, session, terms, free, limit, offset):
+        # Cada palabra entre comillas (sin sintaxis FTS inyectable) y como prefijo.
+        # Empates de bm25 por clave, como en los demás motores, para que OFFSET no repita ni salte filas
+        clauses = [f'{field} : "{token}"*' for field, tokens in terms.items() for token in tokens]
+        clauses += [f'"{token}"*' for token in free]
+        rows = session.execute(
+            text(f"""SELECT i.record_id FROM {self.name} s
+                     JOIN {self.name}_ids i ON i.docid = s.rowid
+                     WHERE {self.name} MATCH :match
+                     ORDER BY bm25({self.name}), i.record_id
+                     LIMIT :limit OFFSET :offset"""),
+            {'match': ' AND '.join(clauses), 'limit': limit, 'offset': offset}
+        )
+        return [row[0] for row in rows]
+
+    def _search_tsvector(self, session, terms, free, limit, offset):
+        weights = {f: WEIGHT_LABELS[min(i, 3)] for i, f in enumerate(self.fields)}
+        clauses = [f"'{token}':*{weights[field]}" for field, tokens in terms.items() for token in tokens]
+        clauses += [f"'{token}':*" for token in free]
+        vector = self._tsvector_sql()
+        rows = session.execute(
+            text(f"""SELECT {self.key} FROM {self.table},
+                         to_tsquery('simple', {self.name}_unaccent(:query)) query
+                     WHERE ({vector}) @@ query
+                     ORDER BY ts_rank(({vector}), query) DESC, {self.key}
+                     LIMIT :limit OFFSET :offset"""),
+            {'query': ' & '.join(clauses), 'limit': limit, 'offset': offset}
+        )
+        return [row[0] for row in rows]
+
+    def _search_like(self, session, terms, free, limit, offset):
+        clauses, params = [], {'limit': limit, 'offset': offset}
+        for field, tokens in terms.items():
+            for i, token in enumerate(tokens):
+                params[f"{field}_{i}"] = f"%{token}%"
+                clauses.append(f"lower({field}) LIKE lower(:{field}_{i})")
+        for i, token in enumerate(free):
+            params[f"q_{i}"] = f"%{token}%"
+            clauses.append('(' + ' OR '.join(f"lower({f}) LIKE lower(:q_{i})" for f in self.fields) + ')')
+        rows = session.execute(
+            text(f"""SELECT {self.key} FROM {self.table} WHERE {' AND '.join(clauses)}
+                     ORDER BY {self.key} LIMIT :limit OFFSET :offset"""),
+            params
+        )
+        return [row[0] for row in rows]
@@ -0,0 +1,71 @@
+"""
+Serialización rápida de listados.
+
+Los listados grandes se leen como tuplas de columnas (sin hidratar objetos
+ORM ni pasar por el identity map) y se codifican directamente a bytes con
+orjson si está instalado, o con el módulo `json` si no. Las respuestas se
+construyen con esos bytes, sin la conversión intermedia a `str` de
+`jsonify`.
+"""
+import json
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # opcional: sin orjson se usa json
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson else 'json'
+
+# Filas por fragmento en las respuestas en streaming
+STREAM_CHUNK_ROWS = 200
+
+
+def _default(value):
+    # Fechas y otros tipos que el módulo json no conoce (orjson ya los trata)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+if orjson:
+    def dumps(obj):
+        """Codifica `obj` como JSON en UTF-8 (bytes)"""
+        return orjson.dumps(obj, default=_default)
+else:
+    def dumps(obj):
+        """Codifica `obj` como JSON en UTF-8 (bytes)"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode()
+
+
+def json_response(obj, status=200):
+    """Respuesta JSON equivalente a `jsonify(obj)` con el codificador rápido"""
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def row_mapper(keys):
+    """Convierte tuplas en diccionarios con `keys` (en el orden de las columnas seleccionadas)"""
+    keys = tuple(keys)
+
+    def to_dict(row):
+        return dict(zip(keys, row))
+    return to_dict
+
+
+def iter_chunks(rows, serialize, separator=b',', chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Codifica las filas por fragmentos de `chunk_rows`.
+
+    Cada fragmento es un único `bytes` con las filas separadas por
+    `separator`, de modo que el servidor hace una escritura por fragmento
+    y no una por fila.
+    """
+    batch = []
+    for row in rows:
+        batch.append(dumps(serialize(row)))
+        if len(batch) >= chunk_rows:
+            yield separator.join(batch)
+            batch = []
+    if batch:
+        yield separator.join(batch)
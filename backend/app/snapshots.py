@@ -0,0 +1,219 @@
+"""
+Instantáneas estáticas de las fichas para las consultas de emergencia.
+
+Cada ficha se escribe en `SNAPSHOT_FOLDER` como `<id>.json` (los mismos
+datos que la API) y `<id>.html` (una página mínima con la foto, sin
+JavaScript). Un servidor estático (nginx) o la ruta `/snapshots/` de la
+aplicación las sirven sin consultar la base de datos, así que un escaneo
+sigue funcionando aunque esta no responda. Sin `SNAPSHOT_FOLDER` no se
+genera nada.
+
+Las escrituras de fichas llaman a `refresh` con los IDs afectados después
+del commit: se releen de la base de datos y se reescriben, o se borran si
+ya no existen. Cada regeneración toma un flock y relee las filas dentro
+del bloqueo, de modo que entre workers la última en escribir siempre ve
+el estado más reciente.
+"""
+import fcntl
+import html
+import logging
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+import click
+from flask import send_file
+from flask.cli import AppGroup
+
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# IDs que se releen por consulta al regenerar
+REFRESH_BATCH = 500
+
+# El contenido cambia con cada edición: el cliente revalida con la ETag
+SNAPSHOT_CACHE_CONTROL = 'no-cache'
+
+_NAME_RE = re.compile(r'^[0-9A-Za-z]+\.(html|json)$')
+# Sólo los IDs que dan nombres de `_NAME_RE` se convierten en archivos
+_ID_RE = re.compile(r'^[0-9A-Za-z]+$')
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<meta name="robots" content="noindex">
+<title>{name}</title>
+<style>
+body{{font-family:sans-serif;margin:0 auto;max-width:32rem;padding:1rem;color:#222}}
+img{{max-width:100%;border-radius:.5rem}}
+.sangre{{font-size:2.5rem;font-weight:bold;color:#b00;margin:.5rem 0}}
+dt{{font-weight:bold;margin-top:.75rem}}
+dd{{margin:0}}
+</style>
+</head>
+<body>
+<h1>{name}</h1>
+{image}<p class="sangre">{blood_type}</p>
+<dl>
+<dt>Alergias</dt><dd>{allergies}</dd>
+<dt>Medicaciones</dt><dd>{medications}</dd>
+<dt>Contacto de emergencia</dt><dd>{contact} &middot; <a href="tel:{phone}">{phone}</a></dd>
+</dl>
+</body>
+</html>
+"""
+
+
+def render_html(payload, image_url=None):
+    """Página de emergencia de una ficha (claves en español, como en la API)"""
+    def text(key):
+        return html.escape(str(payload.get(key) or ''))
+
+    image = f'<img src="{html.escape(image_url)}" alt="Foto">\n' if image_url else ''
+    return PAGE_TEMPLATE.format(
+        name=f"{text('nombre')} {text('apellido')}",
+        image=image,
+        blood_type=text('tipo_sangre'),
+        allergies=text('alergias') or 'Ninguna',
+        medications=text('medicaciones') or 'Ninguna',
+        contact=text('contacto_emergencia'),
+        phone=text('numero_contacto'),
+    )
+
+
+class SnapshotStore:
+    """
+    Carpeta de instantáneas de una tabla de fichas.
+
+    Args:
+        folder: carpeta de las instantáneas ('' o None las desactiva).
+        load: función `ids -> {id: payload}` con los datos actuales.
+        all_ids: función sin argumentos que itera todos los IDs (para `build`).
+        image_url: función `payload -> URL relativa de la foto` o None.
+    """
+
+    def __init__(self, folder, load, all_ids, image_url=None):
+        self.folder = folder
+        self.load = load
+        self.all_ids = all_ids
+        self.image_url = image_url or (lambda payload: None)
+
+    @property
+    def enabled(self):
+        return bool(self.folder)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, name, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, os.path.join(self.folder, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _refresh_batch(self, record_ids):
+        invalid = [record_id for record_id in record_ids if not isinstance(record_id, str) or not _ID_RE.match(record_id)]
+        if invalid:
+            # Un ID así saldría de la carpeta (p. ej. '../x'): no se escribe ni se borra nada con él
+            logger.warning("IDs sin instantánea por su formato", extra={'ids': [repr(i) for i in invalid[:10]]})
+            record_ids = [record_id for record_id in record_ids if record_id not in invalid]
+            if not record_ids:
+                return
+        with self._locked():
+            payloads = self.load(record_ids)
+            for record_id in record_ids:
+                payload = payloads.get(record_id)
+                if payload is None:
+                    for ext in ('json', 'html'):
+                        try:
+                            os.remove(os.path.join(self.folder, f"{record_id}.{ext}"))
+                        except FileNotFoundError:
+                            pass
+                    continue
+                self._write(f"{record_id}.json", dumps(payload))
+                self._write(f"{record_id}.html", render_html(payload, self.image_url(payload)).encode())
+
+    def refresh(self, *record_ids):
+        """
+        Regenera (o borra) las instantáneas de `record_ids`.
+
+        Se llama después del commit; un fallo se registra pero no se
+        propaga, porque el cambio ya está guardado (`flask snapshots build`
+        repara lo que quede desfasado).
+        """
+        if not self.enabled or not record_ids:
+            return
+        record_ids = list(dict.fromkeys(record_ids))
+        try:
+            for start in range(0, len(record_ids), REFRESH_BATCH):
+                self._refresh_batch(record_ids[start:start + REFRESH_BATCH])
+        except Exception:
+            logger.exception("No se pudieron regenerar las instantáneas", extra={'ids': len(record_ids)})
+
+    def build(self):
+        """
+        Regenera todas las instantáneas y borra las de fichas que ya no existen.
+
+        Returns:
+            tuple: (instantáneas escritas, huérfanas borradas)
+        """
+        seen = set()
+        batch = []
+        for record_id in self.all_ids():
+            seen.add(record_id)
+            batch.append(record_id)
+            if len(batch) >= REFRESH_BATCH:
+                self._refresh_batch(batch)
+                batch = []
+        if batch:
+            self._refresh_batch(batch)
+
+        orphans = []
+        if os.path.isdir(self.folder):
+            orphans = sorted({name.rsplit('.', 1)[0] for name in os.listdir(self.folder) if _NAME_RE.match(name)} - seen)
+        for start in range(0, len(orphans), REFRESH_BATCH):
+            self._refresh_batch(orphans[start:start + REFRESH_BATCH])
+        return len(seen), len(orphans)
+
+    def exists(self, record_id):
+        return self.enabled and bool(_ID_RE.match(record_id)) \
+            and os.path.exists(os.path.join(self.folder, f"{record_id}.html"))
+
+    def send(self, name):
+        """Respuesta con la instantánea `name` (`<id>.html` o `<id>.json`), o None si no existe"""
+        if not self.enabled or not _NAME_RE.match(name):
+            return None
+        try:
+            response = send_file(os.path.abspath(os.path.join(self.folder, name)), conditional=True, etag=True)
+        except FileNotFoundError:
+            return None
+        response.headers['Cache-Control'] = SNAPSHOT_CACHE_CONTROL
+        return response
+
+
+def snapshot_cli(store):
+    """Grupo `flask snapshots` para un `SnapshotStore`"""
+    group = AppGroup('snapshots', help='Instantáneas estáticas de las fichas (SNAPSHOT_FOLDER).')
+
+    @group.command('build')
+    def build_command():
+        """Genera todas las instantáneas y borra las de fichas eliminadas."""
+        if not store.enabled:
+            raise click.ClickException("Defina SNAPSHOT_FOLDER para generar instantáneas")
+        written, removed = store.build()
+        click.echo(f"{written} instantáneas generadas, {removed} huérfanas borradas en {store.folder}")
+
+    return group
@@ -0,0 +1,49 @@
+import click
+
+
+class _LazyGroup(click.Group):
+    """Grupo de comandos que carga el grupo real sólo cuando se usa"""
+
+    def __init__(self, load, **attrs):
+        super().__init__(**attrs)
+        self._load = load
+
+    def list_commands(self, ctx):
+        return self._load().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._load().get_command(ctx, name)
+
+
+class LazyMigrate:
+    """
+    Flask-Migrate sin importar alembic al arrancar.
+
+    Importar flask_migrate carga alembic, mako y pygments (~200 ms por
+    worker) aunque sólo se usen en `flask db` y en la inicialización. Aquí
+    `flask db` se registra como un grupo perezoso y `Migrate` se crea con la
+    primera llamada a `load()`.
+    """
+
+    def __init__(self, app, db, directory='migrations', **kwargs):
+        self.app = app
+        self.db = db
+        self.directory = directory
+        self.kwargs = kwargs
+        self._migrate = None
+        app.extensions['lazy_migrate'] = self
+        app.cli.add_command(_LazyGroup(self._cli_group, name='db', help='Perform database migrations.'))
+
+    def load(self):
+        """Crea el `Migrate` real (y registra su `flask db`); devuelve el objeto"""
+        if self._migrate is None:
+            from flask_migrate import Migrate
+
+            self._migrate = Migrate(self.app, self.db, directory=self.directory, **self.kwargs)
+        return self._migrate
+
+    def _cli_group(self):
+        self.load()
+        from flask_migrate.cli import db
+
+        return db
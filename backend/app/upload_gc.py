@@ -0,0 +1,265 @@
+"""
+Limpieza de las imágenes subidas que ya no usa ningún registro.
+
+Las imágenes se guardan con el hash del contenido en el nombre, así que
+al cambiar la foto de un registro o borrarlo la anterior (con sus
+derivados y su enlace simbólico en la carpeta de la aplicación) queda
+huérfana. Dos mecanismos la recuperan:
+
+* `release_images`, tras confirmar un cambio, comprueba sólo las
+  imágenes que acaban de dejar de usarse.
+* `collect_garbage` (`flask uploads gc`) recorre las carpetas, compara
+  cada archivo con el índice de referencias (imagen -> registros) y borra
+  los huérfanos y los enlaces rotos por lotes.
+
+Antes de borrar cada lote se vuelve a consultar la base de datos, y los
+archivos modificados en los últimos `UPLOAD_GC_GRACE` segundos se
+respetan: una subida en curso escribe el archivo antes de guardar el
+registro, y reutilizar un archivo existente actualiza su fecha.
+"""
+import logging
+import os
+import time
+from collections import defaultdict, namedtuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select
+
+from .images import DERIVATIVE_FORMATS, DERIVATIVE_SIZES, ORIGINAL_EXTENSIONS, derivative_name, parse_derivative
+
+logger = logging.getLogger(__name__)
+
+# Archivos examinados por consulta de comprobación y borrado
+GC_BATCH_SIZE = int(os.getenv('UPLOAD_GC_BATCH_SIZE', '500'))
+
+# Antigüedad mínima (segundos) de un archivo para poder borrarlo
+GC_GRACE_SECONDS = int(os.getenv('UPLOAD_GC_GRACE', '3600'))
+
+# Imágenes por defecto que no referencia ningún registro pero se sirven igualmente
+PROTECTED_NAMES = {'default.png', 'default.jpg', 'default_profile.png'}
+
+IMAGE_EXTENSIONS = set(ORIGINAL_EXTENSIONS) | set(DERIVATIVE_FORMATS)
+
+Orphan = namedtuple('Orphan', 'path name stem size link dangling')
+
+
+def image_stem(filename):
+    """Nombre base de una imagen: el del original para sus derivados, sin extensión"""
+    derivative = parse_derivative(filename)
+    if derivative:
+        return derivative[0]
+    return filename.rsplit('.', 1)[0]
+
+
+def is_managed(filename):
+    """Si `filename` es una imagen subida que la limpieza puede borrar"""
+    # Sólo nombres de archivo sueltos: nunca rutas (absolutas o con '..') que salgan de la carpeta
+    if not isinstance(filename, str) or os.path.basename(filename) != filename:
+        return False
+    if filename.startswith('.') or filename in PROTECTED_NAMES or '.' not in filename:
+        return False
+    return filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+class ReferenceIndex:
+    """Índice imagen (nombre base) -> IDs de los registros que la usan"""
+
+    def __init__(self):
+        self._records = defaultdict(set)
+
+    def add(self, record_id, filename):
+        if filename:
+            self._records[image_stem(filename)].add(record_id)
+
+    def records(self, filename):
+        return self._records.get(image_stem(filename), set())
+
+    def __contains__(self, filename):
+        return image_stem(filename) in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    @classmethod
+    def load(cls, db, id_column, image_column):
+        """Índice de todos los registros, leído en streaming"""
+        index = cls()
+        with db.engine.connect() as connection:
+            rows = connection.execution_options(yield_per=5000).execute(
+                select(id_column, image_column).where(image_column.isnot(None))
+            )
+            for record_id, filename in rows:
+                index.add(record_id, filename)
+        return index
+
+
+def referenced_stems(db, image_column, stems):
+    """Nombres base de `stems` que algún registro usa ahora mismo"""
+    stems = list(stems)
+    referenced = set()
+    for start in range(0, len(stems), GC_BATCH_SIZE):
+        names = [f"{stem}.{ext}" for stem in stems[start:start + GC_BATCH_SIZE] for ext in ORIGINAL_EXTENSIONS]
+        with db.engine.connect() as connection:
+            referenced.update(image_stem(name) for name in connection.scalars(
+                select(image_column).where(image_column.in_(names))
+            ))
+    return referenced
+
+
+class GCResult:
+    """Archivos y enlaces borrados (o que se borrarían) y bytes recuperados"""
+
+    def __init__(self):
+        self.files = 0
+        self.links = 0
+        self.bytes = 0
+        self.kept = 0
+
+    def add(self, orphan):
+        if orphan.link:
+            self.links += 1
+        else:
+            self.files += 1
+            self.bytes += orphan.size
+
+    def to_dict(self):
+        return {'files': self.files, 'links': self.links, 'bytes': self.bytes, 'kept': self.kept}
+
+
+def _orphan(folder, name, grace, now, referenced):
+    """Orphan si el archivo o enlace `name` de `folder` se puede borrar, o None"""
+    if not is_managed(name):
+        return None
+    folder = os.path.abspath(folder)
+    path = os.path.abspath(os.path.join(folder, name))
+    # El enlace en sí (no su destino) debe estar dentro de la carpeta
+    if os.path.dirname(path) != folder:
+        return None
+    try:
+        stat = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    link = os.path.islink(path)
+    dangling = link and not os.path.exists(path)
+    if not dangling and (referenced or now - stat.st_mtime < grace):
+        return None
+    return Orphan(path, name, image_stem(name), 0 if link else stat.st_size, link, dangling)
+
+
+def scan_orphans(folders, references, grace=GC_GRACE_SECONDS):
+    """Itera los archivos de `folders` que no están en `references` y los enlaces rotos"""
+    now = time.time()
+    for folder in folders:
+        try:
+            with os.scandir(folder) as entries:
+                names = [entry.name for entry in entries if is_managed(entry.name)]
+        except OSError:
+            continue
+        for name in names:
+            orphan = _orphan(folder, name, grace, now, name in references)
+            if orphan:
+                yield orphan
+
+
+def _delete_batch(batch, recheck, result, dry_run, forget):
+    # Los enlaces rotos no sirven aunque el registro siga apuntando a la imagen
+    still_used = recheck({orphan.stem for orphan in batch if not orphan.dangling})
+    for orphan in batch:
+        if orphan.stem in still_used and not orphan.dangling:
+            result.kept += 1
+            continue
+        if not dry_run:
+            try:
+                os.unlink(orphan.path)
+            except FileNotFoundError:
+                continue
+            if forget:
+                forget(orphan.name)
+        result.add(orphan)
+
+
+def collect_garbage(orphans, recheck, batch_size=GC_BATCH_SIZE, dry_run=False, forget=None):
+    """
+    Borra `orphans` por lotes.
+
+    Args:
+        orphans: iterable de Orphan (ver `scan_orphans`).
+        recheck: función `nombres base -> los que siguen en uso`, que se
+            consulta justo antes de borrar cada lote.
+        dry_run: sólo cuenta lo que se borraría.
+        forget: se llama con el nombre de cada archivo borrado (p. ej.
+            `UploadIndex.forget`).
+
+    Returns:
+        GCResult
+    """
+    result = GCResult()
+    batch = []
+    for orphan in orphans:
+        batch.append(orphan)
+        if len(batch) >= batch_size:
+            _delete_batch(batch, recheck, result, dry_run, forget)
+            batch = []
+    if batch:
+        _delete_batch(batch, recheck, result, dry_run, forget)
+    return result
+
+
+def image_files(filename):
+    """Nombres del original `filename` y de todos sus derivados"""
+    return [filename] + [derivative_name(filename, size, ext)
+                         for size in DERIVATIVE_SIZES for ext in DERIVATIVE_FORMATS]
+
+
+def release_images(filenames, folders, recheck, grace=GC_GRACE_SECONDS, forget=None):
+    """
+    Borra las imágenes `filenames` (con sus derivados y enlaces) si ya no las usa nadie.
+
+    Se llama después del commit que deja de referenciarlas; un fallo se
+    registra pero no se propaga (`flask uploads gc` recoge lo que quede).
+    """
+    names = [name for name in dict.fromkeys(filenames) if name and is_managed(name)]
+    if not names:
+        return GCResult()
+    try:
+        now = time.time()
+        orphans = [orphan for name in names for variant in image_files(name) for folder in folders
+                   for orphan in [_orphan(folder, variant, grace, now, False)] if orphan]
+        return collect_garbage(orphans, recheck, forget=forget)
+    except Exception:
+        logger.exception("No se pudieron liberar las imágenes", extra={'images': names})
+        return GCResult()
+
+
+def _size(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def upload_gc_cli(db, id_column, image_column, upload_folders):
+    """
+    Grupo `flask uploads` para las imágenes de `image_column`.
+
+    `upload_folders` es una función sin argumentos que devuelve
+    {nombre: carpeta}, como en `backup_cli`.
+    """
+    group = AppGroup('uploads', help='Mantenimiento de las imágenes subidas.')
+
+    @group.command('gc')
+    @click.option('--dry-run', is_flag=True, help='Sólo informa de lo que se borraría.')
+    @click.option('--grace', type=click.IntRange(min=0), default=GC_GRACE_SECONDS, show_default=True,
+                  help='Segundos que se respetan los archivos recién escritos.')
+    @click.option('--batch-size', type=click.IntRange(min=1), default=GC_BATCH_SIZE, show_default=True)
+    def gc_command(dry_run, grace, batch_size):
+        """Borra las imágenes huérfanas y los enlaces rotos de las carpetas de uploads."""
+        references = ReferenceIndex.load(db, id_column, image_column)
+        folders = list(dict.fromkeys(os.path.abspath(folder) for folder in upload_folders().values() if folder))
+        result = collect_garbage(scan_orphans(folders, references, grace),
+                                 lambda stems: referenced_stems(db, image_column, stems),
+                                 batch_size, dry_run)
+        action = 'se borrarían' if dry_run else 'borrados'
+        click.echo(f"{len(references)} imágenes en uso; {action} {result.files} archivos huérfanos "
+                   f"({_size(result.bytes)}) y {result.links} enlaces; "
+                   f"{result.kept} vueltos a usar durante la limpieza")
+
+    return group
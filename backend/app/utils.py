@@ -1,14 +1,15 @@
-import qrcode
 import os
-from io import BytesIO
 import base64
 from functools import wraps
 from flask import request, jsonify, current_app
 import re
 from werkzeug.utils import secure_filename
-from PIL import Image
 import hashlib
 import shutil
+from .qr_cache import get_qr_cache
+from .images import derivatives_exist, schedule_derivatives
+from .file_serving import get_upload_index
+from .metrics import timed
 
 def sanitize_text(text):
     """Sanitize text input to prevent XSS attacks"""
@@ -21,19 +22,8 @@ def sanitize_text(text):
 def generate_qr_code(data):
     """Generate QR code for the given data"""
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
+        _, png = get_qr_cache().get_or_render(data)
+        return base64.b64encode(png).decode()
     except Exception as e:
         current_app.logger.error(f"Error generating QR code: {str(e)}")
         return None
@@ -58,16 +48,26 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Carpetas ya creadas en este proceso (evita un makedirs por llamada)
+_created_folders = set()
+
+def ensure_folder(folder):
+    """Crea la carpeta si no existe (sólo la primera vez en cada proceso)"""
+    if folder not in _created_folders:
+        os.makedirs(folder, exist_ok=True)
+        _created_folders.add(folder)
+    return folder
+
 def get_persistent_upload_folder():
     """Get the persistent upload folder, creating it if it doesn't exist"""
     # Usar un directorio fuera de la aplicación para persistencia
-    persistent_folder = os.getenv('PERSISTENT_UPLOAD_FOLDER', '/data/motosegura/uploads')
-    
-    # Crear el directorio si no existe
-    os.makedirs(persistent_folder, exist_ok=True)
-    
-    return persistent_folder
+    return ensure_folder(os.getenv('PERSISTENT_UPLOAD_FOLDER', '/data/motosegura/uploads'))
+
+def get_upload_folders():
+    """Carpetas de uploads en orden de prioridad: persistente y de la aplicación"""
+    return [get_persistent_upload_folder(), current_app.config['UPLOAD_FOLDER']]
 
+@timed('image_save')
 def save_profile_image(file, record_id):
     """Save profile image and return the filename"""
     if not file:
@@ -97,24 +97,32 @@ def save_profile_image(file, record_id):
         
         # Verificar si el archivo ya existe (evitar duplicados)
         if os.path.exists(file_path):
+            # La fecha actualizada protege el archivo de una limpieza de huérfanos en curso
+            os.utime(file_path)
             current_app.logger.info(f"File already exists, reusing: {filename}")
         else:
             # Validar que sea una imagen
             try:
+                from PIL import Image
                 img = Image.open(file)
                 img.verify()  # Verificar que es una imagen válida
                 
                 # Guardar la imagen
                 file.seek(0)
                 file.save(file_path)
+                get_upload_index(current_app, get_upload_folders).register(file_path)
                 
                 current_app.logger.info(f"Saved profile image: {filename}")
             except Exception as e:
                 current_app.logger.error(f"Invalid image file: {str(e)}")
                 return 'default.png'
         
+        # Generar las versiones redimensionadas fuera del hilo de la petición
+        if not derivatives_exist(file_path):
+            schedule_derivatives(file_path)
+        
         # Asegurar que la imagen esté disponible en el directorio de uploads de la aplicación
-        app_upload_folder = current_app.config['UPLOAD_FOLDER']
+        app_upload_folder = ensure_folder(current_app.config['UPLOAD_FOLDER'])
         
         # Verificar si necesitamos crear un enlace simbólico o copiar el archivo al directorio de la aplicación
         app_file_path = os.path.join(app_upload_folder, filename)
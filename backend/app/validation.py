@@ -0,0 +1,13 @@
+"""
+Reglas de validación compartidas por las altas individuales y las
+importaciones masivas, para que ambos caminos acepten lo mismo.
+"""
+
+BLOOD_TYPES = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+
+
+def blood_type_error(value):
+    """Mensaje de error si `value` no es un grupo sanguíneo válido, o None"""
+    if value not in BLOOD_TYPES:
+        return 'Invalid blood type. Must be one of: ' + ', '.join(BLOOD_TYPES)
+    return None
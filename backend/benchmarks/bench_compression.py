@@ -0,0 +1,132 @@
+"""
+Bytes ahorrados y coste de CPU de la compresión de los listados.
+
+Se siembran `--rows` registros en un SQLite temporal y, para cada tamaño
+de página de `/api/fichas` (`all`: el listado completo en streaming), se
+mide:
+
+* el tamaño sin comprimir y con cada codificación y nivel (gzip y, si está
+  instalado, brotli), con la mediana del tiempo de compresión;
+* la mediana de la petición completa sin compresión, comprimida sin caché
+  (un parámetro distinto en cada ronda cambia la ETag, y como no es
+  conocido la respuesta no se guarda) y comprimida desde la caché de
+  respuestas comprimidas. Las páginas se consultan y serializan igualmente
+  antes de mirar la caché; el listado en streaming no se guarda, así que
+  siempre se comprime al vuelo.
+
+Uso (desde backend/)::
+
+    python -m benchmarks.bench_compression --rows 20000 --pages 100,1000,all
+    python -m benchmarks.bench_compression --app debug --levels 1,6,9
+"""
+import argparse
+import importlib
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from .dataset import seed_debug_app, seed_package_app
+from .run import benchmark_env
+
+
+def median_ms(function, rounds):
+    function()  # calentamiento
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def measure_codecs(payload, levels, rounds):
+    """(codificación, nivel, bytes, ms de compresión) de `payload`"""
+    from app.compression import ENCODINGS, compress
+
+    results = []
+    for encoding in ENCODINGS:
+        for level in levels:
+            settings = {'gzip_level': min(level, 9), 'brotli_quality': min(level, 11)}
+            size = len(compress(payload, encoding, settings))
+            results.append((encoding, level, size, median_ms(lambda: compress(payload, encoding, settings), rounds)))
+    return results
+
+
+def page_url(limit, *params):
+    params = ([] if limit == 'all' else [f'limit={limit}']) + list(params)
+    return '/api/fichas?' + '&'.join(params)
+
+
+def measure_requests(client, limit, encoding, rounds):
+    """Mediana (ms) de la petición sin comprimir, comprimida sin caché y comprimida desde la caché"""
+    url = page_url(limit)
+    counter = iter(range(10**9))
+
+    def identity():
+        client.get(url, headers={'Accept-Encoding': 'identity'}).get_data()
+
+    def miss():
+        client.get(page_url(limit, f'_={next(counter)}'), headers={'Accept-Encoding': encoding}).get_data()
+
+    def hit():
+        client.get(url, headers={'Accept-Encoding': encoding}).get_data()
+
+    return median_ms(identity, rounds), median_ms(miss, rounds), median_ms(hit, rounds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=['debug', 'package'], default='package')
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--pages', default='100,1000,all', help='tamaños de página separados por comas (all: todo)')
+    parser.add_argument('--levels', default='1,6,9', help='niveles de gzip / calidades de brotli')
+    parser.add_argument('--rounds', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='motosegura-bench-')
+    try:
+        os.environ.update(benchmark_env(workdir, f"sqlite:///{os.path.join(workdir, 'bench.db')}"))
+        # Todas las páginas se comprimen, para medir también las pequeñas
+        os.environ['COMPRESS_MIN_SIZE'] = '0'
+        if args.app == 'debug':
+            module = importlib.import_module('debug_app')
+            module.limiter.enabled = False
+            seed_debug_app(module, args.rows, users=0, records_per_user=0, images=0)
+            app = module.app
+        else:
+            from app import create_app
+
+            app = create_app()
+            seed_package_app(app, args.rows, images=0)
+
+        from app.compression import ENCODINGS
+
+        client = app.test_client()
+        levels = [int(level) for level in args.levels.split(',')]
+        rows = []
+        for limit in args.pages.split(','):
+            payload = client.get(page_url(limit), headers={'Accept-Encoding': 'identity'}).get_data()
+            rows.append((limit, len(payload), measure_codecs(payload, levels, args.rounds),
+                         {encoding: measure_requests(client, limit, encoding, args.rounds) for encoding in ENCODINGS}))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.app}: {args.rows} filas, mediana de {args.rounds} ejecuciones")
+    print(f"{'filas':>8}{'codificación':>14}{'nivel':>7}{'bytes':>12}{'ahorro':>9}{'ms CPU':>9}")
+    for limit, raw, codecs, _ in rows:
+        print(f"{limit:>8}{'identity':>14}{'-':>7}{raw:>12}{'-':>9}{'-':>9}")
+        for encoding, level, size, ms in codecs:
+            print(f"{limit:>8}{encoding:>14}{level:>7}{size:>12}{1 - size / raw:>8.0%}{ms:>9.2f}")
+
+    print()
+    print("Petición completa (ms): sin comprimir / comprimida sin caché / comprimida desde la caché")
+    print(f"{'filas':>8}{'codificación':>14}{'identity':>11}{'sin caché':>11}{'caché':>9}")
+    for limit, _, _, requests in rows:
+        for encoding, (identity, miss, hit) in requests.items():
+            print(f"{limit:>8}{encoding:>14}{identity:>11.2f}{miss:>11.2f}{hit:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Coste de serializar un listado: ORM + `to_dict` + `jsonify` frente a
+tuplas de columnas + serializador por petición + codificador rápido.
+
+Se siembran `--rows` filas en un SQLite temporal y, para cada tamaño de
+página, se mide la mediana de `--rounds` ejecuciones de cada camino
+completo (consulta, conversión y codificación de la respuesta).
+
+Uso (desde backend/)::
+
+    python -m benchmarks.bench_serialization --rows 20000 --pages 100,1000,20000
+"""
+import argparse
+import importlib
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from .dataset import seed_debug_app, seed_package_app
+from .run import benchmark_env
+
+
+def legacy_record_dict(record):
+    """`MedicalRecord.to_dict(include_image_url=True)` tal como era antes de las tuplas"""
+    record_dict = {
+        'id': record.id,
+        'nombre': record.first_name,
+        'apellido': record.last_name,
+        'tipo_sangre': record.blood_type,
+        'contacto_emergencia': record.emergency_contact_name,
+        'numero_contacto': record.emergency_contact_phone,
+        'alergias': record.allergies or '',
+        'medicaciones': record.medications or '',
+        'foto_url': record.profile_image,
+        'fecha_registro': record.created_at.strftime('%Y-%m-%d'),
+    }
+    record_dict.update(record.image_urls(record.profile_image))
+    return record_dict
+
+
+def package_paths(app):
+    from flask import jsonify
+
+    from app.models import RECORD_ROW_COLUMNS, MedicalRecord, db, record_row_serializer
+    from app.serialization import json_response
+
+    order = (MedicalRecord.created_at, MedicalRecord.id)
+
+    def orm(limit):
+        records = MedicalRecord.query.order_by(*order).limit(limit).all()
+        return jsonify({'status': 'success', 'fichas': [legacy_record_dict(r) for r in records]}).get_data()
+
+    def tuples(limit):
+        serialize = record_row_serializer(include_image_url=True)
+        rows = db.session.query(*RECORD_ROW_COLUMNS).order_by(*order).limit(limit).all()
+        return json_response({'status': 'success', 'fichas': [serialize(row) for row in rows]}).get_data()
+
+    return {'orm+to_dict+jsonify': orm, 'tuplas+serializador+rápido': tuples}
+
+
+def debug_paths(module):
+    from flask import jsonify
+
+    from app.serialization import json_response
+
+    FichaMedica, db = module.FichaMedica, module.db
+
+    def orm(limit):
+        fichas = FichaMedica.query.order_by(FichaMedica.id).limit(limit).all()
+        return jsonify({'status': 'success', 'fichas': [f.to_dict() for f in fichas]}).get_data()
+
+    def tuples(limit):
+        filas = db.session.query(*module.COLUMNAS_FICHA).order_by(FichaMedica.id).limit(limit).all()
+        return json_response({'status': 'success', 'fichas': [module.fila_a_dict(f) for f in filas]}).get_data()
+
+    return {'orm+to_dict+jsonify': orm, 'tuplas+serializador+rápido': tuples}
+
+
+def measure(app, paths, pages, rounds):
+    from app.serialization import JSON_BACKEND
+
+    results = []
+    with app.test_request_context('/api/fichas', base_url='http://bench.local'):
+        for limit in pages:
+            timings = {}
+            for name, path in paths.items():
+                path(limit)  # calentamiento
+                samples = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    path(limit)
+                    samples.append(time.perf_counter() - start)
+                timings[name] = statistics.median(samples) * 1000
+            results.append((limit, timings))
+    return JSON_BACKEND, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=['debug', 'package'], default='package')
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--pages', default='100,1000,10000', help='tamaños de página separados por comas')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--images', type=int, default=1000, help='registros con foto (URLs de derivados)')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='motosegura-bench-')
+    try:
+        os.environ.update(benchmark_env(workdir, f"sqlite:///{os.path.join(workdir, 'bench.db')}"))
+        if args.app == 'debug':
+            module = importlib.import_module('debug_app')
+            seed_debug_app(module, args.rows, users=0, records_per_user=0, images=0)
+            app, paths = module.app, debug_paths(module)
+        else:
+            from app import create_app
+
+            app = create_app()
+            seed_package_app(app, args.rows, images=args.images)
+            paths = package_paths(app)
+        backend, results = measure(app, paths, [int(p) for p in args.pages.split(',')], args.rounds)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    names = list(paths)
+    print(f"{args.app}: {args.rows} filas, codificador {backend}, mediana de {args.rounds} ejecuciones (ms)")
+    print(f"{'filas':>8}" + ''.join(f"{name:>30}" for name in names) + f"{'mejora':>10}")
+    for limit, timings in results:
+        speedup = timings[names[0]] / timings[names[1]]
+        print(f"{limit:>8}" + ''.join(f"{timings[name]:>30.2f}" for name in names) + f"{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Compara dos resultados de `benchmarks.run` endpoint a endpoint.
+
+Uso (desde backend/)::
+
+    python -m benchmarks.compare antes.json despues.json
+"""
+import argparse
+import json
+
+METRICS = ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return ''
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"antes:   {before['meta'].get('commit')}  ({before['meta'].get('timestamp')})")
+    print(f"después: {after['meta'].get('commit')}  ({after['meta'].get('timestamp')})")
+    print(f"{'endpoint':<18}" + ''.join(f"{metric:>28}" for metric in METRICS))
+    for name in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        old, new = before['endpoints'].get(name, {}), after['endpoints'].get(name, {})
+        cells = []
+        for metric in METRICS:
+            a, b = old.get(metric), new.get(metric)
+            cells.append(f"{a if a is not None else '-':>9} → {b if b is not None else '-':<9}{change(a, b):>8}")
+        print(f"{name:<18}" + ''.join(f"{cell:>28}" for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
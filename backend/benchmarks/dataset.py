@@ -0,0 +1,147 @@
+"""
+Generación del conjunto de datos de los benchmarks.
+
+El contenido es determinista para una misma semilla, de modo que dos
+ejecuciones (o dos commits) miden la misma base de datos; sólo cambian
+los IDs, que asigna IdAllocator.
+"""
+import os
+import random
+import time
+from io import BytesIO
+
+NOMBRES = ['Ana', 'Luis', 'María', 'José', 'Lucía', 'Carlos', 'Sofía', 'Javier', 'Elena', 'Andrés',
+           'Paula', 'Miguel', 'Valeria', 'Diego', 'Camila', 'Raúl', 'Inés', 'Tomás', 'Julia', 'Óscar']
+APELLIDOS = ['García', 'Martínez', 'López', 'Sánchez', 'Pérez', 'Gómez', 'Martín', 'Jiménez', 'Ruiz',
+             'Hernández', 'Díaz', 'Moreno', 'Muñoz', 'Álvarez', 'Romero', 'Alonso', 'Gutiérrez', 'Navarro']
+TIPOS_SANGRE = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+
+# Contraseña de todos los usuarios sembrados
+BENCH_PASSWORD = 'bench-password'
+
+BATCH_SIZE = 5000
+
+
+def jpeg_bytes(rng, size=(640, 480)):
+    """Imagen JPEG pequeña con un color aleatorio"""
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3))).save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def _batches(total, size=BATCH_SIZE):
+    start = 0
+    while start < total:
+        yield start, min(size, total - start)
+        start += size
+
+
+def seed_debug_app(module, fichas, users, records_per_user, images, seed=0):
+    """
+    Siembra `debug_app`: fichas, usuarios, fichas por usuario e imágenes.
+
+    Returns:
+        dict: IDs y credenciales que usan los escenarios.
+    """
+    from sqlalchemy import insert, update
+
+    rng = random.Random(seed)
+    app, db = module.app, module.db
+    module.init_db()
+
+    with app.app_context():
+        ids = []
+        fecha = time.strftime('%Y-%m-%d')
+        for _, count in _batches(fichas):
+            batch_ids = module.generar_ids_unicos(count)
+            db.session.execute(insert(module.FichaMedica), [{
+                'id': ficha_id,
+                'nombre': rng.choice(NOMBRES),
+                'apellido': rng.choice(APELLIDOS),
+                'tipo_sangre': rng.choice(TIPOS_SANGRE),
+                'contacto_emergencia': f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}",
+                'numero_contacto': f"+34 6{rng.randrange(10**7, 10**8)}",
+                'alergias': 'Ninguna',
+                'medicaciones': 'Ninguna',
+                'foto_url': 'default.jpg',
+                'fecha_registro': fecha,
+            } for ficha_id in batch_ids])
+            db.session.commit()
+            ids.extend(batch_ids)
+
+        first_user = db.session.query(db.func.coalesce(db.func.max(module.User.id), 0)).scalar() + 1
+        usernames = [f"bench{first_user + i}" for i in range(users)]
+        if usernames:
+            db.session.execute(insert(module.User), [{
+                'id': first_user + i,
+                'username': username,
+                'password': BENCH_PASSWORD,
+                'name': username,
+                'email': f"{username}@bench.local",
+                'role': 'user',
+            } for i, username in enumerate(usernames)])
+            user_records = [{
+                'user_id': first_user + i,
+                'record_id': ficha_id,
+                'status': 'Active',
+                'created_at': fecha,
+            } for i in range(users) for ficha_id in rng.sample(ids, min(records_per_user, len(ids)))]
+            if user_records:
+                db.session.execute(insert(module.UserRecord), user_records)
+            db.session.commit()
+
+        filenames = []
+        for i in range(min(images, len(ids))):
+            filename = f"{ids[i]}.jpg"
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'wb') as f:
+                f.write(jpeg_bytes(rng))
+            filenames.append(filename)
+        if filenames:
+            db.session.execute(update(module.FichaMedica), [
+                {'id': ids[i], 'foto_url': name, 'version': 1} for i, name in enumerate(filenames)
+            ])
+            db.session.commit()
+
+    return {'ids': ids, 'usernames': usernames, 'images': filenames}
+
+
+def seed_package_app(app, records, images, seed=0):
+    """Siembra la aplicación de `create_app`: registros médicos e imágenes de perfil"""
+    from sqlalchemy import insert
+
+    from app.models import MedicalRecord, db, record_ids
+
+    rng = random.Random(seed)
+    with app.app_context():
+        db.create_all()
+        ids = []
+        for _, count in _batches(records):
+            batch_ids = record_ids.allocate(db.engine, count)
+            db.session.execute(insert(MedicalRecord), [{
+                'id': record_id,
+                'first_name': rng.choice(NOMBRES),
+                'last_name': rng.choice(APELLIDOS),
+                'blood_type': rng.choice(TIPOS_SANGRE),
+                'emergency_contact_name': f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}",
+                'emergency_contact_phone': f"+34 6{rng.randrange(10**7, 10**8)}",
+                'allergies': '',
+                'medications': '',
+                'profile_image': 'default.png',
+            } for record_id in batch_ids])
+            db.session.commit()
+            ids.extend(batch_ids)
+
+        filenames = []
+        folder = app.config['PERSISTENT_UPLOAD_FOLDER']
+        for i in range(min(images, len(ids))):
+            filename = f"{ids[i]}_{rng.getrandbits(128):032x}.jpg"
+            with open(os.path.join(folder, filename), 'wb') as f:
+                f.write(jpeg_bytes(rng))
+            filenames.append(filename)
+        for record_id, filename in zip(ids, filenames):
+            db.session.query(MedicalRecord).filter_by(id=record_id).update({'profile_image': filename})
+        db.session.commit()
+
+    return {'ids': ids, 'images': filenames}
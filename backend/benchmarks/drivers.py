@@ -0,0 +1,126 @@
+"""
+Clientes de carga: en proceso (WSGI directo) o HTTP contra gunicorn.
+
+Ambos exponen `request(req) -> (status, json, headers)` y se usan con un
+cliente por hilo, de modo que el mismo escenario se mide igual en los dos
+modos.
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from io import BytesIO
+
+
+class InProcessClient:
+    """Cliente de pruebas de Flask: mide la aplicación sin red ni servidor"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, req):
+        data = dict(req.get('form') or {})
+        for field, (filename, content) in (req.get('files') or {}).items():
+            data[field] = (BytesIO(content), filename)
+        response = self.client.open(
+            req['path'], method=req['method'], headers=req.get('headers'),
+            json=req.get('json'), data=data or None,
+        )
+        try:
+            return response.status_code, response.get_json(silent=True), response.headers
+        finally:
+            response.close()
+
+
+class HTTPClient:
+    """Cliente HTTP con conexiones persistentes (una sesión por hilo)"""
+
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, req):
+        files = {field: (filename, content) for field, (filename, content) in (req.get('files') or {}).items()}
+        response = self.session.request(
+            req['method'], self.base_url + req['path'], headers=req.get('headers'),
+            json=req.get('json'), data=req.get('form'), files=files or None, timeout=60,
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body, response.headers
+
+
+class ThreadLocalClients:
+    """Crea un cliente por hilo con `factory` y reenvía las peticiones al del hilo actual"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+
+    def request(self, req):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.factory()
+        return client.request(req)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class GunicornServer:
+    """
+    Lanza gunicorn en un puerto libre con el entorno del benchmark.
+
+    Se usa como contexto: espera a que `/health` responda y detiene el
+    servidor al salir.
+    """
+
+    def __init__(self, target, env, workers=2, threads=4, cwd=None):
+        self.target = target
+        self.env = env
+        self.workers = workers
+        self.threads = threads
+        self.cwd = cwd or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+
+    def __enter__(self):
+        import requests
+
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(self.workers), '--threads', str(self.threads),
+             '--bind', f"127.0.0.1:{self.port}", '--log-level', 'warning', self.target],
+            cwd=self.cwd,
+            # La topología también dimensiona el pool de conexiones (app.db_profiles)
+            env=dict(os.environ, **self.env, GUNICORN_WORKERS=str(self.workers), GUNICORN_THREADS=str(self.threads)),
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn terminó con código {self.process.returncode}")
+            try:
+                requests.get(f"{self.base_url}/health", timeout=5)
+                return self
+            except requests.RequestException:
+                # El socket ya escucha mientras los workers importan la aplicación
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError('gunicorn no respondió en 60 s')
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
@@ -0,0 +1,92 @@
+"""
+Presupuesto de tiempo de arranque de un worker.
+
+Importa la aplicación (lo mismo que hace cada worker de gunicorn al
+arrancar o reiniciarse) en intérpretes nuevos, informa de la mediana y
+falla con código 1 si supera `--budget-ms`. Con `--top` muestra los
+módulos de primer nivel que más tardan, según `python -X importtime`.
+
+Uso (desde backend/)::
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --app package --budget-ms 600 --top 15
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .run import benchmark_env
+
+# Lo que importa gunicorn en cada worker
+TARGETS = {
+    'debug': 'debug_app',
+    'package': 'wsgi',
+}
+
+DEFAULT_BUDGET_MS = int(os.getenv('IMPORT_BUDGET_MS', '750'))
+
+_MEASURE = "import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+
+
+def measure(module, env, cwd):
+    """Milisegundos que tarda en importarse `module` en un intérprete nuevo"""
+    output = subprocess.check_output(
+        [sys.executable, '-c', _MEASURE.format(module=module)], env=env, cwd=cwd, stderr=subprocess.DEVNULL,
+    )
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def slowest_imports(module, env, cwd, top):
+    """Módulos importados directamente por el nivel superior, ordenados por tiempo acumulado"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+    )
+    rows = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Un nivel de sangría: importaciones directas del módulo medido (o de site)
+        if name.startswith('   ') and not name.startswith('     ') and cumulative.strip().isdigit():
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=sorted(TARGETS), default='debug')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"mediana máxima permitida (por defecto {DEFAULT_BUDGET_MS}, o IMPORT_BUDGET_MS)")
+    parser.add_argument('--top', type=int, default=0, help='mostrar los N módulos más lentos')
+    args = parser.parse_args(argv)
+
+    module = TARGETS[args.app]
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='motosegura-import-')
+    try:
+        env = dict(os.environ, **benchmark_env(workdir, f"sqlite:///{os.path.join(workdir, 'bench.db')}"))
+        # La primera importación compila los .pyc; no cuenta
+        measure(module, env, cwd)
+        timings = sorted(measure(module, env, cwd) for _ in range(args.runs))
+        top = slowest_imports(module, env, cwd, args.top) if args.top else []
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    median = statistics.median(timings)
+    print(f"import {module}: mediana {median:.0f} ms (mín. {timings[0]:.0f}, máx. {timings[-1]:.0f}; "
+          f"{args.runs} ejecuciones), presupuesto {args.budget_ms:.0f} ms")
+    for ms, name in top:
+        print(f"  {ms:8.1f} ms  {name}")
+    if median > args.budget_ms:
+        print(f"Se supera el presupuesto en {median - args.budget_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Escenarios de carga: una petición representativa por endpoint.
+
+Cada escenario es una función `(rng, data) -> dict` que devuelve la
+petición a enviar: `method`, `path` y, opcionalmente, `headers`, `json`,
+`form` y `files` ({campo: (nombre, bytes)}). `data` es lo que devolvió la
+siembra más lo que preparó `setup` (p. ej. tokens de sesión).
+"""
+from .dataset import APELLIDOS, BENCH_PASSWORD, NOMBRES, TIPOS_SANGRE, jpeg_bytes
+
+
+def _prefix(rng, words):
+    word = rng.choice(words)
+    return word[:rng.randint(2, len(word))]
+
+
+# -- debug_app --------------------------------------------------------------
+
+DEBUG_APP_SCENARIOS = {
+    'list_page': lambda rng, data: {'method': 'GET', 'path': '/api/fichas?limit=100'},
+    'list_conditional': lambda rng, data: {
+        'method': 'GET', 'path': '/api/fichas?limit=100',
+        'headers': {'If-None-Match': data['list_etag']},
+    },
+    'get': lambda rng, data: {'method': 'GET', 'path': f"/api/fichas/{rng.choice(data['ids'])}"},
+    'search': lambda rng, data: {
+        'method': 'GET', 'path': f"/api/buscar/fichas?q={_prefix(rng, NOMBRES)}+{_prefix(rng, APELLIDOS)}",
+    },
+    'qr': lambda rng, data: {'method': 'GET', 'path': f"/api/qr/{rng.choice(data['ids'])}"},
+    'upload': lambda rng, data: {
+        'method': 'POST', 'path': f"/api/upload_photo/{rng.choice(data['ids'])}",
+        'files': {'file': ('foto.jpg', data['jpeg'])},
+    },
+    'uploads_get': lambda rng, data: {'method': 'GET', 'path': f"/uploads/{rng.choice(data['images'])}"},
+    'login': lambda rng, data: {
+        'method': 'POST', 'path': '/api/auth/login',
+        'json': {'username': rng.choice(data['usernames']), 'password': BENCH_PASSWORD},
+    },
+    'user_records': lambda rng, data: {
+        'method': 'GET', 'path': '/api/records/user?limit=50',
+        'headers': {'Authorization': f"Bearer {rng.choice(data['tokens'])}"},
+    },
+}
+
+
+def setup_debug_app(client, data, rng):
+    """Tokens de algunos usuarios, ETag del listado y una foto de prueba"""
+    data['tokens'] = [
+        client.request({'method': 'POST', 'path': '/api/auth/login',
+                        'json': {'username': username, 'password': BENCH_PASSWORD}})[1]['token']
+        for username in data['usernames'][:20]
+    ]
+    data['list_etag'] = client.request({'method': 'GET', 'path': '/api/fichas?limit=100'})[2].get('ETag', '')
+    data['jpeg'] = jpeg_bytes(rng)
+
+
+# -- create_app -------------------------------------------------------------
+
+PACKAGE_APP_SCENARIOS = {
+    'list_page': lambda rng, data: {'method': 'GET', 'path': '/api/fichas?limit=100'},
+    'get_record': lambda rng, data: {'method': 'GET', 'path': f"/api/records/{rng.choice(data['ids'])}"},
+    'get_ficha': lambda rng, data: {'method': 'GET', 'path': f"/api/fichas/{rng.choice(data['ids'])}"},
+    'create_record': lambda rng, data: {
+        'method': 'POST', 'path': '/api/records',
+        'form': {
+            'first_name': rng.choice(NOMBRES),
+            'last_name': rng.choice(APELLIDOS),
+            'blood_type': rng.choice(TIPOS_SANGRE),
+            'emergency_contact_name': rng.choice(NOMBRES),
+            'emergency_contact_phone': '+34 600000000',
+        },
+        'files': {'profile_image': ('foto.jpg', data['jpeg'])},
+    },
+    'uploads_get': lambda rng, data: {'method': 'GET', 'path': f"/uploads/{rng.choice(data['images'])}"},
+}
+
+
+def setup_package_app(client, data, rng):
+    data['jpeg'] = jpeg_bytes(rng)
+
+
+# Escenarios que necesitan datos sembrados de un tipo concreto
+REQUIRES = {
+    'uploads_get': 'images',
+    'login': 'usernames',
+    'user_records': 'usernames',
+}
@@ -1,36 +1,70 @@
 import os
 import sys
+import csv
 import json
-import random
-import string
 import time
 import datetime
 from datetime import datetime, timedelta
 import base64
+import hashlib
+import tempfile
 import uuid
-import qrcode
 from io import BytesIO
-from PIL import Image
 from functools import wraps
-import jwt
+from itertools import groupby
 from flask import Flask, jsonify, request, abort, render_template, send_file
+import click
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
+from app.pagination import (InvalidCursor, decode_cursor, decode_offset, encode_cursor, encode_offset,
+                            keyset_filter, keyset_page, iter_query,
+                            parse_limit, stream_json_array, stream_ndjson, wants_stream)
+from app.qr_cache import qr_png_response
+from app.qr_batch import BATCH_FORMATS, build_batch, render_many
+from app.search import SearchIndex
+from app.file_serving import get_upload_index, send_upload
+from app.cache import TTLCache, get_record_cache
+from app.etags import not_modified, payload_etag, strong_etag, tag_response
+from app.serialization import json_response, row_mapper
+from app.snapshots import SnapshotStore, snapshot_cli
+from app.backup import backup_cli
+from app.upload_gc import referenced_stems, release_images, upload_gc_cli
+from app.bulk_io import (FORMATS, IMPORT_BATCH_SIZE, MAX_IMPORT_BATCH_SIZE, Checkpoint, check_lengths, check_types,
+                         export_chunks, export_response, import_stream, insert_rows, new_rows, parse_format)
+from app.validation import blood_type_error
+from app.db_profiles import configure_engine, init_engine_hooks
+from app.ids import IdAllocator, is_valid_id
+from app.startup import LazyMigrate
+from app.logs import configure_logging
+from app.metrics import init_metrics, registry, timed
+from app.compression import init_compression
+from app.ratelimit_storage import default_strategy, ratelimit_storage_uri
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+# Logs en JSON escritos por un hilo de fondo, fuera del camino de las peticiones
+configure_logging(app)
+# X-Next-Cursor: cursor de la siguiente página de /api/records/user, legible desde el frontend
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True, expose_headers=['X-Next-Cursor'])
 
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///motosegura.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Perfil del motor según la URL (DB_ENGINE_PROFILE): WAL en SQLite, pool dimensionado en PostgreSQL
+configure_engine(app)
 db = SQLAlchemy(app)
+init_engine_hooks(app, db)
+# alembic sólo se importa al usar `flask db` o `flask init`
+migrate = LazyMigrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 
 # Función para obtener la IP real del cliente considerando proxies
 def get_real_ip():
@@ -48,15 +82,25 @@ def get_real_ip():
     # Si no hay headers de proxy, usamos la IP remota
     return request.remote_addr
 
+# Los benchmarks desactivan los límites con RATELIMIT_ENABLED=false
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'true').lower() != 'false'
+
 # Configuración de rate limiter con límite global más estricto
 limiter = Limiter(
     app=app,
     key_func=get_real_ip,  # Usar la función personalizada para obtener la IP real
     default_limits=["10 per minute"],  # Límite global de 10 solicitudes por minuto por IP
-    storage_uri=os.environ.get('REDIS_URL', 'memory://'),  # Usar Redis si está disponible, memoria en caso contrario
-    strategy="fixed-window"  # Estrategia de ventana fija para el conteo
+    # Redis si está disponible; si no, un archivo SQLite compartido por todos los workers
+    storage_uri=ratelimit_storage_uri(),
+    strategy=os.environ.get('RATELIMIT_STRATEGY', default_strategy())  # Ventana deslizante entre workers
 )
 
+# Métricas Prometheus en /metrics, agregadas entre los workers de gunicorn (con la API key o METRICS_TOKEN)
+init_metrics(app, limiter, authorize=lambda: request.headers.get('X-API-Key') == API_KEY)
+
+# Compresión gzip/brotli de las respuestas grandes; las que llevan ETag se comprimen una sola vez
+init_compression(app)
+
 # Secret key para JWT - from environment variables
 JWT_SECRET = os.environ.get('JWT_SECRET', 'dev-jwt-secret')
 JWT_EXPIRATION_HOURS = int(os.environ.get('JWT_EXPIRATION_HOURS', '24'))
@@ -64,12 +108,25 @@ JWT_EXPIRATION_HOURS = int(os.environ.get('JWT_EXPIRATION_HOURS', '24'))
 # API Key para operaciones privilegiadas - from environment variables
 API_KEY = os.environ.get('API_KEY', 'dev-api-key')
 
+# Número máximo de fichas por lote de códigos QR
+QR_BATCH_MAX = int(os.environ.get('QR_BATCH_MAX', '1000'))
+
+# Número máximo de elementos por operación masiva
+BULK_MAX = int(os.environ.get('BULK_MAX', '1000'))
+
+# Resultados por página en las búsquedas
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '50'))
+
 # Directorio para guardar fotos - usar una ubicación persistente
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Delegar el envío de fotos al servidor web: 'x-accel' (nginx) o 'x-sendfile'
+app.config['UPLOAD_OFFLOAD'] = os.environ.get('UPLOAD_OFFLOAD', '')
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_protected_uploads')
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -96,6 +153,9 @@ class User(db.Model):
         return data
 
 class FichaMedica(db.Model):
+    # (change_seq, id) ordena los cambios de /api/fichas/changes
+    __table_args__ = (db.Index('ix_ficha_medica_change_seq_id', 'change_seq', 'id'),)
+    
     id = db.Column(db.String(10), primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     apellido = db.Column(db.String(100), nullable=False)
@@ -106,6 +166,13 @@ class FichaMedica(db.Model):
     medicaciones = db.Column(db.String(200), nullable=True)
     foto_url = db.Column(db.String(200), nullable=True, default='default.jpg')
     fecha_registro = db.Column(db.String(10), nullable=False)
+    # Versión de la fila: el ORM la incrementa en cada UPDATE (y detecta escrituras concurrentes)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
+    # Valor del contador de escrituras de fichas en el último cambio de la fila
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def to_dict(self):
         return {
@@ -118,13 +185,23 @@ class FichaMedica(db.Model):
             'alergias': self.alergias,
             'medicaciones': self.medicaciones,
             'foto_url': self.foto_url,
-            'fecha_registro': self.fecha_registro
+            'fecha_registro': self.fecha_registro,
+            'version': self.version
         }
 
+# Columnas de `to_dict`, en su orden: los listados las leen como tuplas, sin hidratar objetos
+COLUMNAS_FICHA = [FichaMedica.id, FichaMedica.nombre, FichaMedica.apellido, FichaMedica.tipo_sangre,
+                  FichaMedica.contacto_emergencia, FichaMedica.numero_contacto, FichaMedica.alergias,
+                  FichaMedica.medicaciones, FichaMedica.foto_url, FichaMedica.fecha_registro, FichaMedica.version]
+fila_a_dict = row_mapper(columna.key for columna in COLUMNAS_FICHA)
+
 class UserRecord(db.Model):
+    # (user_id, id) cubre el listado paginado de las fichas de un usuario
+    __table_args__ = (db.Index('ix_user_record_user_id_id', 'user_id', 'id'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    record_id = db.Column(db.String(10), db.ForeignKey('ficha_medica.id'), nullable=False)
+    record_id = db.Column(db.String(10), db.ForeignKey('ficha_medica.id'), nullable=False, index=True)
     status = db.Column(db.String(20), nullable=False, default='Active')
     created_at = db.Column(db.String(10), nullable=False)
     
@@ -140,11 +217,146 @@ class UserRecord(db.Model):
             'created_at': self.created_at
         }
 
+class FichaEliminada(db.Model):
+    # Registro de fichas eliminadas para /api/fichas/changes; `flask compact-changes` lo compacta
+    ficha_id = db.Column(db.String(10), primary_key=True)
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class DataVersion(db.Model):
+    # Contador de escrituras por tabla: cambia con cada INSERT, UPDATE o DELETE
+    # y sirve para calcular la ETag de los listados sin leer las filas
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+# Entrada de DataVersion con la secuencia más alta compactada del registro de eliminaciones
+HORIZONTE_ELIMINADAS = FichaEliminada.__tablename__
+
+def incrementar_version_datos(connection, tabla):
+    """
+    Incrementa el contador de escrituras de `tabla` en la transacción en curso.
+    
+    Devuelve el nuevo valor, que las fichas usan como secuencia de cambio:
+    el UPDATE bloquea la fila del contador hasta el commit, así que las
+    secuencias se confirman en orden.
+    """
+    tabla_versiones = DataVersion.__table__
+    actualizadas = connection.execute(
+        update(tabla_versiones).where(tabla_versiones.c.name == tabla)
+        .values(version=tabla_versiones.c.version + 1)
+    ).rowcount
+    if not actualizadas:
+        connection.execute(insert(tabla_versiones).values(name=tabla, version=1))
+        return 1
+    return connection.scalar(select(tabla_versiones.c.version).where(tabla_versiones.c.name == tabla))
+
+def registrar_eliminadas(connection, ids, seq):
+    """Anota en el registro de eliminaciones las fichas `ids`, borradas con la secuencia `seq`"""
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return
+    tabla = FichaEliminada.__table__
+    connection.execute(delete(tabla).where(tabla.c.ficha_id.in_(ids)))
+    ahora = datetime.utcnow()
+    connection.execute(insert(tabla), [{'ficha_id': i, 'change_seq': seq, 'deleted_at': ahora} for i in ids])
+
+def version_datos(tabla):
+    """Contador de escrituras actual de `tabla`"""
+    return db.session.query(DataVersion.version).filter_by(name=tabla).scalar() or 0
+
+@event.listens_for(db.session, 'before_flush')
+def versionar_cambios_orm(session, flush_context, instances):
+    """
+    Incrementa el contador de fichas cuando un flush crea, modifica o elimina
+    alguna: las creadas o modificadas toman el nuevo valor como `change_seq`
+    y las eliminadas se anotan en el registro de eliminaciones.
+    """
+    cambiadas = [objeto for objeto in (*session.new, *session.dirty) if isinstance(objeto, FichaMedica)
+                 and session.is_modified(objeto, include_collections=False)]
+    eliminadas = [objeto.id for objeto in session.deleted if isinstance(objeto, FichaMedica)]
+    if not cambiadas and not eliminadas:
+        return
+    seq = incrementar_version_datos(session.connection(), FichaMedica.__tablename__)
+    for ficha in cambiadas:
+        ficha.change_seq = seq
+    registrar_eliminadas(session.connection(), eliminadas, seq)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def versionar_cambios_masivos(orm_execute_state):
+    """Lo mismo que `versionar_cambios_orm` para los INSERT, UPDATE y DELETE masivos"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete) \
+            or orm_execute_state.bind_mapper is not FichaMedica.__mapper__:
+        return
+    connection = orm_execute_state.session.connection()
+    seq = incrementar_version_datos(connection, FichaMedica.__tablename__)
+    if orm_execute_state.is_delete:
+        ids = connection.scalars(select(FichaMedica.id).where(orm_execute_state.statement.whereclause))
+        registrar_eliminadas(connection, ids, seq)
+    elif isinstance(orm_execute_state.parameters, list):
+        # INSERT o UPDATE por clave primaria con una lista de filas
+        for fila in orm_execute_state.parameters:
+            fila['change_seq'] = seq
+    else:
+        orm_execute_state.statement = orm_execute_state.statement.values(change_seq=seq)
+
+# Índice de texto completo para las búsquedas por nombre y apellido
+ficha_search = SearchIndex(FichaMedica.__tablename__, 'id', ['nombre', 'apellido'])
+
+# Revisión de la migración que corresponde al esquema creado con create_all
+REVISION_ESQUEMA_INICIAL = 'd2e7ce6f9379'
+
 # Initialize database
 def init_db():
+    from flask_migrate import stamp, upgrade
+    
+    migrate.load()
     with app.app_context():
-        # Create all tables if they don't exist
-        db.create_all()
+        tablas = set(db.inspect(db.engine).get_table_names())
+        if 'alembic_version' in tablas:
+            # Aplicar las migraciones pendientes
+            upgrade()
+        elif 'ficha_medica' in tablas:
+            # Base de datos anterior a las migraciones: marcarla y actualizarla
+            stamp(revision=REVISION_ESQUEMA_INICIAL)
+            upgrade()
+        else:
+            # Create all tables if they don't exist
+            db.create_all()
+            stamp()
+        # Crear el índice de búsqueda (y sus triggers) si todavía no existe
+        ficha_search.ensure(db.engine)
+
+# Cachés de tokens verificados (token -> user_id) y de usuarios (user_id -> columnas)
+token_cache = TTLCache(max_entries=int(os.environ.get('TOKEN_CACHE_SIZE', '10000')),
+                       ttl=int(os.environ.get('TOKEN_CACHE_TTL', '300')))
+user_cache = TTLCache(max_entries=int(os.environ.get('USER_CACHE_SIZE', '10000')),
+                      ttl=int(os.environ.get('USER_CACHE_TTL', '60')))
+registry.register_stats('token', token_cache.stats)
+registry.register_stats('user', user_cache.stats)
+
+def cargar_usuario(user_id):
+    """
+    Devuelve el usuario asociado a la sesión actual, usando la caché si es posible.
+    
+    En un acierto se reconstruye la instancia desde las columnas guardadas y se
+    adjunta a la sesión sin consultar la base de datos.
+    """
+    valores = user_cache.get(user_id)
+    if valores is not None:
+        user = User(**valores)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    
+    user = db.session.get(User, user_id)
+    if user:
+        user_cache.set(user_id, {c.key: getattr(user, c.key) for c in User.__table__.columns})
+    return user
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidar_usuario(mapper, connection, target):
+    """Invalida la caché del usuario cuando cambia o se elimina"""
+    user_cache.pop(target.id)
 
 # Decorador para verificar token JWT
 def token_required(f):
@@ -161,26 +373,262 @@ def token_required(f):
         if not token:
             return jsonify({'message': 'Token no proporcionado'}), 401
         
-        try:
-            # Decodificar el token
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            current_user = User.query.get(data["user_id"])
-            
-            if not current_user:
-                return jsonify({'message': 'Usuario no válido'}), 401
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token expirado'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Token inválido'}), 401
+        # Los tokens ya verificados se guardan en caché hasta su expiración
+        user_id = token_cache.get(token)
+        if user_id is None:
+            import jwt  # PyJWT carga sus algoritmos al importarse: sólo cuando hace falta
+            try:
+                # Decodificar el token
+                data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+            except jwt.ExpiredSignatureError:
+                return jsonify({'message': 'Token expirado'}), 401
+            except jwt.InvalidTokenError:
+                return jsonify({'message': 'Token inválido'}), 401
+            user_id = data["user_id"]
+            token_cache.set(token, user_id, ttl=data["exp"] - time.time() if "exp" in data else None)
+        
+        current_user = cargar_usuario(user_id)
+        if not current_user:
+            return jsonify({'message': 'Usuario no válido'}), 401
             
         return f(current_user, *args, **kwargs)
     
     return decorated
 
+# IDs de ficha: 7 caracteres sin orden aparente, reservados por bloques (sin consultar la tabla)
+ficha_ids = IdAllocator(FichaMedica.__tablename__)
+
 def generar_id_unico():
-    """Genera un ID único alfanumérico de 6 caracteres"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    """Genera un ID único alfanumérico de 7 caracteres"""
+    return ficha_ids.next_id(db.engine)
+
+def generar_ids_unicos(cantidad):
+    """Genera `cantidad` IDs únicos de una vez"""
+    return ficha_ids.allocate(db.engine, cantidad)
+
+# Campos obligatorios de una ficha y campos que se pueden modificar
+CAMPOS_REQUERIDOS_FICHA = ['nombre', 'apellido', 'tipo_sangre', 'contacto_emergencia', 'numero_contacto']
+CAMPOS_EDITABLES_FICHA = CAMPOS_REQUERIDOS_FICHA + ['alergias', 'medicaciones', 'foto_url']
+
+# Foto por defecto de las fichas (no es un archivo de UPLOAD_FOLDER)
+FOTO_POR_DEFECTO = 'default.jpg'
+
+def error_foto(foto_url):
+    """Mensaje de error si `foto_url` no es la foto por defecto ni un archivo subido a UPLOAD_FOLDER, o None"""
+    if foto_url == FOTO_POR_DEFECTO:
+        return None
+    # Sólo nombres de archivo sueltos: una ruta permitiría que la limpieza de fotos borrase archivos ajenos
+    if not isinstance(foto_url, str) or not foto_url or foto_url.startswith('.') \
+            or os.path.basename(foto_url) != foto_url:
+        return "foto_url debe ser el nombre de una foto subida"
+    if not os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], foto_url)):
+        return "La foto no existe"
+    return None
+
+def validar_ficha(data, parcial=False):
+    """Devuelve un mensaje de error si los datos de la ficha no son válidos, o None"""
+    if not isinstance(data, dict):
+        return "Cada ficha debe ser un objeto"
+    if not parcial:
+        for field in CAMPOS_REQUERIDOS_FICHA:
+            if not data.get(field):
+                return f"Campo requerido: {field}"
+    desconocidos = [k for k in data if k not in CAMPOS_EDITABLES_FICHA and k != 'id']
+    if desconocidos:
+        return f"Campos no permitidos: {', '.join(desconocidos)}"
+    if 'foto_url' in data:
+        return error_foto(data['foto_url'])
+    return None
+
+def leer_lote(clave):
+    """Lee la lista de elementos de una petición masiva (objeto con `clave` o lista directa)"""
+    data = request.json
+    items = data.get(clave) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        abort(400, description=f"Se requiere una lista no vacía en '{clave}'")
+    if len(items) > BULK_MAX:
+        abort(400, description=f"Máximo {BULK_MAX} elementos por petición")
+    atomico = isinstance(data, dict) and bool(data.get('atomic'))
+    return items, atomico
+
+def respuesta_lote(resultados, aplicados, atomico, codigo_ok=200):
+    """Construye la respuesta por elemento de una operación masiva"""
+    errores = sum(1 for r in resultados if r['status'] == 'error')
+    if errores and atomico:
+        # En modo atómico un solo error cancela todo el lote
+        for r in resultados:
+            if r['status'] != 'error':
+                r['status'] = 'skipped'
+        return jsonify({"status": "error", "message": "Lote rechazado: no se aplicó ningún cambio",
+                        "results": resultados}), 400
+    if errores:
+        return jsonify({"status": "partial", "message": f"{aplicados} aplicados, {errores} con errores",
+                        "results": resultados}), 207
+    return jsonify({"status": "success", "message": f"{aplicados} aplicados", "results": resultados}), codigo_ok
+
+# Campos de la exportación masiva: los de `to_dict` más, opcionalmente, los vínculos con usuarios
+CAMPOS_EXPORTACION = [columna.key for columna in COLUMNAS_FICHA]
+CAMPOS_EXPORTACION_USUARIOS = CAMPOS_EXPORTACION + ['usuarios']
+
+def exportar_fichas(con_usuarios=False):
+    """
+    Diccionarios de todas las fichas, leídos por lotes desde un cursor del servidor.
+    
+    Con `con_usuarios` cada ficha lleva en `usuarios` sus vínculos. Se leen
+    con un LEFT JOIN ordenado por ficha y se agrupan al vuelo, así que
+    nunca hay más de una ficha en memoria.
+    """
+    if not con_usuarios:
+        return map(fila_a_dict, iter_query(db.session.query(*COLUMNAS_FICHA), [FichaMedica.id]))
+    
+    consulta = db.session.query(*COLUMNAS_FICHA, UserRecord.user_id, UserRecord.status, UserRecord.created_at) \
+        .outerjoin(UserRecord, UserRecord.record_id == FichaMedica.id)
+    n = len(COLUMNAS_FICHA)
+    
+    def agrupar(filas):
+        for _, grupo in groupby(filas, key=lambda fila: fila[0]):
+            grupo = list(grupo)
+            ficha = fila_a_dict(grupo[0][:n])
+            ficha['usuarios'] = [{'user_id': fila[n], 'status': fila[n + 1], 'created_at': fila[n + 2]}
+                                 for fila in grupo if fila[n] is not None]
+            yield ficha
+    return agrupar(iter_query(consulta, [FichaMedica.id, UserRecord.id]))
+
+def leer_vinculos(valor):
+    """Vínculos con usuarios de una ficha importada (lista, o JSON en una celda CSV)"""
+    if valor in (None, ''):
+        return []
+    if isinstance(valor, str):
+        try:
+            valor = json.loads(valor)
+        except ValueError:
+            raise ValueError("usuarios debe ser una lista JSON")
+    if not isinstance(valor, list):
+        raise ValueError("usuarios debe ser una lista")
+    vinculos = []
+    for vinculo in valor:
+        if not isinstance(vinculo, dict) or not isinstance(vinculo.get('user_id'), int):
+            raise ValueError("Cada vínculo de usuarios necesita un user_id entero")
+        vinculos.append({
+            'user_id': vinculo['user_id'],
+            'status': vinculo.get('status') or 'Active',
+            'created_at': vinculo.get('created_at') or time.strftime('%Y-%m-%d')
+        })
+    return vinculos
+
+def preparar_ficha_importada(data):
+    """Fila completa de `ficha_medica` a partir de una ficha importada; ValueError si no es válida"""
+    for field in CAMPOS_REQUERIDOS_FICHA:
+        if not data.get(field):
+            raise ValueError(f"Campo requerido: {field}")
+    error = blood_type_error(data['tipo_sangre'])
+    if error:
+        raise ValueError(error)
+    
+    fila = {
+        'id': data.get('id') or None,
+        'nombre': data['nombre'],
+        'apellido': data['apellido'],
+        'tipo_sangre': data['tipo_sangre'],
+        'contacto_emergencia': data['contacto_emergencia'],
+        'numero_contacto': data['numero_contacto'],
+        'alergias': data.get('alergias') or 'Ninguna',
+        'medicaciones': data.get('medicaciones') or 'Ninguna',
+        'foto_url': data.get('foto_url') or 'default.jpg',
+        'fecha_registro': data.get('fecha_registro') or time.strftime('%Y-%m-%d'),
+        'version': 1
+    }
+    if fila['id'] is not None and not is_valid_id(fila['id']):
+        raise ValueError(f"ID no válido: {fila['id']!r}")
+    error = check_types(FichaMedica.__table__, fila) or check_lengths(FichaMedica.__table__, fila)
+    if error:
+        raise ValueError(error)
+    if os.path.basename(fila['foto_url']) != fila['foto_url']:
+        raise ValueError("foto_url debe ser un nombre de archivo")
+    fila['usuarios'] = leer_vinculos(data.get('usuarios'))
+    return fila
+
+def escribir_lote_fichas(filas):
+    """
+    Inserta un lote de fichas importadas (y sus vínculos) en una transacción.
+    
+    Las fichas cuyo ID ya existe se omiten junto con sus vínculos, y los
+    vínculos con usuarios que no existen se descartan.
+    """
+    sin_id = [fila for fila in filas if not fila['id']]
+    for fila, nuevo_id in zip(sin_id, generar_ids_unicos(len(sin_id))):
+        fila['id'] = nuevo_id
+    
+    connection = db.session.connection()
+    nuevas, omitidas = new_rows(connection, FichaMedica.id, filas)
+    vinculos = [dict(vinculo, record_id=fila['id']) for fila in nuevas for vinculo in fila.pop('usuarios')]
+    if nuevas:
+        seq = incrementar_version_datos(connection, FichaMedica.__tablename__)
+        for fila in nuevas:
+            fila['change_seq'] = seq
+    insert_rows(connection, FichaMedica.__table__, nuevas)
+    if vinculos:
+        usuarios = set(connection.scalars(select(User.id).where(User.id.in_({v['user_id'] for v in vinculos}))))
+        insert_rows(connection, UserRecord.__table__, [v for v in vinculos if v['user_id'] in usuarios])
+    db.session.commit()
+    fichas_modificadas(*(fila['id'] for fila in nuevas))
+    return len(nuevas), omitidas
+
+# Caché compartida entre workers de las fichas serializadas (consultas tras escanear un QR)
+ficha_cache = get_record_cache('ficha')
+registry.register_stats('ficha', ficha_cache.stats)
+
+def cargar_fichas(ids):
+    """Fichas `ids` como diccionarios de `to_dict`, con una sola consulta"""
+    filas = db.session.query(*COLUMNAS_FICHA).filter(FichaMedica.id.in_(ids))
+    return {fila.id: fila_a_dict(fila) for fila in filas}
+
+def url_foto_ficha(ficha):
+    foto = ficha.get('foto_url')
+    return f"/uploads/{foto}" if foto and foto != 'default.jpg' else None
+
+# Instantáneas estáticas (JSON + HTML) de cada ficha para los escaneos; SNAPSHOT_FOLDER las activa
+ficha_snapshots = SnapshotStore(
+    os.environ.get('SNAPSHOT_FOLDER', ''), cargar_fichas,
+    lambda: (fila[0] for fila in iter_query(db.session.query(FichaMedica.id), [FichaMedica.id])),
+    url_foto_ficha
+)
+
+def fichas_modificadas(*ids):
+    """Tras confirmar cambios en fichas: vacía su caché y regenera sus instantáneas"""
+    ficha_cache.invalidate(*ids)
+    ficha_snapshots.refresh(*ids)
+
+def liberar_fotos(*nombres):
+    """Tras confirmar cambios en fichas: borra las fotos que ya no usa ninguna"""
+    carpeta = app.config['UPLOAD_FOLDER']
+    release_images(nombres, [carpeta], lambda raices: referenced_stems(db, FichaMedica.foto_url, raices),
+                   forget=get_upload_index(app, lambda: [carpeta]).forget)
+
+def cargar_ficha_json(ficha_id):
+    """Ficha serializada como JSON, desde la caché o con una sola consulta en un fallo"""
+    def cargar():
+        ficha = db.session.get(FichaMedica, ficha_id)
+        return app.json.dumps(ficha.to_dict()).encode() if ficha else None
+    return ficha_cache.get_or_load(ficha_id, cargar)
+
+def qr_data_for(ficha_id):
+    """URL completa a la que apunta el QR de una ficha (frontend)"""
+    return f"motosegura.online/ficha/{ficha_id}"
+
+def buscar_fichas(nombre='', apellido='', q='', limit=SEARCH_PAGE_SIZE, offset=0):
+    """Fichas que coinciden con la búsqueda (filas de `COLUMNAS_FICHA`), ordenadas por relevancia"""
+    ids = ficha_search.search(db.session, {'nombre': nombre, 'apellido': apellido}, q, limit, offset)
+    if not ids:
+        return []
+    por_id = {ficha.id: ficha for ficha in db.session.query(*COLUMNAS_FICHA).filter(FichaMedica.id.in_(ids))}
+    return [por_id[i] for i in ids if i in por_id]
+
+def construir_lote_qr(fichas, formato='pdf', workers=None):
+    """Renderiza en paralelo los QR de las fichas y los empaqueta en una hoja o un zip"""
+    pngs = render_many([qr_data_for(ficha.id) for ficha in fichas], workers=workers)
+    etiquetas = [f"{ficha.id} - {ficha.nombre} {ficha.apellido}" for ficha in fichas]
+    return build_batch(pngs, etiquetas, [ficha.id for ficha in fichas], formato)
 
 def verificar_api_key():
     """Verifica si la solicitud contiene una API key válida"""
@@ -213,6 +661,7 @@ def login():
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
     
+    import jwt
     token = jwt.encode(token_payload, JWT_SECRET, algorithm="HS256")
     
     return jsonify({
@@ -248,6 +697,7 @@ def update_user_profile(current_user):
             setattr(current_user, key, value)
     
     db.session.commit()
+    user_cache.pop(current_user.id)
     
     return jsonify({
         'message': 'Perfil actualizado con éxito',
@@ -257,23 +707,46 @@ def update_user_profile(current_user):
 @app.route('/api/records/user', methods=['GET'])
 @token_required
 def get_user_records(current_user):
-    """Obtener fichas médicas del usuario"""
-    user_record_items = UserRecord.query.filter_by(user_id=current_user.id).all()
-    
-    records = []
-    for user_record in user_record_items:
-        ficha = FichaMedica.query.get(user_record.record_id)
-        if ficha:
-            record_data = {
-                'id': ficha.id,
-                'nombre': ficha.nombre,
-                'apellido': ficha.apellido,
-                'status': user_record.status,
-                'created_at': user_record.created_at
-            }
-            records.append(record_data)
-    
-    return jsonify(records)
+    """
+    Obtener fichas médicas del usuario.
+    
+    Una sola consulta con JOIN que trae sólo las columnas necesarias. Con
+    `limit`/`cursor` se pagina por el ID de la relación y el cursor de la
+    siguiente página se devuelve en la cabecera `X-Next-Cursor`.
+    """
+    query = db.session.query(
+        UserRecord.id.label('user_record_id'),
+        FichaMedica.id,
+        FichaMedica.nombre,
+        FichaMedica.apellido,
+        UserRecord.status,
+        UserRecord.created_at
+    ).join(FichaMedica, FichaMedica.id == UserRecord.record_id).filter(UserRecord.user_id == current_user.id)
+    
+    next_cursor = None
+    cursor = request.args.get('cursor')
+    if cursor or 'limit' in request.args:
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            filas, next_cursor = keyset_page(query, [UserRecord.id], cursor, limit,
+                                             row_key=lambda fila: [fila.user_record_id])
+        except (InvalidCursor, ValueError) as e:
+            abort(400, description=str(e))
+    else:
+        filas = query.order_by(UserRecord.id).all()
+    
+    records = [{
+        'id': fila.id,
+        'nombre': fila.nombre,
+        'apellido': fila.apellido,
+        'status': fila.status,
+        'created_at': fila.created_at
+    } for fila in filas]
+    
+    response = json_response(records)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @app.route('/')
 def hello():
@@ -284,20 +757,139 @@ def health():
     """Health check endpoint."""
     return jsonify({"status": "healthy"})
 
+# El listado elige entre JSON y NDJSON también según la cabecera Accept
+VARY_LISTADO = ('Accept',)
+
 @app.route('/api/fichas', methods=['GET'])
 @limiter.limit("10 per minute")  # Límite estándar para consultas generales
 def get_fichas():
-    """Obtener todas las fichas médicas."""
-    fichas = FichaMedica.query.all()
-    return jsonify({"status": "success", "fichas": [ficha.to_dict() for ficha in fichas]})
+    """
+    Obtener las fichas médicas.
+
+    Con `limit`/`cursor` devuelve una página ordenada por ID junto con
+    `next_cursor`. Sin parámetros, o con `format=ndjson`, el listado se
+    genera fila a fila desde un cursor del servidor para mantener la
+    memoria constante sin importar el tamaño de la tabla.
+    """
+    # La ETag depende sólo del contador de escrituras, de los parámetros y del formato
+    # (que también se elige con Accept): un 304 no lee filas
+    stream = wants_stream(request)
+    etag = strong_etag('fichas', version_datos(FichaMedica.__tablename__), request.query_string, stream)
+    respuesta = not_modified(etag, VARY_LISTADO)
+    if respuesta:
+        return respuesta
+
+    columns = [FichaMedica.id]
+    filas = db.session.query(*COLUMNAS_FICHA)
+    cursor = request.args.get('cursor')
+
+    if stream == 'ndjson':
+        return tag_response(stream_ndjson(iter_query(filas, columns), fila_a_dict), etag, VARY_LISTADO)
+
+    if stream is None and (cursor or 'limit' in request.args):
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            fichas, next_cursor = keyset_page(filas, columns, cursor, limit)
+        except (InvalidCursor, ValueError) as e:
+            abort(400, description=str(e))
+        return tag_response(json_response({
+            "status": "success",
+            "fichas": [fila_a_dict(ficha) for ficha in fichas],
+            "next_cursor": next_cursor
+        }), etag, VARY_LISTADO)
+
+    return tag_response(stream_json_array(iter_query(filas, columns), fila_a_dict,
+                                          'fichas', envelope={"status": "success"}), etag, VARY_LISTADO)
+
+# Clave de ordenación de los cambios; el token de `since` añade la secuencia desde la que informar eliminaciones
+COLUMNAS_CAMBIOS = [FichaMedica.change_seq, FichaMedica.id]
+
+def leer_token_cambios(token, actual):
+    """(secuencia, último ID, secuencia de eliminaciones) de un token de /api/fichas/changes"""
+    if not token:
+        # Descarga completa: las eliminaciones anteriores no afectan al cliente
+        return -1, None, actual
+    seq, ultimo_id, eliminadas = decode_cursor(token, COLUMNAS_CAMBIOS + [FichaMedica.change_seq])
+    if not isinstance(seq, int) or not isinstance(eliminadas, int) \
+            or not (ultimo_id is None or isinstance(ultimo_id, str)):
+        raise InvalidCursor('cursor inválido')
+    return seq, ultimo_id, eliminadas
+
+@app.route('/api/fichas/changes', methods=['GET'])
+@limiter.limit("60 per minute")  # Pensado para sondeos frecuentes: cada respuesta trae sólo lo nuevo
+def get_fichas_changes():
+    """
+    Fichas creadas, modificadas o eliminadas desde el token `since`.
+
+    Devuelve las fichas cambiadas (`fichas`, en orden de cambio), los IDs
+    eliminados (`eliminadas`) y el token `next_since` para la consulta
+    siguiente; con `has_more` hay que seguir pidiendo enseguida. Sin `since`
+    devuelve todas las fichas. Un token anterior a la última compactación
+    del registro de eliminaciones (o de una base de datos restaurada)
+    responde 410 y el cliente debe empezar de nuevo sin `since`.
+    """
+    actual = version_datos(FichaMedica.__tablename__)
+    horizonte = version_datos(HORIZONTE_ELIMINADAS)
+    etag = strong_etag('cambios', actual, horizonte, request.query_string)
+    respuesta = not_modified(etag)
+    if respuesta:
+        return respuesta
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        seq, ultimo_id, desde_eliminadas = leer_token_cambios(request.args.get('since'), actual)
+    except (InvalidCursor, ValueError) as e:
+        abort(400, description=str(e))
+    if desde_eliminadas < horizonte or max(seq, desde_eliminadas) > actual:
+        abort(410, description="El token de sincronización ya no es válido: descargue todas las fichas sin since")
+
+    # Sólo cambios ya contados en `actual` (leído antes): los confirmados después llegan en la próxima consulta
+    filas = db.session.query(*COLUMNAS_FICHA, FichaMedica.change_seq).filter(FichaMedica.change_seq <= actual)
+    if ultimo_id is None:
+        filas = filas.filter(FichaMedica.change_seq > seq)
+    else:
+        filas = filas.filter(keyset_filter(COLUMNAS_CAMBIOS, [seq, ultimo_id]))
+    filas = filas.order_by(*COLUMNAS_CAMBIOS).limit(limit + 1).all()
+
+    has_more = len(filas) > limit
+    if has_more:
+        filas = filas[:limit]
+        hasta = filas[-1].change_seq
+        siguiente = [hasta, filas[-1].id, max(desde_eliminadas, hasta)]
+    else:
+        hasta = actual
+        siguiente = [actual, None, actual]
+
+    eliminadas = []
+    if hasta > desde_eliminadas:
+        # Una ficha restaurada después de eliminarse vuelve a aparecer entre las cambiadas
+        eliminadas = [fila[0] for fila in db.session.query(FichaEliminada.ficha_id).filter(
+            FichaEliminada.change_seq > desde_eliminadas, FichaEliminada.change_seq <= hasta,
+            ~select(FichaMedica.id).where(FichaMedica.id == FichaEliminada.ficha_id).exists()
+        ).order_by(FichaEliminada.change_seq)]
+
+    return tag_response(json_response({
+        "status": "success",
+        "fichas": [fila_a_dict(fila) for fila in filas],
+        "eliminadas": eliminadas,
+        "next_since": encode_cursor(siguiente),
+        "has_more": has_more
+    }), etag)
 
 @app.route('/api/fichas/<ficha_id>', methods=['GET'])
 @limiter.limit("15 per minute")  # Un poco más permisivo para consultas individuales
 def get_ficha(ficha_id):
     """Obtener una ficha médica por ID."""
-    ficha = FichaMedica.query.get(ficha_id)
+    ficha = cargar_ficha_json(ficha_id)
     if ficha:
-        return jsonify({"status": "success", "ficha": ficha.to_dict()})
+        # La ETag se calcula sobre la ficha ya serializada (incluye su versión)
+        etag = payload_etag(ficha)
+        respuesta = not_modified(etag)
+        if respuesta:
+            return respuesta
+        # La ficha ya está serializada: se inserta en la respuesta sin volver a codificarla
+        return tag_response(app.response_class(b'{"status":"success","ficha":' + ficha + b'}',
+                                               mimetype='application/json'), etag)
     else:
         abort(404, description="Ficha médica no encontrada")
 
@@ -315,8 +907,6 @@ def add_ficha():
     
     # Generar ID único
     nuevo_id = generar_id_unico()
-    while FichaMedica.query.get(nuevo_id):
-        nuevo_id = generar_id_unico()  # Regenerar si existe
     
     # Crear nueva ficha médica
     nueva_ficha = FichaMedica(
@@ -334,6 +924,7 @@ def add_ficha():
     
     db.session.add(nueva_ficha)
     db.session.commit()
+    fichas_modificadas(nuevo_id)
     
     return jsonify({
         "status": "success", 
@@ -361,13 +952,21 @@ def update_ficha(ficha_id):
         abort(404, description="Ficha médica no encontrada")
     
     data = request.json
+    if 'foto_url' in data:
+        error = error_foto(data['foto_url'])
+        if error:
+            abort(400, description=error)
+    anterior = ficha.foto_url
     
     # Actualizar campos
     for key, value in data.items():
-        if key != 'id' and key != 'fecha_registro':  # No permitir cambiar ciertos campos
+        if key not in ('id', 'fecha_registro', 'version'):  # No permitir cambiar ciertos campos
             setattr(ficha, key, value)
     
     db.session.commit()
+    fichas_modificadas(ficha_id)
+    if ficha.foto_url != anterior:
+        liberar_fotos(anterior)
     
     return jsonify({"status": "success", "message": "Ficha médica actualizada con éxito", "ficha": ficha.to_dict()})
 
@@ -389,57 +988,291 @@ def delete_ficha(ficha_id):
     
     db.session.delete(ficha)
     db.session.commit()
+    fichas_modificadas(ficha_id)
+    liberar_fotos(ficha_data['foto_url'])
     
     return jsonify({"status": "success", "message": "Ficha médica eliminada con éxito", "ficha": ficha_data})
 
+@app.route('/api/fichas/bulk', methods=['POST'])
+@limiter.limit("10 per minute")
+def add_fichas_bulk():
+    """
+    Añadir varias fichas médicas en una sola transacción.
+    
+    Todas las fichas se validan antes de escribir y las válidas se insertan
+    con un único INSERT multi-fila. Con `atomic: true` un error en cualquier
+    ficha cancela el lote completo.
+    """
+    items, atomico = leer_lote('fichas')
+    
+    resultados, validos = [], []
+    for i, item in enumerate(items):
+        error = validar_ficha(item)
+        if error:
+            resultados.append({"index": i, "status": "error", "error": error})
+        else:
+            resultados.append({"index": i, "status": "created"})
+            validos.append((resultados[-1], item))
+    
+    if atomico and len(validos) < len(items):
+        return respuesta_lote(resultados, 0, atomico)
+    
+    fecha = time.strftime('%Y-%m-%d')
+    filas = []
+    for (resultado, item), nuevo_id in zip(validos, generar_ids_unicos(len(validos))):
+        filas.append({
+            'id': nuevo_id,
+            'nombre': item['nombre'],
+            'apellido': item['apellido'],
+            'tipo_sangre': item['tipo_sangre'],
+            'contacto_emergencia': item['contacto_emergencia'],
+            'numero_contacto': item['numero_contacto'],
+            'alergias': item.get('alergias', 'Ninguna'),
+            'medicaciones': item.get('medicaciones', 'Ninguna'),
+            'foto_url': 'default.jpg',
+            'fecha_registro': fecha
+        })
+        resultado.update({"id": nuevo_id, "qr_url": f"/fichas/{nuevo_id}"})
+    
+    if filas:
+        db.session.execute(insert(FichaMedica), filas)
+        db.session.commit()
+        fichas_modificadas(*(fila['id'] for fila in filas))
+    
+    return respuesta_lote(resultados, len(filas), atomico, codigo_ok=201)
+
+@app.route('/api/fichas/bulk', methods=['PUT'])
+@limiter.limit("10 per minute")
+def update_fichas_bulk():
+    """Actualizar varias fichas médicas en una sola transacción (requiere API key)."""
+    verificar_api_key()
+    items, atomico = leer_lote('fichas')
+    
+    ids = [item.get('id') for item in items if isinstance(item, dict) and isinstance(item.get('id'), str)]
+    # Versión actual de cada ficha: el UPDATE masivo la incrementa y la usa para detectar conflictos
+    existentes, fotos = {}, {}
+    for ficha_id, version, foto in db.session.query(FichaMedica.id, FichaMedica.version, FichaMedica.foto_url) \
+            .filter(FichaMedica.id.in_(ids)):
+        existentes[ficha_id], fotos[ficha_id] = version, foto
+    
+    resultados, filas, vistos = [], [], set()
+    for i, item in enumerate(items):
+        error = validar_ficha(item, parcial=True)
+        ficha_id = item.get('id') if isinstance(item, dict) else None
+        if not error and not ficha_id:
+            error = "Campo requerido: id"
+        elif not error and not isinstance(ficha_id, str):
+            error = "El ID debe ser texto"
+        elif not error and len(item) == 1:
+            error = "No hay campos que actualizar"
+        elif not error and ficha_id not in existentes:
+            error = "Ficha médica no encontrada"
+        elif not error and ficha_id in vistos:
+            error = "ID repetido en el lote"
+        if error:
+            resultados.append({"index": i, "id": ficha_id, "status": "error", "error": error})
+            continue
+        vistos.add(ficha_id)
+        filas.append(dict(item, version=existentes[ficha_id]))
+        resultados.append({"index": i, "id": ficha_id, "status": "updated"})
+    
+    if atomico and len(filas) < len(items):
+        return respuesta_lote(resultados, 0, atomico)
+    
+    if filas:
+        # UPDATE masivo por clave primaria (executemany agrupado por columnas)
+        db.session.execute(update(FichaMedica), filas)
+        db.session.commit()
+        fichas_modificadas(*vistos)
+        # Fotos reemplazadas por el lote
+        liberar_fotos(*(fotos[fila['id']] for fila in filas
+                        if 'foto_url' in fila and fila['foto_url'] != fotos[fila['id']]))
+    
+    return respuesta_lote(resultados, len(filas), atomico)
+
+@app.route('/api/fichas/bulk', methods=['DELETE'])
+@limiter.limit("10 per minute")
+def delete_fichas_bulk():
+    """Eliminar varias fichas médicas en una sola transacción (requiere API key)."""
+    verificar_api_key()
+    ids, atomico = leer_lote('ids')
+    
+    validos = [i for i in ids if isinstance(i, str)]
+    # ID -> foto, para liberar las fotos tras el borrado
+    existentes = dict(db.session.query(FichaMedica.id, FichaMedica.foto_url).filter(FichaMedica.id.in_(validos)))
+    
+    resultados = []
+    for i, ficha_id in enumerate(ids):
+        if not isinstance(ficha_id, str):
+            resultados.append({"index": i, "id": ficha_id, "status": "error", "error": "El ID debe ser texto"})
+        elif ficha_id in existentes:
+            resultados.append({"index": i, "id": ficha_id, "status": "deleted"})
+        else:
+            resultados.append({"index": i, "id": ficha_id, "status": "error", "error": "Ficha médica no encontrada"})
+    
+    if atomico and len(existentes) < len(ids):
+        return respuesta_lote(resultados, 0, atomico)
+    
+    if existentes:
+        # Eliminar registros de usuario asociados y las fichas con dos sentencias
+        db.session.execute(delete(UserRecord).where(UserRecord.record_id.in_(existentes)),
+                           execution_options={'synchronize_session': False})
+        db.session.execute(delete(FichaMedica).where(FichaMedica.id.in_(existentes)),
+                           execution_options={'synchronize_session': False})
+        db.session.commit()
+        fichas_modificadas(*existentes)
+        liberar_fotos(*existentes.values())
+    
+    return respuesta_lote(resultados, len(existentes), atomico)
+
+@app.route('/api/fichas/export', methods=['GET'])
+@limiter.limit("5 per minute")
+def export_fichas():
+    """
+    Exportar todas las fichas en CSV o NDJSON (requiere API key).
+    
+    `format=csv|ndjson` (o la cabecera Accept) elige el formato y
+    `usuarios=true` añade los vínculos con usuarios. Se genera en streaming
+    desde un cursor del servidor.
+    """
+    verificar_api_key()
+    try:
+        formato = parse_format(request.args.get('format'), request.headers.get('Accept', ''))
+    except ValueError as e:
+        abort(400, description=str(e))
+    con_usuarios = request.args.get('usuarios', '').lower() in ('1', 'true', 'yes')
+    campos = CAMPOS_EXPORTACION_USUARIOS if con_usuarios else CAMPOS_EXPORTACION
+    return export_response(exportar_fichas(con_usuarios), campos, formato, 'fichas')
+
+@app.route('/api/fichas/import', methods=['POST'])
+@limiter.limit("5 per minute")
+def import_fichas():
+    """
+    Importar fichas en CSV o NDJSON desde el cuerpo de la petición (requiere API key).
+    
+    El cuerpo se lee en streaming y se inserta por lotes de `batch_size`
+    filas, cada uno en su transacción. Si la importación se interrumpe,
+    `rows` indica las filas ya confirmadas: repetir la petición con
+    `skip=<rows>` la reanuda. Las fichas cuyo ID ya existe se omiten.
+    """
+    verificar_api_key()
+    try:
+        formato = parse_format(request.args.get('format'), request.content_type)
+        skip = int(request.args.get('skip', 0))
+        batch_size = min(int(request.args.get('batch_size', IMPORT_BATCH_SIZE)), MAX_IMPORT_BATCH_SIZE)
+    except ValueError as e:
+        abort(400, description=str(e))
+    if skip < 0 or batch_size < 1:
+        abort(400, description="skip y batch_size deben ser positivos")
+    
+    progreso = Checkpoint(None, 'api')
+    try:
+        resultado = import_stream(request.stream, formato, preparar_ficha_importada, escribir_lote_fichas,
+                                  batch_size, progreso, skip)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Cuerpo que no es UTF-8 o CSV mal formado: los lotes anteriores ya están confirmados
+        db.session.rollback()
+        return jsonify({"status": "error", "message": f"Archivo no válido: {e}", **progreso.state}), 400
+    except SQLAlchemyError:
+        db.session.rollback()
+        app.logger.exception("Error importando fichas", extra={'rows': progreso.state['rows']})
+        return jsonify({"status": "error", "message": "Importación interrumpida; reanude con skip=rows",
+                        **progreso.state}), 500
+    return jsonify({"status": "success", **resultado.to_dict()})
+
 @app.route('/api/buscar/fichas', methods=['GET'])
 @limiter.limit("10 per minute")  # Límite estándar para búsquedas
 def search_fichas():
-    """Buscar fichas médicas por nombre o apellido."""
+    """
+    Buscar fichas médicas por nombre, apellido o texto libre (`q`).
+    
+    Usa el índice de texto completo: ignora acentos, trata cada palabra como
+    prefijo y ordena por relevancia. Devuelve como máximo `limit` fichas y un
+    `next_cursor` para pedir la siguiente página.
+    """
     nombre = request.args.get('nombre', '')
     apellido = request.args.get('apellido', '')
+    q = request.args.get('q', '')
     
-    query = FichaMedica.query
+    try:
+        limit = parse_limit(request.args.get('limit'), default=SEARCH_PAGE_SIZE)
+        offset = decode_offset(request.args.get('cursor'))
+    except (InvalidCursor, ValueError) as e:
+        abort(400, description=str(e))
     
-    if nombre:
-        query = query.filter(FichaMedica.nombre.ilike(f"%{nombre}%"))
+    # Mismos parámetros y ninguna escritura desde entonces: mismo resultado
+    etag = strong_etag('buscar', version_datos(FichaMedica.__tablename__), request.query_string)
+    respuesta = not_modified(etag)
+    if respuesta:
+        return respuesta
     
-    if apellido:
-        query = query.filter(FichaMedica.apellido.ilike(f"%{apellido}%"))
+    if nombre or apellido or q:
+        fichas = buscar_fichas(nombre, apellido, q, limit + 1, offset)
+    else:
+        # Sin criterios se devuelve el listado paginado por ID
+        fichas = db.session.query(*COLUMNAS_FICHA).order_by(FichaMedica.id).offset(offset).limit(limit + 1).all()
     
-    fichas = query.all()
+    next_cursor = encode_offset(offset + limit) if len(fichas) > limit else None
     
-    return jsonify({"status": "success", "fichas": [ficha.to_dict() for ficha in fichas]})
+    return tag_response(json_response({
+        "status": "success",
+        "fichas": [fila_a_dict(ficha) for ficha in fichas[:limit]],
+        "next_cursor": next_cursor
+    }), etag)
 
 @app.route('/api/qr/<ficha_id>')
 @limiter.limit("60 per minute")
 def generate_qr(ficha_id):
     """Genera un código QR para la ficha médica."""
-    ficha = FichaMedica.query.get(ficha_id)
-    if not ficha:
+    # Sólo comprobamos que la ficha exista; no hace falta cargar la fila completa
+    if not db.session.query(FichaMedica.id).filter_by(id=ficha_id).first():
         abort(404, description="Ficha médica no encontrada")
     
-    # Crear la URL completa a la que apuntará el QR (frontend)
-    qr_data = f"motosegura.online/ficha/{ficha_id}"
+    # La imagen sale de la caché (memoria o disco) o se responde 304 si el cliente ya la tiene
+    return qr_png_response(qr_data_for(ficha_id))
+
+@app.route('/api/qr/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+def generate_qr_batch():
+    """
+    Genera los QR de varias fichas en una sola petición (requiere API key).
+    
+    Acepta `ids` (lista de IDs) o un filtro `nombre`/`apellido`, y `formato`
+    (pdf, png o zip). Devuelve una hoja imprimible o un zip con los QR.
+    """
+    verificar_api_key()
+    data = request.json or {}
     
-    # Generar el código QR
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(qr_data)
-    qr.make(fit=True)
+    formato = data.get('formato', 'pdf')
+    if formato not in BATCH_FORMATS:
+        abort(400, description=f"Formato no soportado. Use uno de: {', '.join(BATCH_FORMATS)}")
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            abort(400, description="ids debe ser una lista de IDs")
+        ids = list(dict.fromkeys(ids))
+        # El límite se comprueba antes de consultar para no cargar un IN arbitrariamente grande
+        if len(ids) > QR_BATCH_MAX:
+            abort(400, description=f"Máximo {QR_BATCH_MAX} fichas por lote")
+        encontradas = {ficha.id: ficha for ficha in FichaMedica.query.filter(FichaMedica.id.in_(ids))}
+        faltantes = [i for i in ids if i not in encontradas]
+        if faltantes:
+            abort(404, description=f"Fichas no encontradas: {', '.join(faltantes)}")
+        fichas = [encontradas[i] for i in ids]
+    elif data.get('nombre') or data.get('apellido'):
+        fichas = buscar_fichas(data.get('nombre', ''), data.get('apellido', ''), limit=QR_BATCH_MAX + 1)
+    else:
+        abort(400, description="Se requiere una lista de ids o un filtro por nombre/apellido")
     
-    # Convertir la imagen a bytes para enviarla
-    img_io = BytesIO()
-    img.save(img_io, 'PNG')
-    img_io.seek(0)
+    if not fichas:
+        abort(404, description="Ninguna ficha coincide con el filtro")
+    if len(fichas) > QR_BATCH_MAX:
+        abort(400, description=f"Máximo {QR_BATCH_MAX} fichas por lote")
     
-    return send_file(img_io, mimetype='image/png')
+    contenido, mimetype, extension = construir_lote_qr(fichas, formato)
+    return send_file(BytesIO(contenido), mimetype=mimetype, as_attachment=True,
+                     download_name=f"qr-fichas.{extension}")
 
 @app.route('/api/upload_photo/<ficha_id>', methods=['POST'])
 @limiter.limit("5 per minute")  # Restrictivo para subida de archivos
@@ -456,14 +1289,34 @@ def upload_photo(ficha_id):
     if not ficha:
         abort(404, description="Ficha médica no encontrada")
     
-    # Guardar archivo con nombre persistente vinculado al ID de la ficha
-    filename = f"{ficha_id}.jpg"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
+    # Nombre con el hash del contenido (<id>_<md5>.jpg): la foto nueva no sobrescribe la anterior,
+    # que se borra tras el commit, y el archivo se sirve como inmutable
+    carpeta = app.config['UPLOAD_FOLDER']
+    with timed('image_save'):
+        fd, tmp_path = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+        digest = hashlib.md5()
+        try:
+            with os.fdopen(fd, 'wb') as destino:
+                for bloque in iter(lambda: file.stream.read(1024 * 1024), b''):
+                    digest.update(bloque)
+                    destino.write(bloque)
+            os.chmod(tmp_path, 0o644)
+            filename = f"{ficha_id}_{digest.hexdigest()}.jpg"
+            filepath = os.path.join(carpeta, filename)
+            # Si ya existía tiene el mismo contenido; reemplazarlo renueva su fecha ante la limpieza de huérfanos
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    get_upload_index(app, lambda: [carpeta]).register(filepath)
     
     # Actualizar la ficha médica con la nueva foto
+    anterior = ficha.foto_url
     ficha.foto_url = filename
     db.session.commit()
+    fichas_modificadas(ficha_id)
+    if anterior != filename:
+        liberar_fotos(anterior)
     
     return jsonify({
         "status": "success", 
@@ -472,10 +1325,24 @@ def upload_photo(ficha_id):
         "ficha": ficha.to_dict()
     })
 
+@app.route('/snapshots/<name>')
+@limiter.exempt  # archivos estáticos: no tocan la base de datos
+def get_snapshot(name):
+    """Instantánea de emergencia de una ficha (`<id>.html` o `<id>.json`), sin consultar la base de datos."""
+    response = ficha_snapshots.send(name)
+    if response is None:
+        abort(404, description="Instantánea no encontrada")
+    return response
+
 @app.route('/uploads/<filename>')
 def get_uploaded_file(filename):
-    """Obtener una foto subida."""
-    return send_file(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    """Obtener una foto subida (con Range, ETag y envío delegado opcional)."""
+    index = get_upload_index(app, lambda: [app.config['UPLOAD_FOLDER']])
+    response = send_upload(index, filename, app.config['UPLOAD_OFFLOAD'] or None,
+                           app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/'))
+    if response is None:
+        abort(404, description="Archivo no encontrado")
+    return response
 
 @app.errorhandler(404)
 def resource_not_found(e):
@@ -489,6 +1356,10 @@ def bad_request(e):
 def forbidden(e):
     return jsonify(error=str(e)), 403
 
+@app.errorhandler(410)
+def gone(e):
+    return jsonify(error=str(e)), 410
+
 @app.errorhandler(429)
 def ratelimit_handler(e):
     """Manejar excesos de rate limit con un mensaje claro"""
@@ -502,6 +1373,133 @@ def ratelimit_handler(e):
         "reset": getattr(e, 'reset_at', None)
     }), 429
 
+@app.cli.command('qr-sheet')
+@click.option('--ids', default='', help='IDs de ficha separados por comas')
+@click.option('--nombre', default='', help='Filtrar por nombre')
+@click.option('--apellido', default='', help='Filtrar por apellido')
+@click.option('--limit', type=int, default=10000, help='Máximo de fichas cuando se usa un filtro')
+@click.option('--formato', type=click.Choice(list(BATCH_FORMATS)), default='pdf')
+@click.option('--workers', type=int, default=None, help='Procesos de render (por defecto, uno por núcleo)')
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False, writable=True))
+def qr_sheet_command(ids, nombre, apellido, limit, formato, workers, output):
+    """Genera una hoja imprimible (o zip) con los QR de varias fichas."""
+    if ids:
+        lista = [i.strip() for i in ids.split(',') if i.strip()]
+        fichas = FichaMedica.query.filter(FichaMedica.id.in_(lista)).order_by(FichaMedica.id).all()
+    elif nombre or apellido:
+        fichas = buscar_fichas(nombre, apellido, limit=limit)
+    else:
+        raise click.UsageError("Indique --ids o un filtro --nombre/--apellido")
+    
+    if not fichas:
+        raise click.ClickException("Ninguna ficha coincide con el filtro")
+    
+    contenido, _, _ = construir_lote_qr(fichas, formato, workers)
+    with open(output, 'wb') as f:
+        f.write(contenido)
+    click.echo(f"{len(fichas)} códigos QR escritos en {output}")
+
+@app.cli.command('init')
+def init_command():
+    """Aplica las migraciones y crea el índice de búsqueda (una vez, antes de arrancar los workers)."""
+    init_db()
+    click.echo("Base de datos inicializada")
+
+@app.cli.command('search-reindex')
+def search_reindex_command():
+    """Reconstruye el índice de búsqueda de fichas desde cero."""
+    backend = ficha_search.rebuild(db.engine)
+    click.echo(f"Índice de búsqueda reconstruido ({backend})")
+
+@app.cli.command('export-fichas')
+@click.option('--formato', type=click.Choice(FORMATS), default=None, help='Por defecto, según la extensión de --output')
+@click.option('--usuarios', is_flag=True, help='Incluir los vínculos con usuarios')
+@click.option('--output', '-o', type=click.File('wb'), default='-')
+def export_fichas_command(formato, usuarios, output):
+    """Exporta todas las fichas en CSV o NDJSON, en streaming."""
+    formato = parse_format(formato, output.name)
+    campos = CAMPOS_EXPORTACION_USUARIOS if usuarios else CAMPOS_EXPORTACION
+    for fragmento in export_chunks(exportar_fichas(usuarios), campos, formato):
+        output.write(fragmento)
+
+def compactar_eliminadas(antes):
+    """
+    Borra del registro de eliminaciones las anteriores a `antes`.
+    
+    El horizonte avanza hasta la secuencia más alta borrada: los tokens de
+    /api/fichas/changes anteriores a él responden 410.
+    
+    Returns:
+        int: entradas borradas
+    """
+    tabla = FichaEliminada.__table__
+    with db.engine.begin() as connection:
+        horizonte = connection.scalar(select(func.max(tabla.c.change_seq)).where(tabla.c.deleted_at < antes))
+        if horizonte is None:
+            return 0
+        borradas = connection.execute(delete(tabla).where(tabla.c.change_seq <= horizonte)).rowcount
+        # Las entradas hasta el horizonte anterior ya no existen: el nuevo siempre es mayor
+        tabla_versiones = DataVersion.__table__
+        if not connection.execute(update(tabla_versiones).where(tabla_versiones.c.name == HORIZONTE_ELIMINADAS)
+                                  .values(version=horizonte)).rowcount:
+            connection.execute(insert(tabla_versiones).values(name=HORIZONTE_ELIMINADAS, version=horizonte))
+    return borradas
+
+@app.cli.command('compact-changes')
+@click.option('--dias', type=click.IntRange(min=0), default=int(os.environ.get('CHANGES_RETENTION_DAYS', '30')),
+              show_default=True, help='Días que se conservan las eliminaciones para /api/fichas/changes.')
+def compact_changes_command(dias):
+    """Compacta el registro de fichas eliminadas de la sincronización incremental."""
+    borradas = compactar_eliminadas(datetime.utcnow() - timedelta(days=dias))
+    click.echo(f"{borradas} eliminaciones compactadas (horizonte: {version_datos(HORIZONTE_ELIMINADAS)})")
+
+@app.cli.command('import-fichas')
+@click.argument('entrada', type=click.File('rb'))
+@click.option('--formato', type=click.Choice(FORMATS), default=None, help='Por defecto, según la extensión')
+@click.option('--batch-size', type=click.IntRange(1, MAX_IMPORT_BATCH_SIZE), default=IMPORT_BATCH_SIZE)
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='Archivo de progreso (por defecto, <entrada>.checkpoint)')
+def import_fichas_command(entrada, formato, batch_size, checkpoint):
+    """
+    Importa fichas desde un archivo CSV o NDJSON (o - para la entrada estándar).
+    
+    Tras cada lote se guarda el progreso; si se interrumpe, volver a
+    ejecutar el mismo comando continúa desde el último lote confirmado.
+    """
+    formato = parse_format(formato, entrada.name)
+    if checkpoint is None and entrada.name != '<stdin>':
+        checkpoint = f"{entrada.name}.checkpoint"
+    progreso = Checkpoint(checkpoint, os.path.abspath(entrada.name))
+    inicio = progreso.load().rows
+    if inicio:
+        click.echo(f"Reanudando tras la fila {inicio} ({checkpoint})", err=True)
+    resultado = import_stream(entrada, formato, preparar_ficha_importada, escribir_lote_fichas,
+                              batch_size, progreso)
+    for error in resultado.errors:
+        click.echo(f"Fila {error['row']}: {error['error']}", err=True)
+    click.echo(f"{resultado.rows} filas: {resultado.inserted} insertadas, {resultado.skipped} ya existían, "
+               f"{resultado.invalid} no válidas")
+
+def tras_restaurar_ficha(ficha_id):
+    """Invalida la caché y registra el cambio (contador y `change_seq`) tras restaurar una ficha desde una copia"""
+    with db.engine.begin() as connection:
+        seq = incrementar_version_datos(connection, FichaMedica.__tablename__)
+        connection.execute(update(FichaMedica.__table__).where(FichaMedica.__table__.c.id == ficha_id)
+                           .values(change_seq=seq))
+    fichas_modificadas(ficha_id)
+
+# `flask snapshots build` (SNAPSHOT_FOLDER)
+app.cli.add_command(snapshot_cli(ficha_snapshots))
+
+# `flask backup create|list|restore-record|restore|prune` (BACKUP_DIR)
+app.cli.add_command(backup_cli(db, FichaMedica.__table__, lambda: {'uploads': app.config['UPLOAD_FOLDER']},
+                               image_column='foto_url', related=[UserRecord.__table__.c.record_id],
+                               after_restore=tras_restaurar_ficha))
+
+# `flask uploads gc`: fotos huérfanas y enlaces rotos
+app.cli.add_command(upload_gc_cli(db, FichaMedica.id, FichaMedica.foto_url,
+                                  lambda: {'uploads': app.config['UPLOAD_FOLDER']}))
+
 if __name__ == '__main__':
     # Configuración para producción vs desarrollo
     DEBUG_MODE = os.environ.get('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
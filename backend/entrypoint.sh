@@ -14,14 +14,12 @@ while ! nc -z db 5432; do
 done
 echo "PostgreSQL started"
 
-# Initialize the application
-python -c "
-from app import create_app
-app = create_app()
-with app.app_context():
-    from app.models import db
-    db.create_all()
-"
+# Initialize the application (tablas, carpetas e imagen por defecto, una sola vez)
+flask --app wsgi init
+
+# Topología de gunicorn (también dimensiona el pool de conexiones de PostgreSQL)
+export GUNICORN_WORKERS="${GUNICORN_WORKERS:-2}"
+export GUNICORN_THREADS="${GUNICORN_THREADS:-4}"
 
 # Start the application
-exec gunicorn --workers=2 --threads=4 --timeout=30 --bind=0.0.0.0:5000 "app:app" 
\ No newline at end of file
+exec gunicorn --workers="$GUNICORN_WORKERS" --threads="$GUNICORN_THREADS" --timeout=30 --bind=0.0.0.0:5000 "wsgi:application" 
\ No newline at end of file
@@ -0,0 +1,34 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def debug_app(tmp_path_factory):
+    """Módulo `debug_app` con una base de datos y carpetas temporales"""
+    workdir = tmp_path_factory.mktemp('motosegura')
+    folders = {name: workdir / name for name in ('uploads', 'persistent', 'qr', 'records', 'metrics')}
+    for folder in folders.values():
+        folder.mkdir()
+    os.environ.update({
+        'DATABASE_URI': f"sqlite:///{workdir / 'test.db'}",
+        'UPLOAD_FOLDER': str(folders['uploads']),
+        'PERSISTENT_UPLOAD_FOLDER': str(folders['persistent']),
+        'QR_CACHE_DIR': str(folders['qr']),
+        'RECORD_CACHE_DIR': str(folders['records']),
+        'METRICS_DIR': str(folders['metrics']),
+        'RATELIMIT_STORAGE_URI': 'memory://',
+        'RATELIMIT_ENABLED': 'false',
+    })
+    module = importlib.import_module('debug_app')
+    module.init_db()
+    return module
+
+
+@pytest.fixture
+def client(debug_app):
+    return debug_app.app.test_client()
@@ -0,0 +1,107 @@
+"""
+Número de consultas SQL por petición.
+
+Cada endpoint debe ejecutar las mismas sentencias con pocas filas que con
+muchas: un N+1 (una consulta por ficha o por relación) hace crecer la
+cuenta con los datos y rompe estas pruebas.
+"""
+import itertools
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, insert
+
+SIZES = (3, 60)
+
+_ids = itertools.count()
+
+
+@contextmanager
+def count_queries(engine):
+    """Cuenta las sentencias que se ejecutan en `engine` dentro del bloque"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed_user(debug_app, fichas):
+    """Crea un usuario con `fichas` fichas asociadas; devuelve (user_id, IDs de las fichas)"""
+    db = debug_app.db
+    n = next(_ids)
+    with debug_app.app.app_context():
+        ids = debug_app.generar_ids_unicos(fichas)
+        db.session.execute(insert(debug_app.FichaMedica), [{
+            'id': ficha_id, 'nombre': 'Ana', 'apellido': 'García', 'tipo_sangre': 'O+',
+            'contacto_emergencia': 'Luis García', 'numero_contacto': '+34 600000000',
+            'fecha_registro': '2024-01-01',
+        } for ficha_id in ids])
+        user = debug_app.User(username=f"user{n}", password='secret', name=f"User {n}",
+                              email=f"user{n}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        db.session.execute(insert(debug_app.UserRecord), [
+            {'user_id': user.id, 'record_id': ficha_id, 'created_at': '2024-01-01'} for ficha_id in ids
+        ])
+        db.session.commit()
+        return user.id, ids
+
+
+def token_for(debug_app, user_id):
+    import jwt
+
+    return jwt.encode({'user_id': user_id}, debug_app.JWT_SECRET, algorithm='HS256')
+
+
+def request_queries(debug_app, client, url, **kwargs):
+    """Sentencias que ejecuta la petición GET, con las cachés de usuarios y fichas vacías"""
+    debug_app.user_cache.clear()
+    debug_app.token_cache.clear()
+    with debug_app.app.app_context():
+        engine = debug_app.db.engine
+    with count_queries(engine) as statements:
+        response = client.get(url, **kwargs)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return len(statements)
+
+
+def queries_by_size(debug_app, client, url_for):
+    """Consultas de la petición `url_for(user_id, ids)` para cada tamaño de `SIZES`"""
+    counts = []
+    for size in SIZES:
+        user_id, ids = seed_user(debug_app, size)
+        url, headers = url_for(user_id, ids)
+        debug_app.ficha_cache.invalidate(*ids)
+        counts.append(request_queries(debug_app, client, url, headers=headers))
+    return counts
+
+
+@pytest.mark.parametrize('query', ['', '?limit=100', '?format=ndjson', '?stream=1'])
+def test_get_fichas(debug_app, client, query):
+    counts = queries_by_size(debug_app, client, lambda user_id, ids: (f"/api/fichas{query}", {}))
+    assert counts[0] == counts[1]
+
+
+def test_get_ficha_scan(debug_app, client):
+    # El QR de una ficha abre su URL, que consulta /api/fichas/<id>
+    counts = queries_by_size(debug_app, client, lambda user_id, ids: (f"/api/fichas/{ids[-1]}", {}))
+    assert counts[0] == counts[1] == 1
+
+
+def test_cargar_usuario(debug_app, client):
+    counts = queries_by_size(debug_app, client, lambda user_id, ids: (
+        '/api/auth/me', {'Authorization': f"Bearer {token_for(debug_app, user_id)}"}))
+    assert counts[0] == counts[1] == 1
+
+
+@pytest.mark.parametrize('query', ['', '?limit=20'])
+def test_get_user_records(debug_app, client, query):
+    counts = queries_by_size(debug_app, client, lambda user_id, ids: (
+        f"/api/records/user{query}", {'Authorization': f"Bearer {token_for(debug_app, user_id)}"}))
+    assert counts[0] == counts[1]
@@ -1,6 +1,8 @@
-from app import create_app
+from app import create_app, init_app_data
 
 application = create_app()
  
 if __name__ == "__main__":
+    # En el servidor de desarrollo no hay un `flask init` previo
+    init_app_data(application)
     application.run() 
\ No newline at end of file
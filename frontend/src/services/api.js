@@ -147,6 +147,30 @@ export const ApiService = {
     }
   },
 
+  // Obtener una página de fichas usando paginación por cursor
+  getFichasPage: async (limit = 100, cursor = null) => {
+    try {
+      const params = { limit };
+      if (cursor) {
+        params.cursor = cursor;
+      }
+      const response = await api.get('/api/fichas', { params });
+
+      if (response.data && Array.isArray(response.data.fichas)) {
+        return {
+          fichas: response.data.fichas,
+          nextCursor: response.data.next_cursor || null
+        };
+      }
+
+      console.error('Respuesta inválida de getFichasPage:', response.data);
+      throw new Error('La respuesta del servidor no tiene el formato esperado');
+    } catch (error) {
+      console.error('Error getting fichas page:', error);
+      throw error;
+    }
+  },
+
   getFichaById: async (fichaId) => {
     try {
       const response = await api.get(`/api/fichas/${fichaId}`);
@@ -185,6 +209,17 @@ export const ApiService = {
     }
   },
 
+  // Crear varias fichas médicas en una sola petición
+  createManyFichas: async (fichasData, atomic = false) => {
+    try {
+      const response = await api.post('/api/fichas/bulk', { fichas: fichasData, atomic });
+      return response.data;
+    } catch (error) {
+      console.error('Error creating multiple fichas:', error);
+      throw error;
+    }
+  },
+
   updateFicha: async (fichaId, fichaData) => {
     try {
       const response = await api.put(`/api/fichas/${fichaId}`, fichaData);
@@ -242,27 +277,23 @@ export const ApiService = {
         throw new Error('Se requiere una API key para eliminar fichas');
       }
       
-      const deletePromises = fichaIds.map(id => 
-        api.delete(`/api/fichas/${id}`, {
-          headers: {
-            'X-API-Key': apiKey
-          }
-        })
-      );
-      
-      const results = await Promise.allSettled(deletePromises);
-      
-      // Procesar resultados
-      const successful = results
-        .filter(result => result.status === 'fulfilled')
-        .map(result => result.value.data);
+      // Una sola petición y una sola transacción para todo el lote
+      const response = await api.delete('/api/fichas/bulk', {
+        data: { ids: fichaIds },
+        headers: {
+          'X-API-Key': apiKey
+        }
+      });
       
+      // Procesar resultados por ficha
+      const results = response.data.results || [];
+      const successful = results.filter(result => result.status === 'deleted');
       const failed = results
-        .filter(result => result.status === 'rejected')
-        .map((result, index) => ({
-          id: fichaIds[index],
-          error: result.reason.message,
-          status: result.reason.response?.status
+        .filter(result => result.status === 'error')
+        .map(result => ({
+          id: result.id,
+          error: result.error,
+          status: 404
         }));
       
       return {
@@ -87,6 +87,7 @@ fi
 echo -e "${YELLOW}Configurando directorios persistentes...${NC}"
 sudo mkdir -p /data/motosegura/uploads
 sudo mkdir -p /data/motosegura/db
+sudo mkdir -p /data/motosegura/snapshots
 sudo chown -R $USER:$USER /data/motosegura
 echo -e "${GREEN}Directorios persistentes creados en /data/motosegura${NC}"
 
@@ -108,6 +109,7 @@ FLASK_HOST=0.0.0.0
 FLASK_PORT=5000
 UPLOAD_FOLDER=/data/motosegura/uploads
 PERSISTENT_UPLOAD_FOLDER=/data/motosegura/uploads
+SNAPSHOT_FOLDER=/data/motosegura/snapshots
 EOL
   echo -e "${GREEN}Archivo .env creado${NC}"
 else
@@ -148,9 +150,36 @@ TimeoutStartSec=0
 WantedBy=multi-user.target
 EOF
 
+# Limpieza diaria de fotos huérfanas (fotos sustituidas o de fichas eliminadas)
+sudo tee /etc/systemd/system/motosegura-uploads-gc.service > /dev/null << EOF
+[Unit]
+Description=MotoSegura - limpieza de fotos huérfanas
+Requires=motosegura.service
+After=motosegura.service
+
+[Service]
+Type=oneshot
+WorkingDirectory=$BASEDIR
+ExecStart=/usr/bin/docker-compose exec -T web flask --app debug_app uploads gc
+EOF
+
+sudo tee /etc/systemd/system/motosegura-uploads-gc.timer > /dev/null << EOF
+[Unit]
+Description=MotoSegura - limpieza diaria de fotos huérfanas
+
+[Timer]
+OnCalendar=*-*-* 04:30:00
+RandomizedDelaySec=15min
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+EOF
+
 # Recargar servicios de systemd
 sudo systemctl daemon-reload
 sudo systemctl enable motosegura.service
+sudo systemctl enable --now motosegura-uploads-gc.timer
 echo -e "${GREEN}Servicio systemd configurado y habilitado${NC}"
 
 # 7. Construir y levantar contenedores
@@ -206,6 +235,12 @@ server {
         expires 30d;
         add_header Cache-Control "public, max-age=2592000";
     }
+
+    # Instantáneas de emergencia: archivos estáticos, responden aunque la base de datos no lo haga
+    location /snapshots {
+        alias /data/motosegura/snapshots;
+        add_header Cache-Control "no-cache";
+    }
 }
 EOF
 